@@ -1,6 +1,8 @@
 # coding: utf-8
 """配置管理"""
 
+import os
+
 from pydantic_settings import BaseSettings
 from typing import Optional
 
@@ -12,6 +14,11 @@ class Settings(BaseSettings):
     APP_NAME: str = "xclub"
     DEBUG: bool = True
     
+    # 日志配置
+    LOG_FILE: str = ""              # 日志文件，为空只输出到控制台
+    LOG_SAMPLE_RATES: str = ""      # 按 logger 采样 INFO 及以下日志，例如 app.services=0.2,app.routers=0.5
+    LOG_QUEUE_SIZE: int = 10000     # 日志队列长度，满了丢弃
+
     # 微信小程序配置
     WECHAT_APPID: str = ""
     WECHAT_SECRET: str = ""
@@ -26,8 +33,44 @@ class Settings(BaseSettings):
     
     # Session 配置
     SESSION_EXPIRE_SECONDS: int = 86400 * 7  # 7 天过期
+    SESSION_STORE: str = "mysql"     # session 存储: mysql / memory / redis
+    SESSION_MODE: str = "opaque"     # opaque: 随机 session_id 查库; signed: HMAC 签名 token
+    SESSION_SECRET: str = ""         # signed 模式的签名密钥，同时用于 session_id 的 HMAC 标签，多进程/多节点需一致
+    SESSION_REVOCATION_REFRESH: int = 30  # signed 模式从 session 存储刷新吊销过滤的间隔秒数
+    SESSION_CACHE_SIZE: int = 10000  # 进程内 session 缓存条数
+    SESSION_CACHE_TTL: int = 60      # 进程内 session 缓存秒数 (多进程部署时其他进程的退出最多延迟这么久生效)
+    SESSION_TOUCH_INTERVAL: int = 3600  # 滑动过期: 使用中的 session 距上次续期超过该秒数时延长有效期，0 关闭 (仅 opaque 模式)
+    SESSION_TOUCH_FLUSH_SECONDS: int = 10  # 续期合并写入的间隔秒数
+    SESSION_SHM_PATH: str = ""      # 多 worker 共享的 session 表文件，例如 /dev/shm/xclub_session，为空不使用
+    SESSION_SHM_SLOTS: int = 16384  # 共享 session 表槽数
+    SESSION_SHM_SLOT_SIZE: int = 512  # 每个槽的字节数，放不下的 session 不进入共享表
+    SESSION_BLOOM_ENABLED: bool = True  # 用布隆过滤器拦截不存在的 session_id，不查库
+    SESSION_BLOOM_CAPACITY: int = 200000  # 布隆过滤器预计容量，按实际 session 数的 2 倍自动扩大
+    SESSION_BLOOM_ERROR_RATE: float = 0.01  # 布隆过滤器误判率
+    SESSION_BLOOM_REBUILD_SECONDS: int = 600  # 布隆过滤器重建间隔秒数
+    USER_CACHE_SIZE: int = 10000     # 进程内用户资料缓存条数
+    USER_CACHE_TTL: int = 60         # 用户资料缓存秒数
+    USER_CACHE_NEGATIVE_TTL: int = 10  # 不存在的 openid 缓存秒数
+    USER_SEARCH_ENABLED: bool = True  # 启动时建立用户昵称 / 姓名 / 手机号的进程内搜索索引
+    CACHE_SNAPSHOT_FILE: str = ""   # 关闭时把进程内缓存写入该文件，启动时恢复，为空不使用
+    SESSION_REAPER_INTERVAL: int = 300  # 后台清理过期 session 的间隔秒数，0 不清理
+    SESSION_REAPER_CHUNK: int = 500  # 每批删除的条数
+    SESSION_REAPER_PAUSE_MS: int = 100  # 每批之间暂停的毫秒数
+    CACHE_BUS: str = ""             # 缓存失效广播: udp (需配置 SESSION_SECRET) / unix / mysql，为空不广播 (只清理本进程缓存)
+    CACHE_BUS_ADDR: str = ""        # udp 为 组播地址:端口 (默认 239.255.0.1:9901)，unix 为 socket 目录 (默认 /tmp/xclub-bus)
+    CACHE_BUS_POLL_MS: int = 200    # mysql 方式轮询间隔毫秒数
+    
+    # Redis 配置 (SESSION_STORE=redis)
+    REDIS_HOST: str = "127.0.0.1"
+    REDIS_PORT: int = 6379
+    REDIS_DB: int = 0
+    REDIS_PASSWORD: str = ""
+    REDIS_PREFIX: str = "xclub:"
+    REDIS_POOL_SIZE: int = 10
     
     # 数据库配置
+    DB_ENGINE: str = "pymysql"      # pymysql / mysql / sqlite
+    DB_SQLITE_PATH: str = "xclub.db"  # sqlite 引擎使用的数据库文件
     DB_HOST: str = "127.0.0.1"
     DB_PORT: int = 3306
     DB_USER: str = "root"
@@ -35,6 +78,14 @@ class Settings(BaseSettings):
     DB_NAME: str = "xclub"
     DB_CHARSET: str = "utf8mb4"
     DB_POOL_SIZE: int = 10
+    DB_MULTI_STATEMENTS: bool = False  # 开启 CLIENT_MULTI_STATEMENTS，pipeline 一次发送多条语句；关闭时逐条执行
+    DB_LOG_SAMPLE_RATE: float = 0.1  # 单条 sql 日志采样率，出错和慢查询总是记录
+    DB_LOG_SLOW_MS: int = 200       # 慢查询阈值 (毫秒)
+    SQL_STATS_ENABLED: bool = True  # 按 sql 指纹聚合统计
+    SQL_STATS_FLUSH_SECONDS: int = 60  # 统计汇总日志间隔
+    DB_CAPTURE_FILE: str = ""       # 采集 sql 流到该文件用于回放压测，为空不采集
+    DB_CAPTURE_LIMIT: int = 1000000  # 最多采集的 sql 条数
+    DB_QUERY_BUDGET: int = 4        # 单个请求的 sql 条数预算，超过记录 warning
     
     class Config:
         env_file = ".env"
@@ -56,5 +107,18 @@ DATABASE = {
         'charset': settings.DB_CHARSET,
         'conn': settings.DB_POOL_SIZE,
         'idle_timeout': 60,
+        # 允许 pipeline 一次发送多条语句 (同时也允许拼接的 sql 执行堆叠语句，默认关闭)
+        'multi_statements': settings.DB_MULTI_STATEMENTS,
     }
 }
+
+if settings.DB_ENGINE == 'sqlite':
+    # 嵌入式 SQLite，表结构见 docs/init_sqlite.sql，已有库的结构变更见 docs/upgrade_sqlite.sql
+    DATABASE['xclub'] = {
+        'engine': 'sqlite',
+        'db': settings.DB_SQLITE_PATH,
+        'init_sql': os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'docs', 'init_sqlite.sql'),
+        'upgrade_sql': os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'docs', 'upgrade_sqlite.sql'),
+        'conn': settings.DB_POOL_SIZE,
+        'idle_timeout': 60,
+    }
@@ -0,0 +1,76 @@
+# coding: utf-8
+"""计数布隆过滤器
+
+每个位置是一个 8 位计数器 (饱和于 255，饱和后不再减少)，支持删除。
+判断为不存在的一定不存在，判断为存在的有 error_rate 的概率误判。
+"""
+
+import hashlib
+import math
+import threading
+from typing import Any, Dict, Iterable
+
+
+class CountingBloomFilter:
+    """
+    Args:
+        capacity: 预计元素数量
+        error_rate: 元素数量达到 capacity 时的误判率
+    """
+
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.01):
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.counters = bytearray(self.size)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def _positions(self, key: str):
+        # 双重哈希: h1 + i * h2
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key: str):
+        positions = self._positions(key)
+        with self.lock:
+            for i in positions:
+                if self.counters[i] < 255:
+                    self.counters[i] += 1
+            self.count += 1
+
+    def update(self, keys: Iterable[str]):
+        for key in keys:
+            self.add(key)
+
+    def remove(self, key: str) -> bool:
+        """删除，只有判断为存在时才修改计数器"""
+        positions = self._positions(key)
+        with self.lock:
+            if not all(self.counters[i] for i in positions):
+                return False
+            for i in positions:
+                if self.counters[i] < 255:
+                    self.counters[i] -= 1
+            self.count -= 1
+        return True
+
+    def __contains__(self, key: str) -> bool:
+        counters = self.counters
+        return all(counters[i] for i in self._positions(key))
+
+    def __len__(self):
+        return self.count
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'capacity': self.capacity,
+            'count': self.count,
+            'size': self.size,
+            'hashes': self.hashes,
+            'error_rate': self.error_rate,
+        }
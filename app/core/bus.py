@@ -0,0 +1,382 @@
+# coding: utf-8
+"""缓存失效广播
+
+修改数据的进程先清理自己的缓存，再 publish(表, 字段, 值)；其他 worker / 节点收到后
+调用该表的订阅回调清理各自的进程内缓存。每个进程有一个 origin，收到自己发出的事件时忽略。
+
+传输方式由 settings.CACHE_BUS 选择:
+    - udp: UDP 组播，同一网段的多台机器，事件用 SESSION_SECRET 签名
+    - unix: 目录下每个进程一个 unix datagram socket，同一台机器
+    - mysql: cache_invalidation 变更表，按自增 id 高水位轮询，跨机器且不依赖网络组播
+    - 空: 不广播，只有本进程的缓存会被清理
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import socket
+import struct
+import threading
+import time
+import uuid
+import logging
+import traceback
+from typing import Any, Callable, Dict, List
+
+from app.db import get_connection
+
+log = logging.getLogger(__name__)
+
+ORIGIN = uuid.uuid4().hex[:16]
+
+
+class Transport:
+    """传输接口: send 发送事件字典，start 之后收到的事件 (json bytes 或字典) 交给 on_message"""
+
+    def start(self, on_message: Callable[[Any], None]):
+        pass
+
+    def send(self, event: dict):
+        pass
+
+    def stop(self):
+        pass
+
+
+def _encode(event: dict) -> bytes:
+    return json.dumps(event, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class _ReceiverThread:
+    """阻塞接收的后台线程"""
+
+    _running = False
+
+    def _start_receiver(self, name, recv, on_message):
+        self._running = True
+
+        def run():
+            while self._running:
+                try:
+                    data = recv()
+                except socket.timeout:
+                    continue
+                except OSError:
+                    if self._running:
+                        log.error(traceback.format_exc())
+                        time.sleep(1)
+                    continue
+                try:
+                    on_message(data)
+                except Exception:
+                    log.error(traceback.format_exc())
+
+        self._thread = threading.Thread(target=run, name=name, daemon=True)
+        self._thread.start()
+
+
+class UDPMulticastTransport(Transport, _ReceiverThread):
+    """UDP 组播
+
+    任何能向组播地址发包的机器都能发送事件，每个数据报前面带 16 字节的 HMAC 标签，
+    标签不对的丢弃并计数
+
+    Args:
+        group: 组播地址，例如 239.255.0.1
+        port: 端口
+        secret: 签名密钥，所有进程需一致
+        ttl: 组播 TTL，1 为只在本网段
+    """
+
+    TAG_SIZE = 16
+
+    def __init__(self, group: str = '239.255.0.1', port: int = 9901, secret: str = '', ttl: int = 1):
+        if not secret:
+            raise ValueError('udp 广播需要签名密钥')
+        self.group = group
+        self.port = port
+        self.key = hashlib.sha256(b'bus:' + secret.encode('utf-8')).digest()
+        self.rejected = 0
+        self.sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.sender.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self.sender.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        self.receiver = None
+
+    def start(self, on_message):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(('', self.port))
+        mreq = struct.pack('4sl', socket.inet_aton(self.group), socket.INADDR_ANY)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        sock.settimeout(1)
+        self.receiver = sock
+
+        def receive(data):
+            payload = self.verify(data)
+            if payload is None:
+                self.rejected += 1
+                log.warning('func=bus_recv|transport=udp|bad signature, dropped')
+                return
+            on_message(payload)
+
+        self._start_receiver('bus-udp', lambda: sock.recv(65536), receive)
+
+    def tag(self, payload: bytes) -> bytes:
+        return hmac.new(self.key, payload, hashlib.sha256).digest()[:self.TAG_SIZE]
+
+    def verify(self, data: bytes):
+        """返回去掉标签的事件，签名不对返回 None"""
+        payload = data[self.TAG_SIZE:]
+        if not hmac.compare_digest(data[:self.TAG_SIZE], self.tag(payload)):
+            return None
+        return payload
+
+    def send(self, event):
+        payload = _encode(event)
+        self.sender.sendto(self.tag(payload) + payload, (self.group, self.port))
+
+    def stop(self):
+        self._running = False
+        if self.receiver:
+            self.receiver.close()
+
+
+class UnixSocketTransport(Transport, _ReceiverThread):
+    """同一台机器上的 unix datagram socket，每个进程在目录下绑定 <origin>.sock，发送给目录下所有 socket"""
+
+    def __init__(self, directory: str = '/tmp/xclub-bus'):
+        self.directory = directory
+        self.path = os.path.join(directory, ORIGIN + '.sock')
+        self.sock = None
+        self.sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sender.setblocking(False)
+        self._peers = []
+        self._peers_mtime = None
+
+    def start(self, on_message):
+        os.makedirs(self.directory, exist_ok=True)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(self.path)
+        sock.settimeout(1)
+        self.sock = sock
+        self._start_receiver('bus-unix', lambda: sock.recv(65536), on_message)
+
+    def peers(self) -> List[str]:
+        # 目录有 socket 增删时 mtime 变化，才重新列目录
+        mtime = os.stat(self.directory).st_mtime_ns
+        if mtime != self._peers_mtime:
+            self._peers = [os.path.join(self.directory, x) for x in os.listdir(self.directory)
+                           if x.endswith('.sock')]
+            self._peers_mtime = mtime
+        return self._peers
+
+    def send(self, event):
+        data = _encode(event)
+        for path in self.peers():
+            if path == self.path:
+                continue
+            try:
+                self.sender.sendto(data, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # 进程已退出，清理残留的 socket 文件
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            except BlockingIOError:
+                log.warning('func=bus_send|peer=%s|queue full, dropped', path)
+
+    def stop(self):
+        self._running = False
+        if self.sock:
+            self.sock.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+
+class MySQLTransport(Transport):
+    """cache_invalidation 变更表
+
+    发送只放入内存队列，由轮询线程每个间隔合并为一条多行 insert 写入 (请求线程不访问数据库)，
+    后台线程按 id > 高水位轮询新事件。并发插入时自增 id 的提交顺序
+    可能和大小不一致，每次多读高水位之前的 LOOKBACK 条，按 id 去重。
+    定期删除 retention 秒之前的事件 (分批，只在一个实例执行)
+
+    CREATE TABLE `cache_invalidation` (
+        `id` bigint NOT NULL AUTO_INCREMENT,
+        `tbl` varchar(64) NOT NULL COMMENT '表名',
+        `col` varchar(64) NOT NULL COMMENT '字段',
+        `val` varchar(128) NOT NULL COMMENT '值',
+        `origin` varchar(32) NOT NULL COMMENT '发出事件的进程',
+        `created_at` int(11) NOT NULL COMMENT '创建时间戳',
+        PRIMARY KEY (`id`),
+        KEY `idx_created_at` (`created_at`)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='缓存失效事件表';
+    """
+
+    TABLE = 'cache_invalidation'
+    LOOKBACK = 50
+    CLEANUP_LOCK = 'xclub:cache_invalidation_cleanup'
+
+    def __init__(self, db_name: str = 'xclub', interval: float = 0.2, retention: int = 3600):
+        self.db_name = db_name
+        self.interval = interval
+        self.retention = retention
+        self.hwm = 0
+        self.seen = set()
+        self.pending = []
+        self.pending_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, on_message):
+        with get_connection(self.db_name) as db:
+            row = db.select_one(self.TABLE, fields='max(id)', isdict=False)
+        self.hwm = (row and row[0]) or 0
+        # 启动前的事件不需要处理
+        self.seen = set(range(self.hwm - self.LOOKBACK + 1, self.hwm + 1))
+
+        def run():
+            last_cleanup = time.time()
+            while not self._stop.wait(self.interval):
+                try:
+                    self.flush()
+                    self.poll(on_message)
+                    if time.time() - last_cleanup > 60:
+                        last_cleanup = time.time()
+                        self.cleanup()
+                except Exception:
+                    log.error(traceback.format_exc())
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name='bus-mysql', daemon=True)
+        self._thread.start()
+
+    def poll(self, on_message):
+        with get_connection(self.db_name) as db:
+            rows = db.select(self.TABLE, where={'id': ('>', self.hwm - self.LOOKBACK)},
+                             fields=['id', 'tbl', 'col', 'val', 'origin'], other='order by id limit 1000')
+        for row in rows:
+            if row['id'] in self.seen or row['id'] <= self.hwm - self.LOOKBACK:
+                continue
+            self.seen.add(row['id'])
+            self.hwm = max(self.hwm, row['id'])
+            on_message({'o': row['origin'], 't': row['tbl'], 'c': row['col'], 'v': row['val']})
+        if len(self.seen) > self.LOOKBACK * 4:
+            self.seen = {x for x in self.seen if x > self.hwm - self.LOOKBACK}
+
+    def cleanup(self):
+        with get_connection(self.db_name) as db:
+            if not db.get_lock(self.CLEANUP_LOCK, 0):
+                return
+            try:
+                where = {'created_at': ('<', int(time.time()) - self.retention)}
+                while db.delete(self.TABLE, where=where, other='limit 1000') >= 1000:
+                    time.sleep(0.1)
+            finally:
+                db.release_lock(self.CLEANUP_LOCK)
+
+    def send(self, event):
+        row = {
+            'tbl': event['t'],
+            'col': event['c'],
+            'val': event['v'],
+            'origin': event['o'],
+            'created_at': int(time.time()),
+        }
+        with self.pending_lock:
+            self.pending.append(row)
+
+    def flush(self) -> int:
+        """写入队列中的事件，写入失败的放回队列下次重试"""
+        with self.pending_lock:
+            rows, self.pending = self.pending, []
+        if not rows:
+            return 0
+        try:
+            with get_connection(self.db_name) as db:
+                db.insert_list(self.TABLE, rows)
+        except Exception:
+            with self.pending_lock:
+                self.pending[:0] = rows
+            raise
+        return len(rows)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        try:
+            self.flush()
+        except Exception:
+            log.error(traceback.format_exc())
+
+
+class InvalidationBus:
+    def __init__(self):
+        self.subscribers: Dict[str, List[Callable[[str, str], None]]] = {}
+        self.transport = Transport()
+        self.sent = 0
+        self.received = 0
+
+    @property
+    def enabled(self) -> bool:
+        """是否有实际的传输，没有时其他进程的写入不会使本进程的缓存失效"""
+        return type(self.transport) is not Transport
+
+    def subscribe(self, table: str, callback: Callable[[str, str], None]):
+        """订阅表的失效事件，callback(字段, 值)"""
+        self.subscribers.setdefault(table, []).append(callback)
+
+    def publish(self, table: str, column: str, value):
+        """通知其他进程 table 中 column = value 的缓存已失效，发送失败只记录日志"""
+        try:
+            self.transport.send({'o': ORIGIN, 't': table, 'c': column, 'v': str(value)})
+            self.sent += 1
+        except Exception:
+            log.error(traceback.format_exc())
+
+    def on_message(self, data):
+        event = data if isinstance(data, dict) else json.loads(data)
+        if event.get('o') == ORIGIN:
+            return
+        self.received += 1
+        for callback in self.subscribers.get(event['t'], []):
+            try:
+                callback(event['c'], event['v'])
+            except Exception:
+                log.error(traceback.format_exc())
+
+    def start(self, transport: Transport):
+        self.transport = transport
+        transport.start(self.on_message)
+        log.info('func=bus_start|transport=%s|origin=%s', type(transport).__name__, ORIGIN)
+
+    def stop(self):
+        self.transport.stop()
+        self.transport = Transport()
+
+
+def create_transport(name: str, addr: str = '', poll_ms: int = 200, secret: str = '') -> Transport:
+    """按名称创建传输，addr: udp 为 组播地址:端口，unix 为目录；secret 为 udp 的签名密钥"""
+    if name == 'udp':
+        if not secret:
+            log.error('func=create_transport|udp 广播需要配置 SESSION_SECRET 签名事件，不广播')
+            return Transport()
+        group, _, port = (addr or '239.255.0.1:9901').partition(':')
+        return UDPMulticastTransport(group, int(port or 9901), secret)
+    if name == 'unix':
+        return UnixSocketTransport(addr or '/tmp/xclub-bus')
+    if name == 'mysql':
+        return MySQLTransport(interval=poll_ms / 1000.0)
+    return Transport()
+
+
+# 全局单例
+bus = InvalidationBus()
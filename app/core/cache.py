@@ -0,0 +1,132 @@
+# coding: utf-8
+"""进程内缓存"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+MISSING = object()
+
+
+class LRUCache:
+    """线程安全的 LRU + TTL 缓存
+
+    Args:
+        maxsize: 最大条数，超出淘汰最久未使用的
+        ttl: 默认过期秒数
+        name: 名称，用于统计输出
+        index: 可选，从 value 计算二级索引 (例如 openid)，支持按索引批量删除
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60, name: str = '',
+                 index: Optional[Callable[[Any], Hashable]] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self.index = index
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._index: Dict[Hashable, set] = {}
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def _unindex(self, key, value):
+        if self.index is None:
+            return
+        ikey = self.index(value)
+        keys = self._index.get(ikey)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._index[ikey]
+
+    def _remove(self, key):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self._unindex(key, item[1])
+        return item
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            if item[0] < time.time():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        expire = time.time() + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            self._remove(key)
+            self._data[key] = (expire, value)
+            if self.index is not None:
+                self._index.setdefault(self.index(value), set()).add(key)
+            while len(self._data) > self.maxsize:
+                old_key, old = self._data.popitem(last=False)
+                self._unindex(old_key, old[1])
+                self.evictions += 1
+
+    def pop(self, key: Hashable) -> Any:
+        with self.lock:
+            item = self._remove(key)
+        return None if item is None else item[1]
+
+    def pop_by_index(self, ikey: Hashable) -> List[Any]:
+        """删除二级索引等于 ikey 的所有条目，返回被删除的 value"""
+        with self.lock:
+            keys = self._index.pop(ikey, None)
+            if not keys:
+                return []
+            ret = []
+            for key in keys:
+                item = self._data.pop(key, None)
+                if item is not None:
+                    ret.append(item[1])
+            return ret
+
+    def get_by_index(self, ikey: Hashable) -> List[Any]:
+        """二级索引等于 ikey 的未过期 value (不计入命中统计，不改变 LRU 顺序)"""
+        now = time.time()
+        with self.lock:
+            keys = self._index.get(ikey) or ()
+            return [item[1] for item in (self._data.get(k) for k in keys)
+                    if item is not None and item[0] >= now]
+
+    def items(self) -> List[tuple]:
+        """未过期的 (key, 过期时间, value)，按最久未使用到最近使用排列"""
+        now = time.time()
+        with self.lock:
+            return [(k, v[0], v[1]) for k, v in self._data.items() if v[0] >= now]
+
+    def clear(self):
+        with self.lock:
+            self._data.clear()
+            self._index.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'name': self.name,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
@@ -0,0 +1,140 @@
+# coding: utf-8
+"""日志配置
+
+所有日志先进入内存队列，由 QueueListener 后台线程负责格式化和写控制台/文件，
+请求线程和事件循环只做一次入队；低于 WARNING 的日志可以按 logger 名称采样
+"""
+
+import copy
+import logging
+import logging.handlers
+import queue
+import random
+from typing import Dict, Optional
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+_exc_formatter = logging.Formatter()
+
+
+def parse_sample_rates(value: str) -> Dict[str, float]:
+    """解析采样率配置，例如 "app.services=0.2,app.routers.auth=0.5" """
+    rates = {}
+    for item in value.split(','):
+        name, _, rate = item.strip().partition('=')
+        if name and rate:
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """按 logger 名称采样，使用最长前缀匹配的采样率，WARNING 及以上总是保留"""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._cache = {}
+
+    def rate(self, name: str) -> float:
+        rate = self._cache.get(name)
+        if rate is None:
+            rate = 1.0
+            prefix = name
+            while prefix:
+                if prefix in self.rates:
+                    rate = self.rates[prefix]
+                    break
+                prefix = prefix.rpartition('.')[0]
+            self._cache[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate(record.name)
+        return rate >= 1 or random.random() < rate
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """入队不阻塞的 QueueHandler
+
+    - 调用线程只拼接消息和渲染异常，时间和格式串交给监听线程
+    - 队列满时丢弃并计数，不阻塞请求
+    """
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 参数可能是之后会被修改的可变对象，入队前拼好消息；
+        # 异常渲染成文本后去掉 exc_info，队列里不持有 traceback 引用的栈帧
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(
+    level: int = logging.INFO,
+    log_file: str = "",
+    sample_rates: Optional[Dict[str, float]] = None,
+    queue_size: int = 10000,
+) -> logging.handlers.QueueListener:
+    """配置根 logger 使用队列 + 后台线程输出
+
+    Args:
+        level: 日志级别
+        log_file: 日志文件，为空只输出到控制台
+        sample_rates: logger 名称 -> 采样率
+        queue_size: 队列长度，满了丢弃
+
+    Returns:
+        QueueListener，关闭时调用 stop_logging
+    """
+    global _listener
+    if _listener:
+        return _listener
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.handlers.WatchedFileHandler(log_file, encoding='utf-8'))
+    for h in handlers:
+        h.setFormatter(formatter)
+
+    q = queue.Queue(queue_size)
+    qh = NonBlockingQueueHandler(q)
+    if sample_rates:
+        qh.addFilter(SamplingFilter(sample_rates))
+
+    root = logging.getLogger()
+    for h in root.handlers[:]:
+        root.removeHandler(h)
+    root.addHandler(qh)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """停止后台线程，写完队列中剩余的日志"""
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
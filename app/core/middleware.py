@@ -0,0 +1,85 @@
+# coding: utf-8
+"""中间件"""
+
+import logging
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from starlette.datastructures import MutableHeaders
+
+log = logging.getLogger(__name__)
+
+
+class RequestDBStats:
+    """单个请求的数据库访问统计"""
+    __slots__ = ('queries', 'round_trips', 'db_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.round_trips = 0
+        self.db_time = 0  # 微秒
+
+
+_request_db_stats: ContextVar[Optional[RequestDBStats]] = ContextVar('request_db_stats', default=None)
+
+
+def current_db_stats() -> Optional[RequestDBStats]:
+    """当前请求的数据库访问统计，不在请求中返回 None"""
+    return _request_db_stats.get()
+
+
+def db_query_hook(conn, sql, usetime, ret, num, err):
+    """dbpool query_hook: 累计到当前请求
+
+    pipeline 只有在连接开启 multi_statements 时才是一次往返多条语句，
+    否则 execute_multi 逐条发送，每条一次往返
+    """
+    stats = _request_db_stats.get()
+    if stats is None:
+        return
+    n = len(sql) if isinstance(sql, (list, tuple)) else 1
+    stats.queries += n
+    stats.round_trips += 1 if getattr(conn, 'multi_statements', False) else n
+    stats.db_time += usetime
+
+
+class DBQueryCounterMiddleware:
+    """统计每个请求的 sql 条数、往返次数和数据库耗时
+
+    - debug 模式下在响应头加上 X-DB-Queries 和 Server-Timing
+    - 超过 budget 条 sql 时记录 warning，便于发现 N+1 查询
+    """
+
+    def __init__(self, app, budget: int = 4, debug: bool = False):
+        self.app = app
+        self.budget = budget
+        self.debug = debug
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestDBStats()
+        token = _request_db_stats.set(stats)
+        start = time.time()
+
+        async def send_wrapper(message):
+            if self.debug and message['type'] == 'http.response.start':
+                headers = MutableHeaders(scope=message)
+                headers.append('X-DB-Queries', '%d' % stats.queries)
+                headers.append('Server-Timing', 'db;dur=%.3f;desc="%d queries, %d round trips"' % (
+                    stats.db_time / 1000.0, stats.queries, stats.round_trips))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_db_stats.reset(token)
+            if stats.queries > self.budget:
+                route = scope.get('route')
+                path = getattr(route, 'path', None) or scope.get('path', '')
+                log.warning('func=db_budget|method=%s|route=%s|queries=%d|round_trips=%d|db_time=%d|time=%d|budget=%d',
+                            scope.get('method', ''), path, stats.queries, stats.round_trips,
+                            stats.db_time, int((time.time() - start) * 1000000), self.budget)
@@ -0,0 +1,152 @@
+# coding: utf-8
+"""进程内 n-gram 搜索索引
+
+每个文档的若干文本字段按字符切分为 1-gram 和 2-gram (不按空格分词，中文同样适用)，
+倒排表 gram -> 文档 key。查询取查询串各 gram 倒排表的交集作为候选，
+再逐个确认字段中包含查询串 (子串匹配)，前缀匹配的排在前面。
+"""
+
+import threading
+import unicodedata
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+
+def normalize(text) -> str:
+    """全角转半角、小写"""
+    if not text:
+        return ''
+    return unicodedata.normalize('NFKC', str(text)).lower()
+
+
+def grams(text: str) -> Set[str]:
+    ret = set(text)
+    ret.update(text[i:i + 2] for i in range(len(text) - 1))
+    ret.discard(' ')
+    return ret
+
+
+class NGramIndex:
+    """
+    Args:
+        fields: 建索引的文本字段
+        sort_key: 同一匹配级别内结果的排序，参数为文档
+    """
+
+    def __init__(self, fields: Iterable[str], sort_key: Optional[Callable[[Dict[str, Any]], Any]] = None):
+        self.fields = list(fields)
+        self.sort_key = sort_key
+        self.docs: Dict[Any, Dict[str, Any]] = {}
+        self.texts: Dict[Any, Dict[str, str]] = {}
+        self.postings: Dict[str, Set[Any]] = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def _grams(self, texts: Dict[str, str]) -> Set[str]:
+        ret = set()
+        for text in texts.values():
+            ret |= grams(text)
+        return ret
+
+    def _remove(self, key):
+        texts = self.texts.pop(key, None)
+        self.docs.pop(key, None)
+        if texts is None:
+            return
+        for g in self._grams(texts):
+            keys = self.postings.get(g)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.postings[g]
+
+    def _add(self, key, doc):
+        texts = {f: normalize(doc.get(f)) for f in self.fields}
+        self._remove(key)
+        self.docs[key] = doc
+        self.texts[key] = texts
+        for g in self._grams(texts):
+            self.postings.setdefault(g, set()).add(key)
+
+    def add(self, key, doc: Dict[str, Any]):
+        """添加或替换文档，doc 中的其他字段随搜索结果返回"""
+        with self.lock:
+            self._add(key, dict(doc))
+
+    def update(self, key, values: Dict[str, Any]) -> bool:
+        """合并更新已有文档，文档不存在返回 False"""
+        with self.lock:
+            doc = self.docs.get(key)
+            if doc is None:
+                return False
+            self._add(key, dict(doc, **values))
+        return True
+
+    def remove(self, key):
+        with self.lock:
+            self._remove(key)
+
+    def get(self, key) -> Optional[Dict[str, Any]]:
+        doc = self.docs.get(key)
+        return dict(doc) if doc else None
+
+    def search(self, query: str, limit: int = 20, fields: Optional[List[str]] = None,
+               where: Optional[Callable[[Dict[str, Any]], bool]] = None) -> List[Dict[str, Any]]:
+        """子串搜索
+
+        Args:
+            query: 查询串
+            limit: 最多返回条数
+            fields: 只在这些字段中匹配，默认全部字段
+            where: 额外的过滤条件，参数为文档
+
+        Returns:
+            匹配的文档，前缀匹配在前
+        """
+        query = normalize(query).strip()
+        if not query:
+            return []
+        fields = [f for f in (fields or self.fields) if f in self.fields]
+        qgrams = grams(query) if len(query) > 1 else {query}
+        # 2-gram 已经包含了 1-gram 的信息，只用 2-gram 求交集
+        if len(query) > 1:
+            qgrams = {g for g in qgrams if len(g) == 2} or qgrams
+
+        with self.lock:
+            lists = sorted((self.postings.get(g, ()) for g in qgrams), key=len)
+            if not lists or not lists[0]:
+                return []
+            candidates = set(lists[0])
+            for keys in lists[1:]:
+                candidates &= keys
+                if not candidates:
+                    return []
+
+            prefix = []
+            others = []
+            for key in candidates:
+                texts = self.texts[key]
+                matched = [texts[f] for f in fields if query in texts[f]]
+                if not matched or (where and not where(self.docs[key])):
+                    continue
+                if any(x.startswith(query) for x in matched):
+                    prefix.append(key)
+                else:
+                    others.append(key)
+            if self.sort_key:
+                prefix.sort(key=lambda k: self.sort_key(self.docs[k]))
+                others.sort(key=lambda k: self.sort_key(self.docs[k]))
+            return [dict(self.docs[k]) for k in (prefix + others)[:limit]]
+
+    def clear(self):
+        with self.lock:
+            self.docs.clear()
+            self.texts.clear()
+            self.postings.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'docs': len(self.docs),
+            'grams': len(self.postings),
+        }
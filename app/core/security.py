@@ -1,12 +1,96 @@
 # coding: utf-8
 """安全相关工具"""
 
+import base64
+import hashlib
+import hmac
+import json
+import re
 import secrets
+import time
+from typing import Optional
 
+_BASE36 = '0123456789abcdefghijklmnopqrstuvwxyz'
+# 旧格式为 43 位随机串，新格式为 7 位 base36 创建时间 + 43 位随机串
+# (配置了密钥时为 32 位随机串 + 11 位 HMAC 标签)
+RE_SESSION_ID = re.compile(r'^(?:[0-9a-z]{7})?[A-Za-z0-9_-]{43}$')
 
-def generate_session_id() -> str:
+
+def _session_id_tag(body: str, key: bytes) -> str:
+    return _b64encode(hmac.new(key, body.encode('ascii'), hashlib.sha256).digest()[:8])
+
+
+def generate_session_id(key: Optional[bytes] = None) -> str:
     """生成安全的 session_id
     
-    使用 secrets.token_urlsafe 生成 256 位随机 token
+    7 位 base36 秒级时间戳 + secrets.token_urlsafe 生成的 256 位随机 token，
+    时间前缀用于判断 session 是否创建于某个时刻之后。
+    指定 key 时随机部分为 192 位，末尾 11 位是时间和随机部分的 HMAC，
+    不知道 key 无法伪造一个时间前缀可信的 session_id
     """
-    return secrets.token_urlsafe(32)
+    n = int(time.time())
+    prefix = ''
+    for _ in range(7):
+        n, r = divmod(n, 36)
+        prefix = _BASE36[r] + prefix
+    if key:
+        body = prefix + secrets.token_urlsafe(24)
+        return body + _session_id_tag(body, key)
+    return prefix + secrets.token_urlsafe(32)
+
+
+def verify_session_id(session_id: str, key: bytes) -> bool:
+    """检查 session_id 末尾的 HMAC 标签"""
+    if len(session_id) != 50:
+        return False
+    return hmac.compare_digest(session_id[39:], _session_id_tag(session_id[:39], key))
+
+
+def is_session_id(session_id: str) -> bool:
+    """格式检查，不符合的一定不存在"""
+    return bool(RE_SESSION_ID.match(session_id))
+
+
+def session_id_time(session_id: str) -> Optional[int]:
+    """session_id 的创建时间，旧格式返回 None"""
+    if len(session_id) != 50:
+        return None
+    try:
+        return int(session_id[:7], 36)
+    except ValueError:
+        return None
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def sign_token(claims: dict, secret: str) -> str:
+    """生成 HMAC-SHA256 签名的 token
+
+    格式: base64url(json claims).base64url(signature)
+    """
+    payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+    sig = hmac.new(secret.encode('utf-8'), payload.encode('ascii'), hashlib.sha256).digest()
+    return payload + '.' + _b64encode(sig)
+
+
+def verify_token(token: str, secret: str) -> Optional[dict]:
+    """校验签名并返回 claims，签名不对或格式错误返回 None (不检查过期)"""
+    payload, _, sig = token.partition('.')
+    if not payload or not sig:
+        return None
+    expected = hmac.new(secret.encode('utf-8'), payload.encode('ascii', 'replace'), hashlib.sha256).digest()
+    try:
+        if not hmac.compare_digest(_b64decode(sig), expected):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        return None
+    if not isinstance(claims, dict):
+        return None
+    return claims
@@ -0,0 +1,187 @@
+# coding: utf-8
+"""多进程共享的定长哈希表
+
+基于 mmap 文件 (建议放在 /dev/shm)，同一台机器上的多个 worker 打开同一个文件即可共享。
+
+- 组相联: key 的哈希决定 bucket，每个 bucket 有 ways 个槽，满了淘汰最早过期的
+- 读不加锁，每个槽带一个序号 (seqlock)，写入期间为奇数，读到奇数或前后不一致时重试
+- 写按 bucket 分段加锁: 进程内用 threading.Lock，进程间用 fcntl.lockf 锁文件末尾之后的对应字节
+
+槽布局: seq u32 | hash u64 | expire u32 | length u16 | key 长度 u8 | key | value
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+MAGIC = b'XCSHM\x01'
+
+_HEADER = struct.Struct('<6sIII')
+HEADER_SIZE = 64
+_SLOT = struct.Struct('<IQIH')
+_SEQ = struct.Struct('<I')
+
+
+def _hash(key: bytes) -> int:
+    # 0 表示空槽
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little') | 1
+
+
+class ShmTable:
+    """
+    Args:
+        path: 文件路径
+        slots: 槽总数 (按 ways 向上取整)
+        slot_size: 每个槽的字节数，放不下的值不写入
+        ways: 每个 bucket 的槽数
+        stripes: 写锁分段数
+    """
+
+    def __init__(self, path: str, slots: int = 16384, slot_size: int = 512, ways: int = 4, stripes: int = 64):
+        self.path = path
+        self.ways = ways
+        self.buckets = max((slots + ways - 1) // ways, 1)
+        self.slots = self.buckets * ways
+        self.slot_size = slot_size
+        self.stripes = min(stripes, self.buckets)
+        self.size = HEADER_SIZE + self.slots * slot_size
+        self.locks = [threading.Lock() for _ in range(self.stripes)]
+
+        self.hits = 0
+        self.misses = 0
+
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._lock_file(0, HEADER_SIZE)
+        try:
+            header = os.pread(self.fd, _HEADER.size, 0)
+            expected = _HEADER.pack(MAGIC, self.slots, slot_size, ways)
+            if header != expected or os.fstat(self.fd).st_size != self.size:
+                # 新文件或参数变化: 清空重建
+                os.ftruncate(self.fd, 0)
+                os.ftruncate(self.fd, self.size)
+                os.pwrite(self.fd, expected, 0)
+            self.mm = mmap.mmap(self.fd, self.size)
+        finally:
+            self._unlock_file(0, HEADER_SIZE)
+
+    def _lock_file(self, start, length):
+        if fcntl:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, length, start)
+
+    def _unlock_file(self, start, length):
+        if fcntl:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, length, start)
+
+    def _offsets(self, h):
+        base = HEADER_SIZE + (h % self.buckets) * self.ways * self.slot_size
+        return [base + i * self.slot_size for i in range(self.ways)]
+
+    def _read(self, off, h, key):
+        """seqlock 读取一个槽，返回 (expire, value) 或 None"""
+        mm = self.mm
+        for _ in range(3):
+            seq, sh, expire, length = _SLOT.unpack_from(mm, off)
+            if sh != h:
+                return None
+            if seq & 1:
+                continue
+            data = mm[off + _SLOT.size:off + _SLOT.size + length]
+            if _SEQ.unpack_from(mm, off)[0] != seq:
+                continue
+            if not data or data[1:1 + data[0]] != key:
+                return None
+            return expire, data[1 + data[0]:]
+        return None
+
+    def get(self, key: str) -> Optional[bytes]:
+        bkey = key.encode('utf-8')
+        h = _hash(bkey)
+        now = time.time()
+        for off in self._offsets(h):
+            ret = self._read(off, h, bkey)
+            if ret is not None:
+                if ret[0] < now:
+                    break
+                self.hits += 1
+                return ret[1]
+        self.misses += 1
+        return None
+
+    def _write(self, off, h, expire, data):
+        mm = self.mm
+        seq = _SEQ.unpack_from(mm, off)[0] | 1
+        _SEQ.pack_into(mm, off, seq)
+        mm[off + _SLOT.size:off + _SLOT.size + len(data)] = data
+        _SLOT.pack_into(mm, off, seq, h, expire, len(data))
+        _SEQ.pack_into(mm, off, (seq + 1) & 0xffffffff)
+
+    @contextmanager
+    def _locked(self, h):
+        # 进程间锁使用文件末尾之后的字节，不和初始化时锁的文件头重叠
+        stripe = h % self.buckets % self.stripes
+        with self.locks[stripe]:
+            self._lock_file(self.size + stripe, 1)
+            try:
+                yield
+            finally:
+                self._unlock_file(self.size + stripe, 1)
+
+    def set(self, key: str, value: bytes, expire: int) -> bool:
+        """写入，expire 为过期时间戳；值太大返回 False"""
+        bkey = key.encode('utf-8')
+        data = bytes([len(bkey)]) + bkey + value
+        if len(bkey) > 255 or _SLOT.size + len(data) > self.slot_size:
+            return False
+        h = _hash(bkey)
+        now = time.time()
+        with self._locked(h):
+            target = None
+            oldest = None
+            for off in self._offsets(h):
+                _, sh, sexpire, _ = _SLOT.unpack_from(self.mm, off)
+                if sh == h and self._read(off, h, bkey) is not None:
+                    target = off
+                    break
+                if target is None and (sh == 0 or sexpire < now):
+                    target = off
+                if oldest is None or sexpire < oldest[0]:
+                    oldest = (sexpire, off)
+            if target is None:
+                target = oldest[1]
+            self._write(target, h, int(expire), data)
+        return True
+
+    def delete(self, key: str) -> bool:
+        bkey = key.encode('utf-8')
+        h = _hash(bkey)
+        with self._locked(h):
+            for off in self._offsets(h):
+                if self._read(off, h, bkey) is not None:
+                    self._write(off, 0, 0, b'')
+                    return True
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'name': os.path.basename(self.path),
+            'slots': self.slots,
+            'slot_size': self.slot_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0,
+        }
+
+    def close(self):
+        self.mm.close()
+        os.close(self.fd)
@@ -0,0 +1,162 @@
+# coding: utf-8
+"""进程内缓存的快照
+
+关闭时把已注册的缓存写入快照文件，启动时 mmap 读取并恢复，重启后的进程不用从冷缓存开始。
+每个缓存登记时提供一个表变更标记 (例如行数、最大 id、最大更新时间)，
+恢复时标记和当前数据库不一致的整段丢弃，避免恢复出旧数据。
+快照文件的权限为 0600，敏感字段由登记时的 encode 去掉。
+
+文件格式 (整数均为小端):
+    magic 'XCSNAP' | version u16 | section 数 u16 | 写入时间 u32
+    每个 section:
+        名称长度 u16 | 名称 | 标记长度 u32 | 标记 json | 条数 u32
+        每条: 长度 u32 | json [key, 过期时间, value]
+"""
+
+import json
+import mmap
+import os
+import struct
+import time
+import logging
+import traceback
+from typing import Any, Callable, Optional
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'XCSNAP'
+VERSION = 1
+
+_HEADER = struct.Struct('<6sHHI')
+_U16 = struct.Struct('<H')
+_U32 = struct.Struct('<I')
+
+# name -> (cache, encode, decode, marker)
+_sections = {}
+
+
+def register(name: str, cache, marker: Callable[[], Any],
+             encode: Optional[Callable[[Any], Any]] = None,
+             decode: Optional[Callable[[Any], Any]] = None):
+    """登记需要快照的缓存
+
+    Args:
+        name: section 名称
+        cache: LRUCache
+        marker: 返回当前表变更标记 (可 json 序列化)，返回 None 表示不支持快照
+        encode: value -> json 可序列化对象
+        decode: encode 结果 -> value，返回 None 表示丢弃 (例如已过期)
+    """
+    _sections[name] = (cache, encode, decode, marker)
+
+
+def unregister(name: str):
+    _sections.pop(name, None)
+
+
+def _dumps(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+
+
+def save(filename: str) -> int:
+    """写入快照 (先写临时文件再替换)，返回写入的条数"""
+    parts = []
+    sections = 0
+    total = 0
+    for name, (cache, encode, decode, marker) in _sections.items():
+        try:
+            mark = marker()
+        except Exception:
+            log.error(traceback.format_exc())
+            continue
+        if mark is None:
+            continue
+        items = cache.items()
+        bname = name.encode('utf-8')
+        bmark = _dumps(mark)
+        parts.append(_U16.pack(len(bname)) + bname)
+        parts.append(_U32.pack(len(bmark)) + bmark)
+        parts.append(_U32.pack(len(items)))
+        for key, expire, value in items:
+            data = _dumps([key, expire, encode(value) if encode else value])
+            parts.append(_U32.pack(len(data)))
+            parts.append(data)
+        sections += 1
+        total += len(items)
+
+    # 快照中有用户资料，只允许本用户读写 (和共享内存表一致)
+    tmp = '%s.%d.tmp' % (filename, os.getpid())
+    try:
+        os.unlink(tmp)
+    except FileNotFoundError:
+        pass
+    with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, sections, int(time.time())))
+        for x in parts:
+            f.write(x)
+    os.replace(tmp, filename)
+    log.info('func=snapshot_save|file=%s|sections=%d|items=%d', filename, sections, total)
+    return total
+
+
+def load(filename: str) -> int:
+    """从快照恢复，返回恢复的条数；文件不存在或格式不对时不恢复"""
+    if not os.path.exists(filename) or os.path.getsize(filename) < _HEADER.size:
+        return 0
+    total = 0
+    with open(filename, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, sections, saved_at = _HEADER.unpack_from(mm, 0)
+            if magic != MAGIC or version != VERSION:
+                log.warning('func=snapshot_load|file=%s|bad header', filename)
+                return 0
+            pos = _HEADER.size
+            for _ in range(sections):
+                n, = _U16.unpack_from(mm, pos)
+                name = mm[pos + 2:pos + 2 + n].decode('utf-8')
+                pos += 2 + n
+                n, = _U32.unpack_from(mm, pos)
+                mark = json.loads(mm[pos + 4:pos + 4 + n])
+                pos += 4 + n
+                count, = _U32.unpack_from(mm, pos)
+                pos += 4
+
+                start = pos
+                for _ in range(count):
+                    n, = _U32.unpack_from(mm, pos)
+                    pos += 4 + n
+                total += _load_section(name, mark, mm, start, count)
+        except (struct.error, ValueError):
+            log.warning('func=snapshot_load|file=%s|err=%s', filename, traceback.format_exc().splitlines()[-1])
+        finally:
+            mm.close()
+    return total
+
+
+def _load_section(name, mark, mm, pos, count) -> int:
+    section = _sections.get(name)
+    if section is None:
+        return 0
+    cache, encode, decode, marker = section
+    current = json.loads(_dumps(marker()))
+    if current != mark:
+        log.info('func=snapshot_load|section=%s|marker changed, skip', name)
+        return 0
+
+    now = time.time()
+    n = 0
+    for _ in range(count):
+        size, = _U32.unpack_from(mm, pos)
+        key, expire, value = json.loads(mm[pos + 4:pos + 4 + size])
+        pos += 4 + size
+        if expire <= now:
+            continue
+        if decode:
+            value = decode(value)
+            if value is None:
+                continue
+        cache.set(key, value, ttl=expire - now)
+        n += 1
+    log.info('func=snapshot_load|section=%s|items=%d/%d', name, n, count)
+    return n
@@ -6,6 +6,10 @@ from app.db.dbpool import (
     get_connection,
     get_connection_exception,
     get_connection_noexcept,
+    get_connection_for,
+    scatter,
+    gather_query,
+    shard_count,
     acquire,
     release,
     DBFunc
@@ -11,11 +11,14 @@ import threading
 import logging
 import re
 import traceback
+import zlib
+import bisect
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 
 from app.db import pager
 
-log = logging.getLogger()
+log = logging.getLogger(__name__)
 
 dbpool = None
 
@@ -24,11 +27,30 @@ settings = {
     'format_time': False,
     # 日志级别 all/simple
     'log_level': 'all',
+    # 单条sql日志的采样率 (0~1)，出错和慢查询总是记录
+    'log_sample_rate': 1.0,
+    # 慢查询阈值 (微秒)
+    'log_slow_time': 200000,
 }
 
+# 每条sql执行后调用 hook(conn, sql, usetime, ret, num, err)，usetime 为微秒
+query_hooks = []
+
 KEY_CP = re.compile('["\'\-\\\*\#,;\/\=\<\>` ]+')
 
 
+def add_query_hook(func):
+    """注册sql执行钩子"""
+    if func not in query_hooks:
+        query_hooks.append(func)
+
+
+def remove_query_hook(func):
+    """移除sql执行钩子"""
+    if func in query_hooks:
+        query_hooks.remove(func)
+
+
 def timeit(func):
     def _(*args, **kwargs):
         starttm = time.time()
@@ -50,22 +72,41 @@ def timeit(func):
             raise
         finally:
             endtm = time.time()
+            usetime = int((endtm - starttm) * 1000000)
             conn = args[0]
-            dbcf = conn.param
-            sql = repr(args[1])
-            if settings.get('log_level', 'all') == 'simple':
-                sql = sql.split()[0].strip("'")
-            log.info('server=%s|id=%d|name=%s|user=%s|r=%s|addr=%s:%d|db=%s|c=%d,%d,%d|tr=%d|time=%d|ret=%s|n=%d|sql=%s|err=%s',
-                     conn.type, conn.conn_id % 10000,
-                     conn.name, dbcf.get('user', ''), conn.role,
-                     dbcf.get('host', ''), dbcf.get('port', 0),
-                     dbcf.get('db', ''),
-                     len(conn.pool.dbconn_idle),
-                     len(conn.pool.dbconn_using),
-                     conn.pool.max_conn, conn.trans,
-                     int((endtm - starttm) * 1000000),
-                     str(ret), num,
-                     sql, err)
+            for hook in query_hooks:
+                try:
+                    hook(conn, args[1], usetime, ret, num, err)
+                except:
+                    log.warning(traceback.format_exc())
+
+            # 先判断是否会输出，丢弃的日志不拼装参数
+            # w 为这一行代表的语句条数 (采样率的倒数)，出错和慢查询总是输出，w=1
+            rate = settings.get('log_sample_rate', 1.0)
+            weight = 0
+            if err or rate >= 1 or usetime >= settings.get('log_slow_time', 200000):
+                weight = 1
+            elif rate > 0 and random.random() < rate:
+                weight = 1.0 / rate
+            if weight and (err or log.isEnabledFor(logging.INFO)):
+                dbcf = conn.param
+                sql = args[1]
+                if isinstance(sql, (list, tuple)):
+                    sql = ';'.join(sql)
+                sql = repr(sql)
+                if settings.get('log_level', 'all') == 'simple':
+                    sql = sql.split()[0].strip("'")
+                log.info('server=%s|id=%d|name=%s|user=%s|r=%s|addr=%s:%d|db=%s|c=%d,%d,%d|tr=%d|time=%d|ret=%s|n=%d|w=%g|sql=%s|err=%s',
+                         conn.type, conn.conn_id % 10000,
+                         conn.name, dbcf.get('user', ''), conn.role,
+                         dbcf.get('host', ''), dbcf.get('port', 0),
+                         dbcf.get('db', ''),
+                         len(conn.pool.dbconn_idle),
+                         len(conn.pool.dbconn_using),
+                         conn.pool.max_conn, conn.trans,
+                         usetime,
+                         str(ret), num, weight,
+                         sql, err)
     return _
 
 
@@ -109,6 +150,64 @@ class DBFunc(object):
         return 'DBFunc({})'.format(self.value)
 
 
+class DBPipelineResult:
+    """pipeline 中单条语句的执行结果"""
+    def __init__(self, affected, lastrowid, rows=None):
+        self.affected = affected
+        self.lastrowid = lastrowid
+        self.rows = rows
+
+    def __repr__(self):
+        return '<DBPipelineResult affected=%s lastrowid=%s rows=%s>' % (
+            self.affected, self.lastrowid, None if self.rows is None else len(self.rows))
+
+
+class DBPipeline:
+    """多语句批量执行
+
+    用法和连接上的构造方法一致，execute 时一次发送所有语句
+    (连接开启 multi_statements 时只有一次网络往返)，按顺序返回 DBPipelineResult
+
+    Usage:
+        p = db.pipeline()
+        p.delete('user_session', {'openid': openid})
+        p.insert('user_session', values)
+        ret = p.execute()
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.sqls = []
+
+    def __len__(self):
+        return len(self.sqls)
+
+    def add(self, sql):
+        self.sqls.append(sql)
+        return self
+
+    def insert(self, table, values, other=None):
+        return self.add(self.conn.insert_sql(table, values, other))
+
+    def update(self, table, values, where=None, other=None):
+        return self.add(self.conn.update_sql(table, values, where, other))
+
+    def upsert(self, table, values, keys, update=None):
+        return self.add(self.conn.upsert_sql(table, values, keys, update))
+
+    def delete(self, table, where, other=None):
+        return self.add(self.conn.delete_sql(table, where, other))
+
+    def select(self, table, where=None, fields='*', other=None):
+        return self.add(self.conn.select_sql(table, where, fields, other))
+
+    def execute(self):
+        if not self.sqls:
+            return []
+        sqls = self.sqls
+        self.sqls = []
+        return self.conn.execute_multi(sqls)
+
+
 class DBConnection:
     def __init__(self, param, lasttime, status):
         self.name = param.get('name')
@@ -121,6 +220,8 @@ class DBConnection:
         self.conn_id = 0
         self.trans = 0  # is start transaction
         self.role = param.get('role', 'm')  # master/slave
+        self.multi_statements = bool(param.get('multi_statements'))
+        self.multi_sent = 0  # 当前批次已经发送的次数
 
     def __str__(self):
         return '<%s %s:%d %s@%s>' % (
@@ -171,6 +272,29 @@ class DBConnection:
         cur.close()
         return ret
 
+    @timeit
+    def execute_multi(self, sqls):
+        '''依次执行多条sql，返回每条语句的 DBPipelineResult'''
+        ret = []
+        self.multi_sent = 0
+        cur = self.conn.cursor()
+        for sql in sqls:
+            self.multi_sent += 1
+            cur.execute(sql)
+            ret.append(self.pipeline_result(cur))
+        cur.close()
+        return ret
+
+    def pipeline_result(self, cur):
+        rows = None
+        if cur.description:
+            xkeys = [i[0] for i in cur.description]
+            rows = [dict(zip(xkeys, self.format_timestamp(r, cur))) for r in cur.fetchall()]
+        return DBPipelineResult(cur.rowcount, cur.lastrowid, rows)
+
+    def pipeline(self):
+        return DBPipeline(self)
+
     @timeit
     def query(self, sql, param=None, isdict=True, head=False):
         '''sql查询，返回查询结果'''
@@ -309,6 +433,27 @@ class DBConnection:
         sql = self.insert_sql(table, values, other)
         return self.execute(sql)
 
+    def upsert_sql(self, table, values, keys, update=None):
+        """按唯一键插入或更新
+
+        Args:
+            keys: 唯一键字段 (MySQL 由表上的唯一索引决定，这里只用于计算默认更新字段)
+            update: 冲突时更新的字段，默认 values 中除 keys 外的全部字段
+        """
+        if isinstance(keys, str):
+            keys = [keys]
+        if update is None:
+            update = [k for k in values if k not in keys]
+        sql = self.insert_sql(table, values)
+        sql += ' on duplicate key update ' + ','.join(
+            ['`%s`=values(`%s`)' % (k, k) for k in [self.key2sql(x) for x in update]])
+        return sql
+
+    def upsert(self, table, values, keys, update=None):
+        """插入或更新，返回 1: 新插入, 2: 更新了已有行, 0: 已有行且值未变"""
+        sql = self.upsert_sql(table, values, keys, update)
+        return self.execute(sql)
+
     def insert_list(self, table, values_list, other=None):
         sql = 'insert into %s ' % self.format_table(table)
         sql_key = ''
@@ -334,6 +479,26 @@ class DBConnection:
         sql = self.update_sql(table, values, where, other)
         return self.execute(sql)
 
+    # null 安全的相等比较，MySQL 为 <=>，SQLite 为 is
+    null_safe_eq = '<=>'
+
+    def update_changed_sql(self, table, values, where=None):
+        """只更新至少有一个字段和 values 不同的行
+
+        MySQL 默认只统计值有变化的行，SQLite 统计的是匹配的行，加上这个条件后
+        两者的 affected 都是实际有变化的行数，为 0 表示库中已经是这些值
+        """
+        changed = ' or '.join(['not (`%s` %s %s)' % (self.key2sql(k), self.null_safe_eq, self.value2sql(v))
+                               for k, v in values.items()])
+        sql = self.update_sql(table, values, where)
+        sql += (' and (%s)' if where else ' where (%s)') % changed
+        return sql
+
+    def update_changed(self, table, values, where=None):
+        """update_changed_sql 的执行，返回有变化的行数"""
+        sql = self.update_changed_sql(table, values, where)
+        return self.execute(sql)
+
     def delete_sql(self, table, where, other=None):
         sql = "delete from %s" % self.format_table(table)
         if where:
@@ -424,6 +589,13 @@ class DBConnection:
     def last_insert_id(self):
         pass
 
+    def get_lock(self, name, timeout=0):
+        """跨进程的命名锁，绑定在当前连接上，用于后台任务只在一个实例执行"""
+        return True
+
+    def release_lock(self, name):
+        pass
+
     def start(self):
         self.trans = 1
         pass
@@ -461,6 +633,18 @@ class DBConnection:
         return res
 
 
+# 发送时连接已经断开，语句没有到达服务端
+CR_SERVER_GONE_ERROR = 2006
+
+
+def mysql_driver(conn_type):
+    if conn_type == 'mysql':
+        import MySQLdb as m
+    else:
+        import pymysql as m
+    return m
+
+
 def with_mysql_reconnect(func):
     def close_mysql_conn(self):
         log.info('close conn:%s', self.conn)
@@ -471,12 +655,7 @@ def with_mysql_reconnect(func):
         self.conn = None
 
     def _(self, *args, **argitems):
-        if self.type == 'mysql':
-            import MySQLdb as m
-        elif self.type == 'pymysql':
-            import pymysql as m
-        elif self.type == 'pymysqlck':
-            import pymysql as m
+        m = mysql_driver(self.type)
         trycount = 3
         while True:
             try:
@@ -522,6 +701,10 @@ class MySQLConnection(DBConnection):
         engine = self.param['engine']
         if engine == 'mysql':
             import MySQLdb
+            from MySQLdb.constants import CLIENT
+            client_flag = 0
+            if self.multi_statements:
+                client_flag = CLIENT.MULTI_STATEMENTS | CLIENT.MULTI_RESULTS
             self.conn = MySQLdb.connect(
                 host=self.param['host'],
                 port=self.param['port'],
@@ -530,6 +713,7 @@ class MySQLConnection(DBConnection):
                 db=self.param['db'],
                 charset=self.param['charset'],
                 connect_timeout=self.param.get('timeout', 10),
+                client_flag=client_flag,
             )
             self.conn.autocommit(1)
 
@@ -576,6 +760,43 @@ class MySQLConnection(DBConnection):
     def executemany(self, sql, param):
         return DBConnection.executemany(self, sql, param)
 
+    def execute_multi(self, sqls):
+        '''不用 with_mysql_reconnect 整体重试: 批次中间断开时前面的语句可能已经执行，
+        重放会让 insert/delete 再执行一次。只有第一次发送就发现连接已断开 (没有语句到达服务端)
+        才重连后再执行一次，其他情况直接抛出异常'''
+        m = mysql_driver(self.type)
+        try:
+            return self._send_multi(sqls)
+        except (m.OperationalError, m.InterfaceError) as e:
+            log.warning(traceback.format_exc())
+            gone = isinstance(e, m.InterfaceError) or e.args[0] == CR_SERVER_GONE_ERROR
+            if self.trans or self.multi_sent > 1 or not gone:
+                raise
+            self.close()
+            self.connect()
+            return self._send_multi(sqls)
+
+    def _send_multi(self, sqls):
+        if not self.multi_statements:
+            return DBConnection.execute_multi(self, sqls)
+        return self._execute_multi(sqls)
+
+    @timeit
+    def _execute_multi(self, sqls):
+        '''CLIENT_MULTI_STATEMENTS: 所有语句一次发送，逐个读取结果集'''
+        ret = []
+        self.multi_sent = 1
+        cur = self.conn.cursor()
+        try:
+            cur.execute(';'.join(sqls))
+            while True:
+                ret.append(self.pipeline_result(cur))
+                if not cur.nextset():
+                    break
+        finally:
+            cur.close()
+        return ret
+
     @with_mysql_reconnect
     def query(self, sql, param=None, isdict=True, head=False):
         return DBConnection.query(self, sql, param, isdict, head)
@@ -597,8 +818,15 @@ class MySQLConnection(DBConnection):
         return ns
 
     def last_insert_id(self):
-        ret = self.query('select last_insert_id()', isdict=False)
-        return ret[0][0]
+        # 取自上一条语句的 OK 包，不需要额外查询
+        return self.conn.insert_id()
+
+    def get_lock(self, name, timeout=0):
+        ret = self.query("select get_lock('%s', %d)" % (self.escape(name), timeout), isdict=False)
+        return bool(ret and ret[0][0] == 1)
+
+    def release_lock(self, name):
+        self.query("select release_lock('%s')" % self.escape(name), isdict=False)
 
     def start(self):
         self.trans = 1
@@ -626,6 +854,10 @@ class PyMySQLConnection(MySQLConnection):
         engine = self.param['engine']
         if engine == 'pymysql':
             import pymysql
+            from pymysql.constants import CLIENT
+            client_flag = 0
+            if self.multi_statements:
+                client_flag = CLIENT.MULTI_STATEMENTS
             self.conn = pymysql.connect(
                 host=self.param['host'],
                 port=self.param['port'],
@@ -634,6 +866,7 @@ class PyMySQLConnection(MySQLConnection):
                 db=self.param['db'],
                 charset=self.param['charset'],
                 connect_timeout=self.param.get('timeout', 10),
+                client_flag=client_flag,
             )
             self.conn.autocommit(1)
             self.trans = 0
@@ -658,6 +891,251 @@ class PyMySQLConnection(MySQLConnection):
                  self.param.get('db', ''))
 
 
+class SQLiteConnection(DBConnection):
+    """嵌入式 SQLite 连接
+
+    与 MySQLConnection 提供相同的构造/查询接口，标识符沿用反引号 (SQLite 兼容)，
+    适合单机部署和无外部服务的压测环境。
+
+    配置项:
+        db: 数据库文件路径，也可以是 file: 开头的 URI
+            (例如 file:xclub?mode=memory&cache=shared 多连接共享内存库)
+        init_sql: 可选，建立连接后执行的建表脚本 (需幂等)
+        upgrade_sql: 可选，已有库的结构变更脚本，以 "-- version: N" 分段，在 init_sql 之前
+            按 PRAGMA user_version 执行未执行过的分段；新建的库只执行 init_sql 并记为最新版本
+    """
+    type = "sqlite"
+    null_safe_eq = 'is'
+
+    _conn_seq = 0
+
+    def __init__(self, param, lasttime, status):
+        DBConnection.__init__(self, param, lasttime, status)
+        self._lastrowid = 0
+        # 连接上的 last_insert_rowid()，None 表示不确定 (建表脚本、executemany 之后)
+        self._conn_rowid = None
+        self._locks = {}
+        self.connect()
+
+    def connect(self):
+        engine = self.param['engine']
+        if engine == 'sqlite':
+            import sqlite3
+            path = self.param['db']
+            self.conn = sqlite3.connect(
+                path,
+                timeout=self.param.get('timeout', 10),
+                isolation_level=None,
+                check_same_thread=False,
+                uri=path.startswith('file:'),
+            )
+            self._conn_rowid = None
+            if 'mode=memory' not in path and path != ':memory:':
+                self.conn.execute('pragma journal_mode=wal')
+                self.conn.execute('pragma synchronous=normal')
+            self.trans = 0
+
+            SQLiteConnection._conn_seq += 1
+            self.server_id = 0
+            self.conn_id = SQLiteConnection._conn_seq
+
+            upgrade_sql = self.param.get('upgrade_sql')
+            if upgrade_sql:
+                self.upgrade(upgrade_sql)
+            init_sql = self.param.get('init_sql')
+            if init_sql:
+                with open(init_sql, encoding='utf-8') as f:
+                    self.conn.executescript(f.read())
+        else:
+            raise ValueError('engine error:' + engine)
+        log.info('server=%s|func=connect|id=%d|name=%s|role=%s|db=%s',
+                 self.type, self.conn_id % 10000,
+                 self.name, self.role, self.param.get('db', ''))
+
+    @staticmethod
+    def parse_upgrade_sql(filename):
+        """读取升级脚本，返回 [(版本, [语句])]"""
+        import sqlite3
+        steps = []
+        buf = ''
+        with open(filename, encoding='utf-8') as f:
+            for line in f:
+                m = re.match(r'^--\s*version:\s*(\d+)', line)
+                if m:
+                    steps.append((int(m.group(1)), []))
+                    continue
+                if not steps or (not buf and (not line.strip() or line.lstrip().startswith('--'))):
+                    continue
+                buf += line
+                if sqlite3.complete_statement(buf):
+                    steps[-1][1].append(buf.strip())
+                    buf = ''
+        return steps
+
+    def upgrade(self, filename):
+        """执行 user_version 之后的升级分段，多个连接 / 进程之间用写锁互斥"""
+        import sqlite3
+        steps = self.parse_upgrade_sql(filename)
+        latest = max([v for v, _ in steps] or [0])
+        if self.conn.execute('pragma user_version').fetchone()[0] >= latest:
+            return
+        self.conn.execute('begin immediate')
+        try:
+            version = self.conn.execute('pragma user_version').fetchone()[0]
+            fresh = not self.conn.execute("select 1 from sqlite_master where type='table' limit 1").fetchone()
+            for v, sqls in steps:
+                if fresh or v <= version:
+                    continue
+                for sql in sqls:
+                    try:
+                        self.conn.execute(sql)
+                    except sqlite3.OperationalError as e:
+                        # 没有版本号的旧库可能已经有这个字段
+                        if 'duplicate column name' not in str(e):
+                            raise
+                log.info('server=%s|func=upgrade|db=%s|version=%d', self.type, self.param.get('db', ''), v)
+            if version < latest:
+                self.conn.execute('pragma user_version = %d' % latest)
+            self.conn.execute('commit')
+        except Exception:
+            self.conn.execute('rollback')
+            raise
+
+    def close(self):
+        log.info('server=%s|func=close|id=%d', self.type, self.conn_id % 10000)
+        try:
+            self.conn.close()
+        except:
+            log.warning(traceback.format_exc())
+        self.conn = None
+        for name in list(self._locks):
+            self.release_lock(name)
+
+    def alive(self):
+        if self.is_available():
+            self.conn.execute('select 1')
+
+    @timeit
+    def execute(self, sql, param=None):
+        cur = self.conn.cursor()
+        if param:
+            cur.execute(sql, param)
+        else:
+            cur.execute(sql)
+        ret = cur.rowcount
+        self._lastrowid = self._conn_rowid = cur.lastrowid
+        cur.close()
+        return ret
+
+    @timeit
+    def executemany(self, sql, param=None):
+        cur = self.conn.cursor()
+        cur.executemany(sql, param)
+        ret = cur.rowcount
+        cur.close()
+        self._conn_rowid = None
+        return ret
+
+    def pipeline_result(self, cur):
+        self._conn_rowid = cur.lastrowid
+        return DBConnection.pipeline_result(self, cur)
+
+    def upsert_sql(self, table, values, keys, update=None):
+        if isinstance(keys, str):
+            keys = [keys]
+        if update is None:
+            update = [k for k in values if k not in keys]
+        sql = self.insert_sql(table, values)
+        sql += ' on conflict(%s) do update set %s' % (
+            ','.join(['`%s`' % self.key2sql(x) for x in keys]),
+            ','.join(['`%s`=excluded.`%s`' % (k, k) for k in [self.key2sql(x) for x in update]]))
+        return sql
+
+    def upsert(self, table, values, keys, update=None):
+        # SQLite 的 changes() 不区分插入和更新。插入时连接的 last_insert_rowid() 变为新行的 id
+        # (自增 id 不重用，和之前的值一定不同)，冲突更新时不变，一条语句即可区分；
+        # 之前的值不确定时先在本连接查一次
+        if isinstance(keys, str):
+            keys = [keys]
+        before = self._conn_rowid
+        if before is None:
+            old = self.select_one(table, where={k: values[k] for k in keys}, fields=keys)
+            self.execute(self.upsert_sql(table, values, keys, update))
+            return 1 if old is None else 2
+        self.execute(self.upsert_sql(table, values, keys, update))
+        return 1 if self._conn_rowid != before else 2
+
+    def fields(self, tb):
+        ret = self.query("pragma table_info(%s)" % self.format_table(tb), isdict=False)
+        return [x[1] for x in ret]
+
+    def tables(self):
+        ret = self.query("select name from sqlite_master where type='table'", isdict=False)
+        return [x[0] for x in ret]
+
+    def escape(self, s, enc='utf-8'):
+        return s.replace("'", "''")
+
+    def last_insert_id(self):
+        return self._lastrowid
+
+    def get_lock(self, name, timeout=0):
+        # 数据库文件旁的锁文件 + fcntl，同一台机器上的进程之间互斥
+        path = self.param['db']
+        if path.startswith('file:') or path == ':memory:' or name in self._locks:
+            return True
+        try:
+            import fcntl
+        except ImportError:
+            return True
+        f = open('%s.%s.lock' % (path, re.sub(r'[^\w.-]', '_', name)), 'a')
+        deadline = time.time() + timeout
+        while True:
+            try:
+                fcntl.lockf(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self._locks[name] = f
+                return True
+            except OSError:
+                if time.time() >= deadline:
+                    f.close()
+                    return False
+                time.sleep(0.1)
+
+    def release_lock(self, name):
+        f = self._locks.pop(name, None)
+        if f:
+            f.close()
+
+    def delete_sql(self, table, where, other=None):
+        if not other or 'limit' not in other.lower():
+            return DBConnection.delete_sql(self, table, where, other)
+        # 默认编译的 SQLite 不支持 delete ... limit，改为按 rowid 子查询
+        table = self.format_table(table)
+        sql = "delete from %s where rowid in (select rowid from %s" % (table, table)
+        if where:
+            sql += " where %s" % self.dict2sql(where, ' and ')
+        sql += ' %s)' % other
+        return sql
+
+    def start(self):
+        self.trans = 1
+        sql = "begin"
+        return self.execute(sql)
+
+    def commit(self):
+        self.trans = 0
+        sql = 'commit'
+        return self.execute(sql)
+
+    def rollback(self):
+        self.trans = 0
+        sql = 'rollback'
+        ret = self.execute(sql)
+        # 回滚的插入不占用自增 id，之后的插入可能得到相同的 id
+        self._conn_rowid = None
+        return ret
+
+
 class DBPool(DBPoolBase):
     def __init__(self, dbcf):
         self.dbconn_idle = []
@@ -773,8 +1251,9 @@ class DBConnProxy:
         self._timeout = timeout
 
         self._modify_methods = set([
-            'execute', 'executemany', 'last_insert_id',
-            'insert', 'update', 'delete', 'insert_list', 'start', 'rollback', 'commit'
+            'execute', 'executemany', 'execute_multi', 'pipeline', 'last_insert_id',
+            'insert', 'update', 'update_changed', 'delete', 'insert_list', 'upsert',
+            'get_lock', 'release_lock', 'start', 'rollback', 'commit'
         ])
 
     def __getattr__(self, name):
@@ -849,6 +1328,71 @@ class RWDBPool:
         return ret
 
 
+class ShardedDBPool:
+    """按分片键路由的连接池
+
+    配置示例:
+        'xclub': {
+            'shard_policy': 'hash',     # hash / range
+            'shard_ranges': [1000, 2000],  # range 策略: 每个分片的上界 (不含)，最后一个分片不限
+            'shards': [
+                {'engine': 'pymysql', 'host': '10.0.0.1', ...},
+                {'master': {...}, 'slave': [...]},
+            ],
+        }
+
+    不带分片键的 acquire 使用第 0 个分片 (默认分片)。
+    range 策略只用于整数键 (例如 club id)，openid 等字符串键使用 hash 策略
+    """
+    def __init__(self, dbcf):
+        self.dbcf = dbcf
+        self.name = dbcf.get('name', '')
+        self.policy = dbcf.get('shard_policy', 'hash')
+        self.ranges = dbcf.get('shard_ranges', [])
+
+        self.shards = []
+        for x in dbcf['shards']:
+            x['name'] = self.name
+            if 'master' in x:
+                pool = RWDBPool(x)
+            else:
+                pool = DBPool(x)
+            self.shards.append(pool)
+
+        if self.policy == 'range' and len(self.ranges) != len(self.shards) - 1:
+            raise ValueError('shard_ranges size must be shards size - 1')
+
+    def route(self, key):
+        """计算分片键所在的分片序号"""
+        if self.policy == 'hash':
+            if not isinstance(key, bytes):
+                key = str(key).encode('utf-8')
+            return zlib.crc32(key) % len(self.shards)
+        elif self.policy == 'range':
+            if isinstance(key, bool) or not isinstance(key, int):
+                raise TypeError('range shard key must be int, got %r' % (key,))
+            return bisect.bisect_right(self.ranges, key)
+        else:
+            raise ValueError('policy not support')
+
+    def acquire(self, timeout=10, key=None):
+        index = 0 if key is None else self.route(key)
+        conn = self.shards[index].acquire(timeout)
+        conn.shard = index
+        return conn
+
+    def acquire_shard(self, index, timeout=10):
+        conn = self.shards[index].acquire(timeout)
+        conn.shard = index
+        return conn
+
+    def release(self, conn):
+        return self.shards[conn.shard].release(conn)
+
+    def size(self):
+        return [x.size() for x in self.shards]
+
+
 def install(cf):
     """初始化数据库连接池
     
@@ -867,7 +1411,9 @@ def install(cf):
     for name, item in cf.items():
         item['name'] = name
         dbp = None
-        if 'master' in item:
+        if 'shards' in item:
+            dbp = ShardedDBPool(item)
+        elif 'master' in item:
             dbp = RWDBPool(item)
         else:
             dbp = DBPool(item)
@@ -884,6 +1430,26 @@ def acquire(name, timeout=10):
     return x
 
 
+def acquire_for(name, key, timeout=10):
+    """按分片键获取数据库连接，未分片的连接池忽略 key"""
+    global dbpool
+    pool = dbpool[name]
+    if isinstance(pool, ShardedDBPool):
+        x = pool.acquire(timeout, key)
+    else:
+        x = pool.acquire(timeout)
+    x.name = name
+    return x
+
+
+def shard_count(name):
+    """连接池的分片数，未分片返回 1"""
+    pool = dbpool[name]
+    if isinstance(pool, ShardedDBPool):
+        return len(pool.shards)
+    return 1
+
+
 def release(conn):
     """释放数据库连接"""
     if not conn:
@@ -913,6 +1479,60 @@ def get_connection(token):
             release(conn)
 
 
+@contextmanager
+def get_connection_for(token, key):
+    """按分片键 (openid / club id) 获取数据库连接
+
+    Usage:
+        with get_connection_for('xclub', openid) as db:
+            db.select_one('club_user', where={'openid': openid})
+    """
+    conn = None
+    try:
+        conn = acquire_for(token, key)
+        yield conn
+    except:
+        log.error("error=%s", traceback.format_exc())
+        raise
+    finally:
+        if conn:
+            release(conn)
+
+
+def scatter(token, func, timeout=10):
+    """在所有分片上执行 func(db)，按分片顺序返回结果列表
+
+    用于跨分片的管理类查询，各分片并发执行
+    """
+    global dbpool
+    pool = dbpool[token]
+    if not isinstance(pool, ShardedDBPool):
+        with get_connection(token) as db:
+            return [func(db)]
+
+    def run(index):
+        conn = pool.acquire_shard(index, timeout)
+        conn.name = token
+        try:
+            return func(conn)
+        except:
+            log.error("shard=%d|error=%s", index, traceback.format_exc())
+            raise
+        finally:
+            release(conn)
+
+    with ThreadPoolExecutor(max_workers=len(pool.shards)) as executor:
+        return list(executor.map(run, range(len(pool.shards))))
+
+
+def gather_query(token, sql, isdict=True):
+    """在所有分片上执行查询并合并结果"""
+    ret = []
+    for rows in scatter(token, lambda db: db.query(sql, isdict=isdict)):
+        ret.extend(rows)
+    return ret
+
+
 get_connection_exception = get_connection
 
 
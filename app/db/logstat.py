@@ -0,0 +1,309 @@
+# coding: utf-8
+"""dbpool 日志离线分析
+
+流式读取 timeit 输出的 sql 日志 (支持 .gz)，内存占用固定。采样输出的日志按行中的
+w (采样率的倒数) 还原为实际条数，没有 w 的旧日志按 1 计。统计:
+    - 按 sql 指纹的总耗时排行、延迟分位、错误率
+    - 连接池饱和区间 (c= 的空闲连接数为 0 且连接数已达上限)
+    - 单个连接地址的重连风暴 (每分钟 func=connect 次数)
+
+Usage:
+    python -m app.db.logstat app.log app.log.1.gz
+    python -m app.db.logstat -n 30 --storm 20 --json app.log.gz
+    zcat app.log.*.gz | python -m app.db.logstat -
+"""
+
+import argparse
+import datetime
+import gzip
+import heapq
+import json
+import re
+import sys
+
+from app.db.sqlstats import fingerprint, Histogram, SQLStat, OTHER
+
+RE_TIME = re.compile(r'^(\d{4}-\d\d-\d\d[ T]\d\d:\d\d:\d\d)')
+
+
+def open_log(filename):
+    if filename == '-':
+        return sys.stdin
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rt', encoding='utf-8', errors='replace')
+    return open(filename, 'r', encoding='utf-8', errors='replace')
+
+
+def parse_time(line):
+    m = RE_TIME.match(line)
+    if not m:
+        return None
+    try:
+        return datetime.datetime.strptime(m.group(1).replace('T', ' '), '%Y-%m-%d %H:%M:%S').timestamp()
+    except ValueError:
+        return None
+
+
+def parse_fields(head):
+    """server=x|id=1|... 解析为字典"""
+    ret = {}
+    for item in head.split('|'):
+        k, _, v = item.partition('=')
+        ret[k] = v
+    return ret
+
+
+def unquote_sql(sql):
+    """日志中的 sql 是 repr() 结果，去掉外层引号"""
+    if len(sql) >= 2 and sql[0] == sql[-1] and sql[0] in '\'"':
+        return sql[1:-1]
+    return sql
+
+
+class TopN:
+    """保留值最大的 n 项"""
+    def __init__(self, n):
+        self.n = n
+        self.heap = []
+        self.seq = 0
+
+    def add(self, value, item):
+        self.seq += 1
+        entry = (value, self.seq, item)
+        if len(self.heap) < self.n:
+            heapq.heappush(self.heap, entry)
+        elif value > self.heap[0][0]:
+            heapq.heapreplace(self.heap, entry)
+
+    def items(self):
+        return [(v, x) for v, _, x in sorted(self.heap, reverse=True)]
+
+
+class LogStat:
+    """流式统计，只保留固定数量的指纹、区间和风暴"""
+    def __init__(self, top=20, max_fingerprints=2000, storm=10):
+        self.top = top
+        self.max_fingerprints = max_fingerprints
+        self.storm = storm
+
+        self.lines = 0
+        self.queries = 0
+        self.errors = 0
+        self.first_time = None
+        self.last_time = None
+        self.hist = Histogram()
+        self.stats = {}
+
+        # 连接池 -> [饱和开始时间, 最后一次饱和时间, 饱和期间的 sql 数]
+        self.saturated = {}
+        self.saturated_total = 0
+        self.saturated_windows = 0
+        self.saturated_top = TopN(top)
+
+        # 连接地址 -> [分钟, 次数]
+        self.connects = {}
+        self.connect_total = 0
+        self.storm_top = TopN(top)
+
+    def feed(self, line):
+        self.lines += 1
+        pos = line.find('server=')
+        if pos < 0:
+            return
+        ts = parse_time(line)
+        if ts is not None:
+            if self.first_time is None:
+                self.first_time = ts
+            self.last_time = ts
+
+        body = line[pos:].rstrip('\n')
+        if '|func=connect|' in body:
+            self.feed_connect(ts, parse_fields(body))
+            return
+        head, sep, rest = body.partition('|sql=')
+        if not sep:
+            return
+        sql, _, err = rest.rpartition('|err=')
+        self.feed_query(ts, parse_fields(head), unquote_sql(sql), err)
+
+    def feed_query(self, ts, fields, sql, err):
+        try:
+            usetime = int(fields.get('time', 0))
+            rows = int(fields.get('n', 0)) or max(int(fields.get('ret', 0)), 0)
+            weight = float(fields.get('w') or 1)
+        except ValueError:
+            return
+        self.queries += weight
+        if err:
+            self.errors += weight
+        self.hist.add(usetime, weight)
+
+        key = fingerprint(sql)
+        stat = self.stats.get(key)
+        if stat is None:
+            if len(self.stats) >= self.max_fingerprints:
+                key = OTHER
+                stat = self.stats.get(key)
+            if stat is None:
+                stat = self.stats[key] = SQLStat()
+        stat.add(usetime, rows, err, weight)
+
+        if ts is not None and 'c' in fields:
+            self.feed_pool(ts, fields, weight)
+
+    def feed_pool(self, ts, fields, weight=1):
+        try:
+            idle, using, maxconn = [int(x) for x in fields['c'].split(',')]
+        except ValueError:
+            return
+        pool = '%s@%s/%s' % (fields.get('name', ''), fields.get('addr', ''), fields.get('r', ''))
+        window = self.saturated.get(pool)
+        if idle == 0 and using >= maxconn:
+            if window is None:
+                self.saturated[pool] = [ts, ts, weight]
+            else:
+                window[1] = ts
+                window[2] += weight
+        elif window is not None:
+            self.close_window(pool, window)
+            del self.saturated[pool]
+
+    def close_window(self, pool, window):
+        start, end, n = window
+        self.saturated_windows += 1
+        self.saturated_total += end - start
+        self.saturated_top.add(end - start, {'pool': pool, 'start': start, 'end': end, 'queries': n})
+
+    def feed_connect(self, ts, fields):
+        self.connect_total += 1
+        if ts is None:
+            return
+        addr = '%s@%s/%s' % (fields.get('name', ''), fields.get('addr', fields.get('db', '')), fields.get('role', ''))
+        minute = int(ts // 60) * 60
+        item = self.connects.get(addr)
+        if item is None or item[0] != minute:
+            if item is not None:
+                self.close_minute(addr, item)
+            self.connects[addr] = [minute, 1]
+        else:
+            item[1] += 1
+
+    def close_minute(self, addr, item):
+        minute, n = item
+        if n >= self.storm:
+            self.storm_top.add(n, {'addr': addr, 'minute': minute, 'connects': n})
+
+    def finish(self):
+        for pool, window in self.saturated.items():
+            self.close_window(pool, window)
+        self.saturated = {}
+        for addr, item in self.connects.items():
+            self.close_minute(addr, item)
+        self.connects = {}
+
+    def report(self):
+        items = sorted(self.stats.items(), key=lambda x: x[1].total_time, reverse=True)
+        fingerprints = []
+        for key, stat in items[:self.top]:
+            d = stat.todict()
+            d['sql'] = key
+            d['p50_ms'] = round(min(stat.hist.percentile(50), stat.max_time) / 1000.0, 3)
+            d['p95_ms'] = round(min(stat.hist.percentile(95), stat.max_time) / 1000.0, 3)
+            d['error_rate'] = round(stat.errors / stat.count, 4) if stat.count else 0
+            fingerprints.append(d)
+
+        def fmt_time(ts):
+            if ts is None:
+                return None
+            return datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+
+        saturation = []
+        for seconds, x in self.saturated_top.items():
+            saturation.append({
+                'pool': x['pool'], 'start': fmt_time(x['start']), 'end': fmt_time(x['end']),
+                'seconds': int(seconds), 'queries': int(round(x['queries'])),
+            })
+
+        storms = []
+        for n, x in self.storm_top.items():
+            storms.append({'addr': x['addr'], 'minute': fmt_time(x['minute']), 'connects': n})
+
+        return {
+            'lines': self.lines,
+            'queries': int(round(self.queries)),
+            'errors': int(round(self.errors)),
+            'error_rate': round(self.errors / self.queries, 4) if self.queries else 0,
+            'start': fmt_time(self.first_time),
+            'end': fmt_time(self.last_time),
+            'latency_ms': {
+                'p50': round(self.hist.percentile(50) / 1000.0, 3),
+                'p90': round(self.hist.percentile(90) / 1000.0, 3),
+                'p99': round(self.hist.percentile(99) / 1000.0, 3),
+                'p999': round(self.hist.percentile(99.9) / 1000.0, 3),
+            },
+            'fingerprints': fingerprints,
+            'saturation': {
+                'windows': self.saturated_windows,
+                'seconds': int(self.saturated_total),
+                'top': saturation,
+            },
+            'connects': self.connect_total,
+            'storms': storms,
+        }
+
+
+def print_report(r, out=sys.stdout):
+    w = out.write
+    w('lines=%d queries=%d errors=%d (%.2f%%) range=%s ~ %s\n' % (
+        r['lines'], r['queries'], r['errors'], r['error_rate'] * 100, r['start'], r['end']))
+    lat = r['latency_ms']
+    w('latency ms: p50=%.3f p90=%.3f p99=%.3f p99.9=%.3f\n' % (lat['p50'], lat['p90'], lat['p99'], lat['p999']))
+
+    w('\n== top fingerprints by total time ==\n')
+    w('%10s %8s %8s %9s %9s %9s %9s %7s  %s\n' % (
+        'total_ms', 'count', 'rows', 'avg_ms', 'p95_ms', 'p99_ms', 'max_ms', 'err%', 'sql'))
+    for x in r['fingerprints']:
+        w('%10.1f %8d %8d %9.3f %9.3f %9.3f %9.3f %7.2f  %s\n' % (
+            x['total_ms'], x['count'], x['rows'], x['avg_ms'], x['p95_ms'], x['p99_ms'],
+            x['max_ms'], x['error_rate'] * 100, x['sql'][:200]))
+
+    sat = r['saturation']
+    w('\n== pool saturation (idle=0): %d windows, %d seconds ==\n' % (sat['windows'], sat['seconds']))
+    for x in sat['top']:
+        w('%s ~ %s %6ds %8d queries  %s\n' % (x['start'], x['end'], x['seconds'], x['queries'], x['pool']))
+
+    w('\n== reconnect storms: %d connects total ==\n' % r['connects'])
+    for x in r['storms']:
+        w('%s %6d/min  %s\n' % (x['minute'], x['connects'], x['addr']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='dbpool sql 日志分析')
+    parser.add_argument('files', nargs='+', help='日志文件，支持 .gz，- 表示标准输入')
+    parser.add_argument('-n', '--top', type=int, default=20, help='排行条数')
+    parser.add_argument('--storm', type=int, default=10, help='每分钟重连次数达到该值视为重连风暴')
+    parser.add_argument('--max-fingerprints', type=int, default=2000, help='最多统计的指纹数')
+    parser.add_argument('--json', action='store_true', help='输出 json')
+    args = parser.parse_args(argv)
+
+    stat = LogStat(args.top, args.max_fingerprints, args.storm)
+    for filename in args.files:
+        f = open_log(filename)
+        try:
+            for line in f:
+                stat.feed(line)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+    stat.finish()
+
+    r = stat.report()
+    if args.json:
+        json.dump(r, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write('\n')
+    else:
+        print_report(r)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,376 @@
+# coding: utf-8
+"""sql 采集与回放压测
+
+采集: 通过 dbpool 的 query_hook 把每条 sql 的开始时间、指纹、完整语句、耗时和所在线程
+写入 jsonl 文件 (服务配置 DB_CAPTURE_FILE 开启)
+
+回放: 按采集时的时间间隔 (可加速) 和并发把 sql 重新发到本地 MySQL 或 sqlite，
+输出延迟分布，用于验证连接池大小、索引和 sql 构造的改动。回放到 sqlite 时
+MySQL 方言的语句由 to_sqlite 改写，没有对应语义的 (get_lock 等) 跳过并计数
+
+Usage:
+    python -m app.db.replay capture.jsonl --engine sqlite --db /tmp/bench.db \\
+        --init-sql docs/init_sqlite.sql --speed 1 2 10 --concurrency 8
+    python -m app.db.replay capture.jsonl --engine pymysql --host 127.0.0.1 \\
+        --user root --passwd xx --db xclub_bench --readonly
+"""
+
+import argparse
+import heapq
+import json
+import logging
+import queue
+import re
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from app.db import dbpool
+from app.db.sqlstats import fingerprint, Histogram, SQLStat
+
+log = logging.getLogger(__name__)
+
+# 回放时按开始时间重排的窗口，采集是在 sql 结束时写入的，顺序会有少量交错
+REORDER_WINDOW = 10000
+
+
+class QueryCapture:
+    """把 sql 执行流写入 jsonl 文件
+
+    请求线程只把原始参数放入队列 (满了丢弃并计数)，指纹计算、序列化和写文件在后台线程
+
+    每行: {"t": 开始时间, "fp": 指纹, "sql": 语句 (pipeline 为列表), "us": 耗时微秒,
+           "th": 线程, "conn": 连接id, "name": 连接池, "n": 行数, "err": 是否出错}
+    """
+    def __init__(self, filename, limit=0, queue_size=10000):
+        self.filename = filename
+        self.limit = limit
+        self.count = 0
+        self.queued = 0
+        self.dropped = 0
+        self.queue = queue.Queue(queue_size)
+        self.f = open(filename, 'a', encoding='utf-8')
+        self._thread = threading.Thread(target=self.run, name='sql-capture', daemon=True)
+        self._thread.start()
+
+    def hook(self, conn, sql, usetime, ret, num, err):
+        """dbpool query_hook"""
+        if self.limit and self.queued >= self.limit:
+            return
+        try:
+            self.queue.put_nowait((time.time(), sql, usetime, threading.get_ident(),
+                                   conn.conn_id, conn.name, num or max(ret, 0), bool(err)))
+            self.queued += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=1)
+            except queue.Empty:
+                self.f.flush()
+                continue
+            if item is None:
+                break
+            try:
+                self.write(*item)
+            except Exception:
+                log.error(traceback.format_exc())
+        self.f.flush()
+
+    def write(self, endtm, sql, usetime, th, conn_id, name, n, err):
+        item = {
+            't': round(endtm - usetime / 1000000.0, 6),
+            'fp': fingerprint(sql),
+            'sql': sql,
+            'us': usetime,
+            'th': th,
+            'conn': conn_id,
+            'name': name,
+            'n': n,
+            'err': err,
+        }
+        self.f.write(json.dumps(item, ensure_ascii=False, default=str) + '\n')
+        self.count += 1
+        if self.limit and self.count == self.limit:
+            log.info('func=capture|file=%s|count=%d|limit reached', self.filename, self.count)
+
+    def close(self):
+        """写完队列中剩余的记录并关闭文件"""
+        if self.f is None:
+            return
+        self.queue.put(None)
+        self._thread.join()
+        self.f.close()
+        self.f = None
+
+
+_capture = None
+
+
+def start_capture(filename, limit=0):
+    """开始采集"""
+    global _capture
+    if _capture:
+        return _capture
+    _capture = QueryCapture(filename, limit)
+    dbpool.add_query_hook(_capture.hook)
+    log.info('func=capture|file=%s|limit=%d|start', filename, limit)
+    return _capture
+
+
+def stop_capture():
+    """停止采集并关闭文件"""
+    global _capture
+    if not _capture:
+        return
+    dbpool.remove_query_hook(_capture.hook)
+    _capture.close()
+    log.info('func=capture|file=%s|count=%d|dropped=%d|stop', _capture.filename, _capture.count, _capture.dropped)
+    _capture = None
+
+
+def read_capture(filename, readonly=False):
+    """按开始时间顺序读取采集文件，只在内存保留重排窗口"""
+    heap = []
+    seq = 0
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                continue
+            if readonly and not is_readonly(item['sql']):
+                continue
+            seq += 1
+            heapq.heappush(heap, (item['t'], seq, item))
+            if len(heap) > REORDER_WINDOW:
+                yield heapq.heappop(heap)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+
+def is_readonly(sql):
+    if isinstance(sql, list):
+        return all(is_readonly(x) for x in sql)
+    return sql.lstrip().split(None, 1)[0].lower() in ('select', 'show', 'desc')
+
+
+# MySQL 方言在 sqlite 上的处理: 没有对应语义的跳过，其余改写
+RE_SQLITE_SKIP = re.compile(r'^\s*(show|desc|describe|set)\b|\b(get_lock|release_lock|connection_id)\s*\(', re.I)
+RE_ON_DUPLICATE = re.compile(r'\s+on\s+duplicate\s+key\s+update\s+', re.I)
+RE_VALUES_FUNC = re.compile(r'\bvalues\s*\(\s*(`?\w+`?)\s*\)', re.I)
+RE_DELETE_LIMIT = re.compile(
+    r'^\s*delete\s+from\s+(\S+)((?:\s+where\s+.*?)?(?:\s+order\s+by\s+.*?)?\s+limit\s+\d+)\s*$', re.I | re.S)
+
+
+def to_sqlite(sql):
+    """把采集的 MySQL 语句改写为 sqlite 可执行的语句，无法执行的返回 None
+
+    - insert ... on duplicate key update a=values(a) -> on conflict do update set a=excluded.a
+    - delete ... limit n -> 按 rowid 子查询 (默认编译的 sqlite 不支持 delete ... limit)
+    - get_lock / release_lock / show / desc 等跳过
+    - start transaction -> begin
+    """
+    if isinstance(sql, list):
+        ret = [x for x in (to_sqlite(x) for x in sql) if x is not None]
+        return ret or None
+    if RE_SQLITE_SKIP.search(sql):
+        return None
+    if re.match(r'^\s*start\s+transaction\s*$', sql, re.I):
+        return 'begin'
+    head, sep, update = _partition(RE_ON_DUPLICATE, sql)
+    if sep:
+        return head + ' on conflict do update set ' + RE_VALUES_FUNC.sub(r'excluded.\1', update)
+    m = RE_DELETE_LIMIT.match(sql)
+    if m:
+        return 'delete from %s where rowid in (select rowid from %s%s)' % (m.group(1), m.group(1), m.group(2))
+    return sql
+
+
+def _partition(pattern, s):
+    m = pattern.search(s)
+    if not m:
+        return s, '', ''
+    return s[:m.start()], m.group(0), s[m.end():]
+
+
+class ReplayResult:
+    """一次回放的统计"""
+    def __init__(self, speed, concurrency):
+        self.speed = speed
+        self.concurrency = concurrency
+        self.lock = threading.Lock()
+        self.hist = Histogram()
+        self.lag = Histogram()
+        self.stats = {}
+        self.count = 0
+        self.errors = 0
+        self.skipped = 0        # 目标库不支持而跳过的语句
+        self.rewritten = 0      # 改写为目标库方言的语句
+        self.start = 0
+        self.end = 0
+
+    def add(self, fp, usetime, lag, err):
+        with self.lock:
+            self.count += 1
+            if err:
+                self.errors += 1
+            self.hist.add(usetime)
+            self.lag.add(lag)
+            stat = self.stats.get(fp)
+            if stat is None:
+                stat = self.stats[fp] = SQLStat()
+            stat.add(usetime, 0, err)
+
+    def report(self, top=10):
+        seconds = max(self.end - self.start, 0.000001)
+        items = sorted(self.stats.items(), key=lambda x: x[1].total_time, reverse=True)
+        return {
+            'speed': self.speed,
+            'concurrency': self.concurrency,
+            'queries': self.count,
+            'errors': self.errors,
+            'skipped': self.skipped,
+            'rewritten': self.rewritten,
+            'seconds': round(seconds, 3),
+            'qps': round(self.count / seconds, 1),
+            'latency_ms': {
+                'p50': round(self.hist.percentile(50) / 1000.0, 3),
+                'p90': round(self.hist.percentile(90) / 1000.0, 3),
+                'p99': round(self.hist.percentile(99) / 1000.0, 3),
+                'p999': round(self.hist.percentile(99.9) / 1000.0, 3),
+            },
+            'schedule_lag_p99_ms': round(self.lag.percentile(99) / 1000.0, 3),
+            'fingerprints': [dict(sql=k, **v.todict()) for k, v in items[:top]],
+        }
+
+
+def run_one(pool, item, scheduled, result):
+    sql = item['sql']
+    start = time.time()
+    lag = int(max(start - scheduled, 0) * 1000000)
+    err = False
+    conn = pool.acquire()
+    try:
+        if isinstance(sql, list):
+            conn.execute_multi(sql)
+        elif is_readonly(sql):
+            conn.query(sql)
+        else:
+            conn.execute(sql)
+    except Exception:
+        err = True
+        log.debug(traceback.format_exc())
+    finally:
+        pool.release(conn)
+    result.add(item['fp'], int((time.time() - start) * 1000000), lag, err)
+
+
+def replay(pool, filename, speed=1.0, concurrency=8, readonly=False, translate=None):
+    """按采集的时间间隔除以 speed 回放，最多 concurrency 条 sql 同时执行
+
+    translate: 把采集的语句改写为目标库方言 (例如 to_sqlite)，返回 None 的跳过并计数
+    """
+    result = ReplayResult(speed, concurrency)
+    slots = threading.BoundedSemaphore(concurrency)
+
+    def task(item, scheduled):
+        try:
+            run_one(pool, item, scheduled, result)
+        finally:
+            slots.release()
+
+    first = None
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        result.start = time.time()
+        for item in read_capture(filename, readonly):
+            if first is None:
+                first = item['t']
+            if translate is not None:
+                sql = translate(item['sql'])
+                if sql is None:
+                    result.skipped += 1
+                    continue
+                if sql != item['sql']:
+                    result.rewritten += 1
+                    item['sql'] = sql
+            scheduled = result.start + (item['t'] - first) / speed
+            delay = scheduled - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            slots.acquire()
+            executor.submit(task, item, scheduled)
+    result.end = time.time()
+    return result
+
+
+def print_report(r, out=sys.stdout):
+    w = out.write
+    lat = r['latency_ms']
+    w('== speed=%sx concurrency=%d ==\n' % (r['speed'], r['concurrency']))
+    w('queries=%d errors=%d skipped=%d rewritten=%d seconds=%.3f qps=%.1f\n' % (
+        r['queries'], r['errors'], r['skipped'], r['rewritten'], r['seconds'], r['qps']))
+    w('latency ms: p50=%.3f p90=%.3f p99=%.3f p99.9=%.3f  schedule lag p99=%.3f\n' % (
+        lat['p50'], lat['p90'], lat['p99'], lat['p999'], r['schedule_lag_p99_ms']))
+    for x in r['fingerprints']:
+        w('%10.1f %8d %9.3f %9.3f  %s\n' % (x['total_ms'], x['count'], x['avg_ms'], x['p99_ms'], x['sql'][:160]))
+    w('\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='sql 采集回放压测')
+    parser.add_argument('file', help='采集文件 (jsonl)')
+    parser.add_argument('--engine', default='sqlite', help='pymysql / mysql / sqlite')
+    parser.add_argument('--db', required=True, help='数据库名，sqlite 为文件路径')
+    parser.add_argument('--init-sql', default='', help='sqlite 建表脚本')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3306)
+    parser.add_argument('--user', default='root')
+    parser.add_argument('--passwd', default='')
+    parser.add_argument('--charset', default='utf8mb4')
+    parser.add_argument('--speed', type=float, nargs='+', default=[1.0], help='回放倍速，可指定多个依次执行')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发数，同时也是连接池大小')
+    parser.add_argument('--readonly', action='store_true', help='只回放查询语句')
+    parser.add_argument('-n', '--top', type=int, default=10, help='输出耗时最多的指纹数')
+    parser.add_argument('--json', action='store_true', help='输出 json')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    dbpool.settings['log_sample_rate'] = 0
+
+    cf = {
+        'name': 'replay',
+        'engine': args.engine,
+        'db': args.db,
+        'conn': args.concurrency,
+        'idle_timeout': 600,
+        'multi_statements': True,
+    }
+    if args.engine == 'sqlite':
+        if args.init_sql:
+            cf['init_sql'] = args.init_sql
+    else:
+        cf.update(host=args.host, port=args.port, user=args.user, passwd=args.passwd, charset=args.charset)
+    pool = dbpool.DBPool(cf)
+
+    reports = []
+    for speed in args.speed:
+        translate = to_sqlite if args.engine == 'sqlite' else None
+        r = replay(pool, args.file, speed, args.concurrency, args.readonly, translate).report(args.top)
+        reports.append(r)
+        if not args.json:
+            print_report(r)
+    if args.json:
+        json.dump(reports, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
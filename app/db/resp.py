@@ -0,0 +1,191 @@
+# coding: utf-8
+"""Redis 协议 (RESP2) 客户端
+
+只依赖标准库，兼容 redis / valkey / keydb 等实现。带一个简单的连接池，
+支持把多条命令一次发送 (pipeline)。
+"""
+
+import socket
+import threading
+import logging
+import traceback
+
+log = logging.getLogger(__name__)
+
+
+class RedisError(Exception):
+    """服务端返回的错误 (-ERR ...)"""
+    pass
+
+
+def encode_command(args):
+    out = [b'*%d\r\n' % len(args)]
+    for x in args:
+        if isinstance(x, bytes):
+            b = x
+        elif isinstance(x, str):
+            b = x.encode('utf-8')
+        else:
+            b = str(x).encode('utf-8')
+        out.append(b'$%d\r\n' % len(b))
+        out.append(b)
+        out.append(b'\r\n')
+    return b''.join(out)
+
+
+class RedisConnection:
+    def __init__(self, host, port, db=0, password='', timeout=3):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self.sock = None
+        self.f = None
+
+    def connect(self):
+        self.sock = socket.create_connection((self.host, self.port), self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.f = self.sock.makefile('rb')
+        log.info('server=redis|func=connect|addr=%s:%d|db=%d', self.host, self.port, self.db)
+        init = []
+        if self.password:
+            init.append(('AUTH', self.password))
+        if self.db:
+            init.append(('SELECT', self.db))
+        if init:
+            for r in self.execute_many(init):
+                if isinstance(r, RedisError):
+                    raise r
+
+    def close(self):
+        if self.sock:
+            try:
+                self.f.close()
+                self.sock.close()
+            except Exception:
+                pass
+        self.sock = None
+        self.f = None
+
+    def read_reply(self):
+        line = self.f.readline()
+        if not line or not line.endswith(b'\r\n'):
+            raise ConnectionError('redis connection closed')
+        t, data = line[:1], line[1:-2]
+        if t == b'+':
+            return data.decode('utf-8')
+        if t == b'-':
+            return RedisError(data.decode('utf-8'))
+        if t == b':':
+            return int(data)
+        if t == b'$':
+            n = int(data)
+            if n < 0:
+                return None
+            b = self.f.read(n + 2)
+            if len(b) != n + 2:
+                raise ConnectionError('redis connection closed')
+            return b[:-2]
+        if t == b'*':
+            n = int(data)
+            if n < 0:
+                return None
+            return [self.read_reply() for _ in range(n)]
+        raise ConnectionError('redis protocol error: %r' % line[:32])
+
+    def execute_many(self, commands):
+        """一次发送多条命令，按顺序返回结果，错误以 RedisError 对象返回"""
+        if self.sock is None:
+            self.connect()
+        self.sock.sendall(b''.join(encode_command(x) for x in commands))
+        return [self.read_reply() for _ in commands]
+
+
+class RedisClient:
+    """线程安全的 Redis 客户端
+
+    Args:
+        host, port, db, password: 服务地址
+        timeout: 连接和读写超时秒数
+        maxconn: 最多保留的空闲连接数
+    """
+
+    def __init__(self, host='127.0.0.1', port=6379, db=0, password='', timeout=3, maxconn=10):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self.maxconn = maxconn
+        self.lock = threading.Lock()
+        self.idle = []
+
+    def _acquire(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return RedisConnection(self.host, self.port, self.db, self.password, self.timeout)
+
+    def _release(self, conn):
+        with self.lock:
+            if len(self.idle) < self.maxconn:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def pipeline(self, commands):
+        """发送多条命令 (一次往返)，任意一条出错抛出 RedisError
+
+        连接断开时重连重试一次，调用方只应发送可重复执行的命令
+        """
+        if not commands:
+            return []
+        conn = self._acquire()
+        try:
+            try:
+                ret = conn.execute_many(commands)
+            except (OSError, ConnectionError):
+                log.warning('server=redis|func=reconnect|addr=%s:%d|err=%s',
+                            self.host, self.port, traceback.format_exc().splitlines()[-1])
+                conn.close()
+                ret = conn.execute_many(commands)
+        except Exception:
+            conn.close()
+            raise
+        self._release(conn)
+        for r in ret:
+            if isinstance(r, RedisError):
+                raise r
+        return ret
+
+    def execute(self, *args):
+        return self.pipeline([args])[0]
+
+    def get(self, key):
+        return self.execute('GET', key)
+
+    def set(self, key, value, ex=None):
+        if ex:
+            return self.execute('SET', key, value, 'EX', int(ex))
+        return self.execute('SET', key, value)
+
+    def delete(self, *keys):
+        if not keys:
+            return 0
+        return self.execute('DEL', *keys)
+
+    def scan_iter(self, match, count=1000):
+        cursor = b'0'
+        while True:
+            cursor, keys = self.execute('SCAN', cursor, 'MATCH', match, 'COUNT', count)
+            for k in keys:
+                yield k
+            if cursor in (b'0', 0):
+                break
+
+    def close(self):
+        with self.lock:
+            conns, self.idle = self.idle, []
+        for c in conns:
+            c.close()
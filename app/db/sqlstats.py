@@ -0,0 +1,225 @@
+# coding: utf-8
+"""SQL 指纹统计模块
+
+按去掉字面量后的 sql 指纹聚合执行次数、耗时 (总计/平均/p99)、返回行数和错误数，
+通过 dbpool 的 query_hook 采集，定期把统计窗口写入汇总日志
+
+Usage:
+    from app.db import sqlstats
+    sqlstats.install()
+    sqlstats.start_flusher(60)
+"""
+
+import math
+import re
+import threading
+import time
+import logging
+import traceback
+
+from app.db import dbpool
+
+log = logging.getLogger(__name__)
+
+# 字符串、数字字面量、in 列表、多行 values
+RE_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"")
+RE_NUMBER = re.compile(r"(?<![\w`.])-?\d+(?:\.\d+)?(?:e[+-]?\d+)?\b", re.I)
+# value2sql 把 None 输出为 NULL，和布尔、default 一样按字面量处理，否则同一条语句按哪些值为空分成多个指纹
+RE_KEYWORD = re.compile(r"(?<![\w`.])(?:null|true|false|default)(?![\w`])", re.I)
+RE_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+RE_VALUES = re.compile(r"(values\s*\(\?\+\))(?:\s*,\s*\(\?\+\))+", re.I)
+RE_SPACE = re.compile(r"\s+")
+
+# 直方图: 每个 2 的幂分 4 个桶，覆盖 1us ~ 2^30us
+HIST_SCALE = 4
+HIST_SIZE = 30 * HIST_SCALE + 1
+
+OTHER = '<other>'
+
+
+def fingerprint(sql):
+    """sql 指纹: 字面量替换为 ?，in 列表和多行 values 折叠，统一小写和空白"""
+    if isinstance(sql, (list, tuple)):
+        return ';'.join(fingerprint(x) for x in sql)
+    sql = RE_STRING.sub('?', sql)
+    sql = RE_NUMBER.sub('?', sql)
+    sql = RE_KEYWORD.sub('?', sql)
+    sql = RE_IN_LIST.sub('(?+)', sql)
+    sql = RE_VALUES.sub(r'\1', sql)
+    sql = RE_SPACE.sub(' ', sql)
+    return sql.strip().lower()
+
+
+class Histogram:
+    """对数分桶的耗时直方图，内存固定"""
+    def __init__(self):
+        self.buckets = [0] * HIST_SIZE
+        self.count = 0
+
+    @staticmethod
+    def index(usetime):
+        if usetime <= 1:
+            return 0
+        return min(int(math.log2(usetime) * HIST_SCALE), HIST_SIZE - 1)
+
+    @staticmethod
+    def upper(i):
+        return int(2 ** ((i + 1) / HIST_SCALE))
+
+    def add(self, usetime, weight=1):
+        self.buckets[self.index(usetime)] += weight
+        self.count += weight
+
+    def merge(self, other):
+        for i, n in enumerate(other.buckets):
+            self.buckets[i] += n
+        self.count += other.count
+
+    def percentile(self, p):
+        """返回 p 分位所在桶的上界 (微秒)"""
+        if not self.count:
+            return 0
+        rank = math.ceil(self.count * p / 100.0)
+        n = 0
+        for i, x in enumerate(self.buckets):
+            n += x
+            if n >= rank:
+                return self.upper(i)
+        return self.upper(HIST_SIZE - 1)
+
+
+class SQLStat:
+    """单个指纹的统计"""
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_time = 0
+        self.max_time = 0
+        self.hist = Histogram()
+
+    def add(self, usetime, rows, err, weight=1):
+        """weight: 这次记录代表的语句条数，采样的日志为采样率的倒数"""
+        self.count += weight
+        self.rows += rows * weight
+        self.total_time += usetime * weight
+        if usetime > self.max_time:
+            self.max_time = usetime
+        if err:
+            self.errors += weight
+        self.hist.add(usetime, weight)
+
+    def todict(self):
+        return {
+            'count': int(round(self.count)),
+            'errors': int(round(self.errors)),
+            'rows': int(round(self.rows)),
+            'total_ms': round(self.total_time / 1000.0, 3),
+            'avg_ms': round(self.total_time / 1000.0 / self.count, 3) if self.count else 0,
+            'p99_ms': round(min(self.hist.percentile(99), self.max_time) / 1000.0, 3),
+            'max_ms': round(self.max_time / 1000.0, 3),
+        }
+
+
+class SQLStats:
+    """按指纹聚合的 sql 统计
+
+    total 为进程启动以来的累计值，window 为上次 flush 以来的值
+    指纹数量超过 max_fingerprints 后新指纹合并到 <other>
+    """
+    def __init__(self, max_fingerprints=500):
+        self.max_fingerprints = max_fingerprints
+        self.total = {}
+        self.window = {}
+        self.start_time = time.time()
+        self.window_start = self.start_time
+        self.lock = threading.Lock()
+
+    def _get(self, stats, key):
+        stat = stats.get(key)
+        if stat is None:
+            if len(stats) >= self.max_fingerprints:
+                key = OTHER
+                stat = stats.get(key)
+            if stat is None:
+                stat = stats[key] = SQLStat()
+        return stat
+
+    def record(self, sql, usetime, rows=0, err=None):
+        key = fingerprint(sql)
+        with self.lock:
+            self._get(self.total, key).add(usetime, rows, err)
+            self._get(self.window, key).add(usetime, rows, err)
+
+    def hook(self, conn, sql, usetime, ret, num, err):
+        """dbpool query_hook"""
+        rows = num if num else max(ret, 0)
+        self.record(sql, usetime, rows, err)
+
+    def top(self, n=50, order='total_ms', window=False):
+        """按 order 字段倒序返回前 n 个指纹"""
+        with self.lock:
+            stats = self.window if window else self.total
+            items = [dict(sql=k, **v.todict()) for k, v in stats.items()]
+        items.sort(key=lambda x: x.get(order, 0), reverse=True)
+        return items[:n]
+
+    def reset(self):
+        with self.lock:
+            self.total = {}
+            self.window = {}
+            self.start_time = self.window_start = time.time()
+
+    def flush(self, n=20):
+        """把统计窗口的前 n 个指纹写入汇总日志，并开始新窗口"""
+        with self.lock:
+            stats = self.window
+            start = self.window_start
+            self.window = {}
+            self.window_start = time.time()
+        if not stats:
+            return
+        items = sorted(stats.items(), key=lambda x: x[1].total_time, reverse=True)
+        for k, v in items[:n]:
+            d = v.todict()
+            log.info('func=sqlstats|window=%d|count=%d|err=%d|rows=%d|total=%.3f|avg=%.3f|p99=%.3f|max=%.3f|sql=%s',
+                     int(time.time() - start), d['count'], d['errors'], d['rows'],
+                     d['total_ms'], d['avg_ms'], d['p99_ms'], d['max_ms'], k)
+
+
+stats = SQLStats()
+
+_flusher = None
+_flusher_stop = threading.Event()
+
+
+def install():
+    """注册到 dbpool 开始采集"""
+    dbpool.add_query_hook(stats.hook)
+
+
+def uninstall():
+    dbpool.remove_query_hook(stats.hook)
+
+
+def start_flusher(interval=60):
+    """启动后台线程定期写汇总日志"""
+    global _flusher
+
+    def run():
+        while not _flusher_stop.wait(interval):
+            try:
+                stats.flush()
+            except:
+                log.error(traceback.format_exc())
+
+    if _flusher and _flusher.is_alive():
+        return
+    _flusher_stop.clear()
+    _flusher = threading.Thread(target=run, name='sqlstats-flusher', daemon=True)
+    _flusher.start()
+
+
+def stop_flusher():
+    _flusher_stop.set()
+    stats.flush()
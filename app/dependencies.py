@@ -1,12 +1,39 @@
 # coding: utf-8
 """依赖注入"""
 
-from fastapi import Header, HTTPException
-from typing import Optional
+from dataclasses import dataclass
+from fastapi import Depends, Header, HTTPException, Request
+from typing import Any, Dict, Optional
 
+from app.core.exceptions import BizError
+from app.core.response import ErrorCode
+from app.schemas.user import UserRole, UserState
 from app.services.session import session_service, SessionData
 
 
+@dataclass
+class AuthContext:
+    """当前登录的 session 和用户 (用户不存在时为 None)"""
+    session: SessionData
+    user: Optional[Dict[str, Any]]
+
+    @property
+    def openid(self) -> str:
+        return self.session.openid
+
+    @property
+    def role(self) -> int:
+        return self.user.get('role', UserRole.VISITOR) if self.user else UserRole.VISITOR
+
+    @property
+    def role_name(self) -> str:
+        return self.user.get('role_name', '游客') if self.user else '游客'
+
+    @property
+    def is_admin(self) -> bool:
+        return self.role == UserRole.ADMIN
+
+
 async def get_session_id(
     x_session_id: Optional[str] = Header(None, alias="X-Session-Id")
 ) -> Optional[str]:
@@ -47,3 +74,62 @@ async def require_login(
         )
     
     return session
+
+
+async def get_current_auth(
+    request: Request,
+    x_session_id: Optional[str] = Header(None, alias="X-Session-Id")
+) -> Optional[AuthContext]:
+    """获取当前 session 和用户 (可选)
+
+    session 和用户信息一次读取 (见 SessionService.get_session_with_user)，
+    同时放到 request.state.session / request.state.user
+    """
+    if not x_session_id:
+        return None
+    session, user = session_service.get_session_with_user(x_session_id)
+    if session is None:
+        return None
+    request.state.session = session
+    request.state.user = user
+    return AuthContext(session, user)
+
+
+async def require_login_user(
+    request: Request,
+    x_session_id: Optional[str] = Header(None, alias="X-Session-Id")
+) -> AuthContext:
+    """要求登录，同时返回用户信息
+
+    如果未登录或 session 无效，抛出 401 错误
+    """
+    if not x_session_id:
+        raise HTTPException(
+            status_code=401,
+            detail="未登录，请先登录"
+        )
+
+    auth = await get_current_auth(request, x_session_id)
+    if auth is None:
+        raise HTTPException(
+            status_code=401,
+            detail="登录已过期，请重新登录"
+        )
+
+    return auth
+
+
+def require_role(role: int):
+    """要求登录且角色不低于 role
+
+    使用 session 中冗余的角色和状态判断，不查用户表；封禁的用户没有任何角色权限
+
+    用法: session: SessionData = Depends(require_role(UserRole.ADMIN))
+    """
+    async def check_role(session: SessionData = Depends(require_login)) -> SessionData:
+        if session.role < role or session.state != UserState.NORMAL:
+            msg = "需要管理员权限" if role == UserRole.ADMIN else "权限不足"
+            raise BizError(code=ErrorCode.FORBIDDEN, msg=msg)
+        return session
+
+    return check_role
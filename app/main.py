@@ -2,25 +2,42 @@
 """FastAPI 应用入口"""
 
 import logging
+import traceback
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.config import settings, DATABASE
-from app.routers import auth, record, user
+from app.routers import auth, record, user, admin
 from app.core.exceptions import setup_exception_handlers
+from app.core.middleware import DBQueryCounterMiddleware, db_query_hook
+from app.core.logger import setup_logging, stop_logging, parse_sample_rates
+from app.core import snapshot
+from app.core.bus import bus, create_transport
 from app.db import install as db_install
+from app.db import dbpool, sqlstats, replay
+from app.services.session import session_service
+from app.services.user import user_service
 
-# 配置日志
-logging.basicConfig(
+# 配置日志: 队列 + 后台线程输出，按 logger 采样
+# dbpool 的单条 sql 日志由 DB_LOG_SAMPLE_RATE 在拼装前采样
+setup_logging(
     level=logging.DEBUG if settings.DEBUG else logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    log_file=settings.LOG_FILE,
+    sample_rates=parse_sample_rates(settings.LOG_SAMPLE_RATES),
+    queue_size=settings.LOG_QUEUE_SIZE,
 )
 
 log = logging.getLogger(__name__)
 
 # 初始化数据库连接池
+dbpool.settings['log_sample_rate'] = settings.DB_LOG_SAMPLE_RATE
+dbpool.settings['log_slow_time'] = settings.DB_LOG_SLOW_MS * 1000
 db_install(DATABASE)
 
+if settings.SQL_STATS_ENABLED:
+    sqlstats.install()
+dbpool.add_query_hook(db_query_hook)
+
 # 创建 FastAPI 应用
 app = FastAPI(
     title="XClub API",
@@ -39,10 +56,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 请求级 sql 计数 (debug 模式输出到响应头)
+app.add_middleware(
+    DBQueryCounterMiddleware,
+    budget=settings.DB_QUERY_BUDGET,
+    debug=settings.DEBUG,
+)
+
 # 注册路由
 app.include_router(auth.router)
 app.include_router(user.router)
 app.include_router(record.router)
+app.include_router(admin.router)
 
 # 注册异常处理
 setup_exception_handlers(app)
@@ -71,9 +96,50 @@ async def startup_event():
     """应用启动事件"""
     log.info(f"XClub API 启动成功")
     log.info(f"API 文档: http://localhost:9900/docs")
+    if settings.SQL_STATS_ENABLED:
+        sqlstats.start_flusher(settings.SQL_STATS_FLUSH_SECONDS)
+    if settings.CACHE_SNAPSHOT_FILE:
+        try:
+            snapshot.load(settings.CACHE_SNAPSHOT_FILE)
+        except Exception:
+            log.error(traceback.format_exc())
+    if settings.CACHE_BUS:
+        bus.start(create_transport(settings.CACHE_BUS, settings.CACHE_BUS_ADDR, settings.CACHE_BUS_POLL_MS,
+                                   settings.SESSION_SECRET))
+    if session_service.signed:
+        session_service.revocation.start()
+    if settings.USER_SEARCH_ENABLED:
+        user_service.start_search_index()
+    if settings.SESSION_BLOOM_ENABLED:
+        session_service.start_bloom(settings.SESSION_BLOOM_REBUILD_SECONDS)
+    if settings.SESSION_TOUCH_INTERVAL > 0:
+        session_service.start_toucher(settings.SESSION_TOUCH_INTERVAL, settings.SESSION_TOUCH_FLUSH_SECONDS)
+    if settings.SESSION_REAPER_INTERVAL > 0:
+        session_service.start_reaper(
+            settings.SESSION_REAPER_INTERVAL,
+            settings.SESSION_REAPER_CHUNK,
+            settings.SESSION_REAPER_PAUSE_MS / 1000.0,
+        )
+    if settings.DB_CAPTURE_FILE:
+        replay.start_capture(settings.DB_CAPTURE_FILE, settings.DB_CAPTURE_LIMIT)
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """应用关闭事件"""
     log.info("XClub API 关闭")
+    if settings.SQL_STATS_ENABLED:
+        sqlstats.stop_flusher()
+    session_service.revocation.stop()
+    session_service.stop_reaper()
+    session_service.stop_toucher()
+    session_service.stop_bloom()
+    bus.stop()
+    if settings.CACHE_SNAPSHOT_FILE:
+        # 在续期写入之后保存，表变更标记包含这些写入
+        try:
+            snapshot.save(settings.CACHE_SNAPSHOT_FILE)
+        except Exception:
+            log.error(traceback.format_exc())
+    replay.stop_capture()
+    stop_logging()
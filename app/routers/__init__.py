@@ -1,4 +1,4 @@
 # coding: utf-8
 """API Routers"""
 
-from app.routers import auth, user, record
+from app.routers import auth, user, record, admin
@@ -0,0 +1,49 @@
+# coding: utf-8
+"""管理路由"""
+
+import logging
+from fastapi import APIRouter, Depends, Query
+
+from app.db import sqlstats
+from app.services.user import user_service
+from app.schemas.user import UserRole
+from app.services.session import session_service, SessionData
+from app.dependencies import require_role
+from app.core.response import success
+
+log = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/xclub/v1/admin", tags=["管理"])
+
+
+@router.get("/sql-stats")
+async def get_sql_stats(
+    top: int = Query(50, ge=1, le=500),
+    order: str = Query("total_ms", pattern="^(total_ms|avg_ms|p99_ms|max_ms|count|errors|rows)$"),
+    window: bool = False,
+    reset: bool = False,
+    session: SessionData = Depends(require_role(UserRole.ADMIN))
+):
+    """按 sql 指纹查看数据库耗时统计 (仅管理员)
+
+    - order: 排序字段
+    - window: 只看上次汇总日志以来的统计
+    - reset: 返回后清空统计
+    """
+    stats = sqlstats.stats
+    data = {
+        "since": int(stats.window_start if window else stats.start_time),
+        "items": stats.top(top, order, window),
+    }
+    if reset:
+        stats.reset()
+    return success(data=data)
+
+
+@router.get("/cache-stats")
+async def get_cache_stats(session: SessionData = Depends(require_role(UserRole.ADMIN))):
+    """查看进程内缓存命中率 (仅管理员)"""
+    data = [session_service.cache.stats(), session_service.bloom_stats(), user_service.cache_stats(), user_service.search_stats()]
+    if session_service.shm is not None:
+        data.append(session_service.shm.stats())
+    return success(data=data)
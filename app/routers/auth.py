@@ -15,7 +15,7 @@ from app.schemas.auth import (
 from app.services.wechat import wechat_service
 from app.services.session import session_service, SessionData
 from app.services.user import user_service
-from app.dependencies import get_current_session, require_login
+from app.dependencies import AuthContext, get_current_auth, require_login
 from app.core.response import success, ErrorCode
 from app.core.exceptions import BizError
 
@@ -36,20 +36,23 @@ async def login(request: WechatLoginRequest):
     openid = wechat_result["openid"]
     session_key = wechat_result["session_key"]
     
+    # 获取用户角色信息 (写入 session 用于权限判断)
+    user = user_service.get_user_by_openid(openid)
+    role = user.get('role', 1) if user else 1
+    role_name = user.get('role_name', '游客') if user else '游客'
+    state = user.get('state', 1) if user else 1
+    
     # 获取或创建 session
     session_id, is_new_user = session_service.get_or_create_user(
         openid=openid,
         session_key=session_key,
         nickname=request.nickname,
-        avatar_url=request.avatar_url
+        avatar_url=request.avatar_url,
+        role=role,
+        state=state,
     )
     
-    # 获取用户角色信息
-    user = user_service.get_user_by_openid(openid)
-    role = user.get('role', 1) if user else 1
-    role_name = user.get('role_name', '游客') if user else '游客'
-    
-    log.info(f"用户登录成功: openid={openid}, is_new_user={is_new_user}")
+    log.info("用户登录成功: openid=%s, is_new_user=%s", openid, is_new_user)
     
     return success(data={
         "session_id": session_id,
@@ -61,25 +64,20 @@ async def login(request: WechatLoginRequest):
 
 
 @router.get("/check")
-async def check_session(session: SessionData = Depends(get_current_session)):
+async def check_session(auth: AuthContext = Depends(get_current_auth)):
     """检查登录状态
     
     需要在 Header 中传入 X-Session-Id
     """
-    if session is None:
+    if auth is None:
         return success(data={"valid": False})
     
-    # 获取用户信息以获取 role
-    user = user_service.get_user_by_openid(session.openid)
-    role = user.get('role', 1) if user else 1
-    role_name = user.get('role_name', '游客') if user else '游客'
-    
     return success(data={
         "valid": True,
-        "openid": session.openid,
-        "nickname": session.nickname,
-        "role": role,
-        "role_name": role_name
+        "openid": auth.openid,
+        "nickname": auth.session.nickname,
+        "role": auth.role,
+        "role_name": auth.role_name
     })
 
 
@@ -92,7 +90,7 @@ async def logout(session: SessionData = Depends(require_login)):
     # 通过 openid 删除 session
     session_service.delete_session_by_openid(session.openid)
     
-    log.info(f"用户退出登录: openid={session.openid}")
+    log.info("用户退出登录: openid=%s", session.openid)
     
     return success(msg="退出成功")
 
@@ -130,20 +128,23 @@ async def register(request: RegisterRequest):
         code = error_code_map.get(error_msg, ErrorCode.PARAM_ERROR)
         raise BizError(code=code, msg=error_msg)
     
+    # 获取用户角色信息
+    user = user_service.get_user_by_openid(openid)
+    role = user.get('role', 1) if user else 2  # 注册成功默认为成员
+    role_name = user.get('role_name', '成员') if user else '成员'
+    state = user.get('state', 1) if user else 1
+    
     # 创建 session
     session_id = session_service.create_session(
         openid=openid,
         session_key=session_key,
         nickname=request.nickname,
         avatar_url=request.avatar_url,
+        role=role,
+        state=state,
     )
     
-    # 获取用户角色信息
-    user = user_service.get_user_by_openid(openid)
-    role = user.get('role', 1) if user else 2  # 注册成功默认为成员
-    role_name = user.get('role_name', '成员') if user else '成员'
-    
-    log.info(f"用户注册成功: openid={openid}, user_id={user_id}")
+    log.info("用户注册成功: openid=%s, user_id=%s", openid, user_id)
     
     return success(data={
         "session_id": session_id,
@@ -2,12 +2,13 @@
 """用户路由"""
 
 import logging
-from fastapi import APIRouter, Depends
+from typing import Optional
+from fastapi import APIRouter, Depends, Query
 
-from app.schemas.user import UserInfo, UserUpdate, UserRoleUpdate
+from app.schemas.user import UserInfo, UserUpdate, UserRoleUpdate, UserRole, UserState
 from app.services.user import user_service
-from app.services.session import SessionData
-from app.dependencies import require_login
+from app.services.session import session_service, SessionData
+from app.dependencies import AuthContext, require_login, require_login_user, require_role
 from app.core.response import success, ErrorCode
 from app.core.exceptions import BizError
 
@@ -17,12 +18,13 @@ router = APIRouter(prefix="/xclub/v1/user", tags=["用户"])
 
 
 @router.get("/info")
-async def get_current_user_info(session: SessionData = Depends(require_login)):
+async def get_current_user_info(auth: AuthContext = Depends(require_login_user)):
     """获取当前登录用户信息
     
     需要在 Header 中传入 X-Session-Id
     """
-    user = user_service.get_user_by_openid(session.openid)
+    session = auth.session
+    user = auth.user
     
     if not user:
         # 用户不存在，自动创建
@@ -35,6 +37,54 @@ async def get_current_user_info(session: SessionData = Depends(require_login)):
     return success(data=UserInfo(**user).model_dump())
 
 
+@router.get("")
+async def list_users(
+    page: int = Query(1, ge=1),
+    pagesize: int = Query(20, ge=1, le=100),
+    role: Optional[int] = None,
+    state: Optional[int] = None,
+    fields: Optional[str] = None,
+    ids: Optional[str] = None,
+    session: SessionData = Depends(require_role(UserRole.ADMIN))
+):
+    """用户列表 (仅管理员)
+
+    - role / state: 过滤条件
+    - fields: 逗号分隔的返回字段，默认全部
+    - ids: 逗号分隔的用户 ID，指定时按 ID 批量获取 (最多 500 个)，忽略分页和过滤条件
+    """
+    if ids:
+        try:
+            user_ids = list(dict.fromkeys(int(x) for x in ids.split(',') if x.strip()))[:user_service.BATCH_SIZE]
+        except ValueError:
+            raise BizError(code=ErrorCode.PARAM_ERROR, msg="ids 格式错误")
+        users = user_service.get_users_by_ids(user_ids)
+        return success(data={"data": [users[x] for x in user_ids if x in users]})
+
+    field_list = [x.strip() for x in fields.split(',')] if fields else None
+    data = user_service.list_users(page, pagesize, role=role, state=state, fields=field_list)
+    return success(data=data)
+
+
+@router.get("/search")
+async def search_users(
+    q: str = Query(..., min_length=1, max_length=50),
+    limit: int = Query(20, ge=1, le=50),
+    session: SessionData = Depends(require_role(UserRole.MEMBER))
+):
+    """按昵称 / 姓名搜索成员 (成员及以上)，管理员还可以按手机号搜索
+
+    使用进程内索引，不查库
+    """
+    if session.role == UserRole.ADMIN:
+        users = user_service.search_users(q, limit)
+    else:
+        users = user_service.search_users(q, limit, fields=['nickname', 'realname'], state=UserState.NORMAL)
+        for user in users:
+            user.pop('phone_num', None)
+    return success(data=users)
+
+
 @router.get("/{user_id}")
 async def get_user_info(
     user_id: int,
@@ -55,7 +105,7 @@ async def get_user_info(
 @router.put("/info")
 async def update_current_user_info(
     data: UserUpdate,
-    session: SessionData = Depends(require_login)
+    auth: AuthContext = Depends(require_login_user)
 ):
     """更新当前登录用户信息
     
@@ -66,20 +116,14 @@ async def update_current_user_info(
     if not update_data:
         raise BizError(code=ErrorCode.PARAM_ERROR, msg="没有要更新的数据")
     
-    # 确保用户存在
-    user = user_service.get_user_by_openid(session.openid)
-    if not user:
-        user_service.create_user(
-            openid=session.openid,
-            nickname=session.nickname or "",
-            avatar=session.avatar_url or ""
-        )
-    
-    # 更新用户信息
-    user_service.update_user(session.openid, **update_data)
-    
-    # 返回更新后的用户信息
-    updated_user = user_service.get_user_by_openid(session.openid)
+    # 用户不存在时创建，存在时只写入有变化的字段，一条语句；返回值由当前信息合并得到
+    session = auth.session
+    updated_user = user_service.upsert_profile(
+        session.openid,
+        base=auth.user,
+        defaults={'nickname': session.nickname, 'avatar': session.avatar_url},
+        **update_data
+    )
     return success(data=UserInfo(**updated_user).model_dump())
 
 
@@ -87,16 +131,12 @@ async def update_current_user_info(
 async def update_user_role(
     user_id: int,
     data: UserRoleUpdate,
-    session: SessionData = Depends(require_login)
+    session: SessionData = Depends(require_role(UserRole.ADMIN))
 ):
     """更新用户角色 (仅管理员)
     
     需要在 Header 中传入 X-Session-Id
     """
-    # 检查当前用户是否为管理员
-    if not user_service.is_admin(session.openid):
-        raise BizError(code=ErrorCode.FORBIDDEN, msg="需要管理员权限")
-    
     # 获取目标用户
     target_user = user_service.get_user_by_id(user_id)
     if not target_user:
@@ -108,4 +148,7 @@ async def update_user_role(
     if not ok:
         raise BizError(code=ErrorCode.PARAM_ERROR, msg="更新失败")
     
+    # 同步 session 中的角色
+    session_service.update_claims(target_user['openid'], role=data.role)
+    
     return success(msg="更新成功")
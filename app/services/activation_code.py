@@ -74,7 +74,7 @@ class ActivationCodeService:
         with get_connection(self.DB_NAME) as db:
             db.insert(self.TABLE, data)
 
-        log.info(f"创建激活码: code={code}, remark={remark}")
+        log.info("创建激活码: code=%s, remark=%s", code, remark)
         return code
 
     def batch_create_codes(self, count: int, remark: str = "") -> list:
@@ -160,9 +160,9 @@ class ActivationCodeService:
             )
 
         if affected:
-            log.info(f"激活码使用成功: code={code}, user_id={user_id}")
+            log.info("激活码使用成功: code=%s, user_id=%s", code, user_id)
         else:
-            log.warning(f"激活码使用失败: code={code}, user_id={user_id}")
+            log.warning("激活码使用失败: code=%s, user_id=%s", code, user_id)
         
         return affected > 0
 
@@ -186,7 +186,7 @@ class ActivationCodeService:
             )
 
         if affected:
-            log.info(f"激活码已作废: code={code}")
+            log.info("激活码已作废: code=%s", code)
         return affected > 0
 
     def get_user_activation_code(self, user_id: int) -> Optional[Dict[str, Any]]:
@@ -77,7 +77,7 @@ class FeishuService:
         FeishuService._token = result["tenant_access_token"]
         FeishuService._token_expire_at = time.time() + result.get("expire", 7200)
         
-        log.info(f"飞书 token 获取成功，有效期 {result.get('expire', 7200)} 秒")
+        log.info("飞书 token 获取成功，有效期 %s 秒", result.get('expire', 7200))
         
         return self._token
     
@@ -135,7 +135,7 @@ class FeishuService:
             "Authorization": f"Bearer {token}"
         }
         
-        log.info(f"创建飞书记录: realname={realname}, meal_type={meal_type}, price={price}")
+        log.info("创建飞书记录: realname=%s, meal_type=%s, price=%s", realname, meal_type, price)
         
         async with httpx.AsyncClient() as client:
             response = await client.post(
@@ -145,7 +145,7 @@ class FeishuService:
             )
             result = response.json()
         
-        log.debug(f"飞书创建记录响应: {result}")
+        log.debug("飞书创建记录响应: %s", result)
         
         # 检查错误
         if result.get("code") != 0:
@@ -155,7 +155,7 @@ class FeishuService:
             )
         
         record_id = result["data"]["record"]["record_id"]
-        log.info(f"飞书记录创建成功: record_id={record_id}")
+        log.info("飞书记录创建成功: record_id=%s", record_id)
         
         return record_id
 
@@ -1,14 +1,28 @@
 # coding: utf-8
-"""Session 管理服务 - MySQL 存储"""
+"""Session 管理服务"""
 
 import time
+import bisect
+import hashlib
+import json
 import logging
-from dataclasses import dataclass
-from typing import Optional
+import threading
+import traceback
+from array import array
+from dataclasses import asdict, dataclass
+from typing import Callable, Iterable, Optional
 
 from app.config import settings
-from app.core.security import generate_session_id
-from app.db import get_connection
+from app.core import snapshot
+from app.core.bloom import CountingBloomFilter
+from app.core.bus import bus
+from app.core.cache import LRUCache, MISSING
+from app.core.shm import ShmTable
+from app.core.security import (
+    generate_session_id, is_session_id, session_id_time, sign_token, verify_session_id, verify_token,
+)
+from app.services.session_store import create_session_store
+from app.services.user import user_service
 
 log = logging.getLogger(__name__)
 
@@ -23,43 +37,178 @@ class SessionData:
     avatar_url: Optional[str] = None
     created_at: int = 0
     expire_at: int = 0
+    role: int = 1
+    state: int = 1
 
     def is_expired(self) -> bool:
         """检查是否过期"""
         return int(time.time()) > self.expire_at
 
 
+def _sid_hash(session_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(session_id.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+
+class RevocationFilter:
+    """签名 session token 的吊销过滤
+
+    - 本进程内的退出、强制下线立即生效 (按 sid 或按 openid + 签发时间)
+    - 其他进程的变更通过定期从 session 存储加载有效 sid 得到: 最近一次加载之前签发、
+      但已经不在存储中的 token 视为吊销。有效 sid 以 64 位摘要的有序数组保存，每个 8 字节
+    """
+
+    def __init__(self, loader: Callable[[], Iterable[str]], interval: int = 30):
+        self.loader = loader
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.revoked_sids = {}      # sid -> 过期时间
+        self.revoked_openids = {}   # openid -> (吊销此刻之前签发的, 过期时间)
+        self.live = None
+        self.loaded_at = 0          # 毫秒
+        self._thread = None
+        self._stop = threading.Event()
+
+    def revoke(self, session_id: str, expire_at: int):
+        with self.lock:
+            self.revoked_sids[session_id] = expire_at
+
+    def revoke_openid(self, openid: str, before_ms: int, expire_at: int):
+        with self.lock:
+            # 广播的事件可能乱序到达，保留最晚的吊销时刻
+            item = self.revoked_openids.get(openid)
+            if item and item[0] > before_ms:
+                before_ms = item[0]
+            self.revoked_openids[openid] = (before_ms, expire_at)
+
+    def is_revoked(self, claims: dict) -> bool:
+        if claims['sid'] in self.revoked_sids:
+            return True
+        item = self.revoked_openids.get(claims['oid'])
+        if item and claims['iat'] <= item[0]:
+            return True
+        live = self.live
+        if live is not None and claims['iat'] < self.loaded_at:
+            h = _sid_hash(claims['sid'])
+            i = bisect.bisect_left(live, h)
+            if i == len(live) or live[i] != h:
+                return True
+        return False
+
+    def refresh(self):
+        """重新加载有效 sid，并清理已过期的本地吊销记录"""
+        loaded_at = int(time.time() * 1000)
+        live = array('q', sorted(_sid_hash(x) for x in self.loader()))
+        now = int(time.time())
+        with self.lock:
+            self.live = live
+            self.loaded_at = loaded_at
+            self.revoked_sids = {k: v for k, v in self.revoked_sids.items() if v >= now}
+            self.revoked_openids = {k: v for k, v in self.revoked_openids.items() if v[1] >= now}
+
+    def start(self):
+        """加载一次并启动后台定期刷新"""
+        def run():
+            while not self._stop.wait(self.interval):
+                try:
+                    self.refresh()
+                except Exception:
+                    log.error(traceback.format_exc())
+
+        self.refresh()
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name='session-revocation', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
 class SessionService:
-    """Session 管理服务 (MySQL 存储)
-    
-    数据库表结构:
-    CREATE TABLE `user_session` (
-        `id` int(11) NOT NULL AUTO_INCREMENT,
-        `session_id` varchar(64) NOT NULL COMMENT 'Session ID',
-        `openid` varchar(64) NOT NULL COMMENT '微信 openid',
-        `session_key` varchar(128) NOT NULL COMMENT '微信 session_key',
-        `nickname` varchar(64) DEFAULT NULL COMMENT '用户昵称',
-        `avatar_url` varchar(512) DEFAULT NULL COMMENT '头像 URL',
-        `created_at` int(11) NOT NULL COMMENT '创建时间戳',
-        `expire_at` int(11) NOT NULL COMMENT '过期时间戳',
-        `ctime` datetime DEFAULT CURRENT_TIMESTAMP,
-        `utime` datetime DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-        PRIMARY KEY (`id`),
-        UNIQUE KEY `uk_session_id` (`session_id`),
-        KEY `idx_openid` (`openid`),
-        KEY `idx_expire_at` (`expire_at`)
-    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='用户会话表';
+    """Session 管理服务
+
+    存储后端见 app.services.session_store，由 settings.SESSION_STORE 选择，
+    进程内 LRU 缓存在存储之前
     """
 
-    TABLE = 'user_session'
-    DB_NAME = 'xclub'
+    def __init__(self):
+        self.store = create_session_store(settings.SESSION_STORE)
+
+        # 签名模式: token 携带 openid / 过期时间 / 角色，校验签名即可，不查库
+        self.signed = settings.SESSION_MODE == 'signed'
+        if self.signed and not settings.SESSION_SECRET:
+            log.warning("SESSION_MODE=signed 但未配置 SESSION_SECRET，使用 opaque session")
+            self.signed = False
+        self.revocation = RevocationFilter(self.live_session_ids, settings.SESSION_REVOCATION_REFRESH)
+
+        self._reaper = None
+        self._reaper_stop = threading.Event()
+
+        # 同一台机器上多个 worker 共享的 session 表: session_id -> session，openid -> 当前 session_id
+        self.shm = None
+        self.shm_openid = None
+        if settings.SESSION_SHM_PATH:
+            self.shm = ShmTable(settings.SESSION_SHM_PATH, settings.SESSION_SHM_SLOTS, settings.SESSION_SHM_SLOT_SIZE)
+            self.shm_openid = ShmTable(settings.SESSION_SHM_PATH + '.openid', settings.SESSION_SHM_SLOTS, 128)
+
+        # 有效 session_id 的布隆过滤器，start_bloom 之后生效
+        # 配置了 SESSION_SECRET 时 session_id 带 HMAC 标签，其他进程新建的 session 可以不查库校验
+        self.id_key = hashlib.sha256(b'session_id:' + settings.SESSION_SECRET.encode('utf-8')).digest() \
+            if settings.SESSION_SECRET else None
+        self.bloom = None
+        self.bloom_built_at = 0
+        self.bloom_rejects = 0
+        self._bloom_thread = None
+        self._bloom_stop = threading.Event()
+
+        # 滑动过期: session_id -> 待写入的过期时间，后台线程批量写入
+        self.touch_interval = 0
+        self._touch_lock = threading.Lock()
+        self._touches = {}
+        self._toucher = None
+        self._toucher_stop = threading.Event()
+
+        # session_id -> SessionData，按 openid 建二级索引用于整体失效
+        self.cache = LRUCache(
+            maxsize=settings.SESSION_CACHE_SIZE,
+            ttl=settings.SESSION_CACHE_TTL,
+            name='session',
+            index=lambda x: x.openid,
+        )
+        # 其他 worker / 节点修改 session 后清理本进程缓存
+        bus.subscribe('user_session', self.on_invalidate)
+
+    def on_invalidate(self, column: str, value: str):
+        """收到其他进程的失效事件
+
+        revoke_sid / revoke_openid 是签名模式下其他进程的吊销，在本进程的吊销过滤中同样生效
+        """
+        if column == 'session_id':
+            self.cache.pop(value)
+        elif column == 'openid':
+            self.cache.pop_by_index(value)
+        elif column == 'revoke_sid':
+            self.cache.pop(value)
+            self.revocation.revoke(value, int(time.time()) + settings.SESSION_EXPIRE_SECONDS)
+        elif column == 'revoke_openid':
+            before_ms, _, openid = value.partition(':')
+            self.cache.pop_by_index(openid)
+            self.revocation.revoke_openid(openid, int(before_ms), int(time.time()) + settings.SESSION_EXPIRE_SECONDS)
+
+    def revoke_openid(self, openid: str, before_ms: int):
+        """签名模式: 吊销该用户 before_ms 及之前签发的 token，并通知其他进程"""
+        self.revocation.revoke_openid(openid, before_ms, int(time.time()) + settings.SESSION_EXPIRE_SECONDS)
+        bus.publish('user_session', 'revoke_openid', '%d:%s' % (before_ms, openid))
 
     def create_session(
         self,
         openid: str,
         session_key: str,
         nickname: Optional[str] = None,
-        avatar_url: Optional[str] = None
+        avatar_url: Optional[str] = None,
+        role: int = 1,
+        state: int = 1
     ) -> str:
         """创建 session
         
@@ -68,33 +217,91 @@ class SessionService:
             session_key: 微信 session_key
             nickname: 用户昵称
             avatar_url: 用户头像
+            role: 用户角色，冗余到 session 用于权限判断，签名模式下写入 token
+            state: 用户状态
             
         Returns:
-            session_id
+            session_id (签名模式下为签名 token)
         """
-        # 删除该用户的旧 session
-        with get_connection(self.DB_NAME) as db:
-            db.delete(self.TABLE, where={'openid': openid})
+        return self._create_session(openid, session_key, nickname, avatar_url, role, state)[0]
 
+    def _create_session(self, openid, session_key, nickname=None, avatar_url=None, role=1, state=1) -> tuple:
+        """创建 session，返回 (session_id, 之前是否没有 session)"""
         # 生成新的 session_id
-        session_id = generate_session_id()
+        session_id = generate_session_id(self.id_key)
         now = int(time.time())
         expire_at = now + settings.SESSION_EXPIRE_SECONDS
 
-        # 插入新 session
-        with get_connection(self.DB_NAME) as db:
-            db.insert(self.TABLE, {
-                'session_id': session_id,
-                'openid': openid,
-                'session_key': session_key,
-                'nickname': nickname,
-                'avatar_url': avatar_url,
-                'created_at': now,
-                'expire_at': expire_at,
-            })
-
-        log.info(f"创建 session: openid={openid}, expire_at={expire_at}")
-        return session_id
+        # 保存新 session 并替换该用户的旧 session
+        is_new = self.store.create({
+            'session_id': session_id,
+            'openid': openid,
+            'session_key': session_key,
+            'nickname': nickname,
+            'avatar_url': avatar_url,
+            'created_at': now,
+            'expire_at': expire_at,
+            'role': role,
+            'state': state,
+        })
+
+        self.cache.pop_by_index(openid)
+        if self.bloom is not None:
+            self.bloom.add(session_id)
+        session = SessionData(
+            session_id=session_id,
+            openid=openid,
+            session_key=session_key,
+            nickname=nickname,
+            avatar_url=avatar_url,
+            created_at=now,
+            expire_at=expire_at,
+            role=role,
+            state=state,
+        )
+        self.cache.set(session_id, session)
+        self.shm_set(session)
+        bus.publish('user_session', 'openid', openid)
+
+        log.info("创建 session: openid=%s, expire_at=%s", openid, expire_at)
+
+        if self.signed:
+            # 旧 session 已删除，同时吊销之前签发的 token
+            iat = int(time.time() * 1000)
+            self.revoke_openid(openid, iat - 1)
+            session_id = sign_token({
+                'sid': session_id,
+                'oid': openid,
+                'iat': iat,
+                'exp': expire_at,
+                'role': role,
+                'st': state,
+            }, settings.SESSION_SECRET)
+        return session_id, is_new
+
+    def verify_signed_session(self, token: str) -> Optional[SessionData]:
+        """校验签名 token，不访问存储"""
+        claims = verify_token(token, settings.SESSION_SECRET)
+        if not claims:
+            return None
+        try:
+            if int(time.time()) > claims['exp'] or self.revocation.is_revoked(claims):
+                return None
+            return SessionData(
+                session_id=claims['sid'],
+                openid=claims['oid'],
+                session_key='',
+                created_at=claims['iat'] // 1000,
+                expire_at=claims['exp'],
+                role=claims.get('role', 1),
+                state=claims.get('st', 1),
+            )
+        except (KeyError, TypeError):
+            return None
+
+    def live_session_ids(self) -> Iterable[str]:
+        """未过期的 session_id，用于刷新吊销过滤"""
+        return self.store.session_ids(int(time.time()))
 
     def get_session(self, session_id: str) -> Optional[SessionData]:
         """获取 session 数据
@@ -105,31 +312,219 @@ class SessionService:
         Returns:
             SessionData 或 None (不存在或已过期)
         """
-        with get_connection(self.DB_NAME) as db:
-            row = db.select_one(
-                self.TABLE,
-                where={'session_id': session_id},
-                fields=['session_id', 'openid', 'session_key', 'nickname', 'avatar_url', 'created_at', 'expire_at']
-            )
+        return self._get_session(session_id)[0]
+
+    def get_session_with_user(self, session_id: str) -> tuple:
+        """获取 session 和对应的用户信息
+
+        session 未缓存时，mysql 存储用一条 left join 同时读取用户并填充用户缓存；
+        否则用户信息从用户缓存读取
 
+        Returns:
+            (SessionData 或 None, 用户信息字典 或 None)
+        """
+        session, user = self._get_session(session_id, with_user=True)
+        if session is None:
+            return None, None
+        if user is MISSING:
+            user = user_service.get_user_by_openid(session.openid)
+        return session, user
+
+    def _get_session(self, session_id: str, with_user: bool = False) -> tuple:
+        """返回 (session, 用户)，没有顺带读取用户时用户为 MISSING"""
+        if self.signed and '.' in session_id:
+            return self.verify_signed_session(session_id), MISSING
+
+        session = self.cache.get(session_id)
+        if session is not None:
+            if session.is_expired():
+                # 过期记录由后台清理线程删除，请求路径上不写库
+                self.cache.pop(session_id)
+                log.debug("session 已过期: session_id=%s...", session_id[:8])
+                return None, MISSING
+            self.touch(session)
+            return session, MISSING
+
+        session = self.shm_get(session_id)
+        if session is not None:
+            self.touch(session)
+            self.cache.set(session_id, session)
+            return session, MISSING
+
+        if not self.maybe_exists(session_id):
+            return None, MISSING
+
+        user = MISSING
+        if with_user and self.store.joinable:
+            gen = user_service.generation
+            row, user_row = self.store.get_with_user(session_id, user_service.TABLE, user_service.FIELDS)
+            if row:
+                user = user_service.prime(row['openid'], user_row, gen)
+        else:
+            row = self.store.get(session_id)
         if not row:
-            return None
+            return None, MISSING
 
         # 检查是否过期
         if int(time.time()) > row['expire_at']:
-            self.delete_session(session_id)
-            log.debug(f"session 已过期: session_id={session_id[:8]}...")
-            return None
+            log.debug("session 已过期: session_id=%s...", session_id[:8])
+            return None, MISSING
 
-        return SessionData(
+        session = SessionData(
             session_id=row['session_id'],
             openid=row['openid'],
             session_key=row['session_key'],
             nickname=row.get('nickname'),
             avatar_url=row.get('avatar_url'),
             created_at=row['created_at'],
-            expire_at=row['expire_at']
+            expire_at=row['expire_at'],
+            role=row.get('role') or 1,
+            state=row.get('state') or 1,
+        )
+        self.touch(session)
+        self.cache.set(session_id, session)
+        self.shm_set(session)
+        return session, user
+
+    def shm_get(self, session_id: str) -> Optional[SessionData]:
+        """从共享内存读取，openid 的当前 session 已经变化 (重新登录或强制下线) 的视为不存在"""
+        if self.shm is None:
+            return None
+        data = self.shm.get(session_id)
+        if data is None:
+            return None
+        # openid, session_key, nickname, avatar_url, created_at, expire_at, role, state
+        fields = json.loads(data)
+        current = self.shm_openid.get(fields[0])
+        if current is None or current.decode('utf-8') != session_id:
+            return None
+        return SessionData(session_id, *fields)
+
+    def shm_set(self, session: SessionData):
+        if self.shm is None:
+            return
+        data = json.dumps([
+            session.openid, session.session_key, session.nickname, session.avatar_url,
+            session.created_at, session.expire_at, session.role, session.state,
+        ], ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        if self.shm.set(session.session_id, data, session.expire_at):
+            self.shm_openid.set(session.openid, session.session_id.encode('utf-8'), session.expire_at)
+
+    def maybe_exists(self, session_id: str) -> bool:
+        """不查库判断 session_id 是否可能存在
+
+        格式不对或布隆过滤器判断不存在的直接拒绝。其他进程在过滤器构建之后创建的
+        session 不在本进程的过滤器中，按 session_id 的时间前缀放行查库；配置了 SESSION_SECRET 时
+        时间前缀要有正确的 HMAC 标签，伪造的 session_id 不会到达存储
+
+        删除的 session 不从过滤器中移除 (可能是其他进程添加的，误判时会减掉别的 key 的计数)，
+        由定期重建清理
+        """
+        if not is_session_id(session_id):
+            self.bloom_rejects += 1
+            return False
+        bloom = self.bloom
+        if bloom is None or session_id in bloom:
+            return True
+        ts = session_id_time(session_id)
+        # 留 60 秒给构建期间创建的 session 和多机时钟误差
+        if ts is not None and self.bloom_built_at - 60 <= ts <= time.time() + 60 and (
+                self.id_key is None or verify_session_id(session_id, self.id_key)):
+            return True
+        self.bloom_rejects += 1
+        return False
+
+    def bloom_stats(self) -> dict:
+        ret = {'name': 'session_bloom', 'built_at': self.bloom_built_at, 'rejects': self.bloom_rejects}
+        if self.bloom is not None:
+            ret.update(self.bloom.stats())
+        return ret
+
+    def build_bloom(self) -> int:
+        """从存储加载有效 session_id 重建布隆过滤器"""
+        built_at = int(time.time())
+        ids = list(self.store.session_ids(built_at))
+        bloom = CountingBloomFilter(
+            max(settings.SESSION_BLOOM_CAPACITY, len(ids) * 2),
+            settings.SESSION_BLOOM_ERROR_RATE,
         )
+        bloom.update(ids)
+        self.bloom, self.bloom_built_at = bloom, built_at
+        log.info("session 布隆过滤器: count=%d, size=%d", len(ids), bloom.size)
+        return len(ids)
+
+    def start_bloom(self, rebuild_interval: int = 600):
+        """构建布隆过滤器并启动后台定期重建 (清理已删除和过期的 session)"""
+        def run():
+            while not self._bloom_stop.wait(rebuild_interval):
+                try:
+                    self.build_bloom()
+                except Exception:
+                    log.error(traceback.format_exc())
+
+        if self.id_key is None:
+            log.warning("未配置 SESSION_SECRET，其他进程新建的 session 按时间前缀放行查库")
+        self.build_bloom()
+        if self._bloom_thread and self._bloom_thread.is_alive():
+            return
+        self._bloom_stop.clear()
+        self._bloom_thread = threading.Thread(target=run, name='session-bloom', daemon=True)
+        self._bloom_thread.start()
+
+    def stop_bloom(self):
+        self._bloom_stop.set()
+
+    def touch(self, session: SessionData):
+        """滑动过期: 距上次续期超过 touch_interval 时延长过期时间
+
+        只修改内存中的 SessionData 并记入待写集合，由后台线程合并写入，
+        同一个 session 每个间隔最多写一次
+        """
+        if not self.touch_interval:
+            return
+        now = int(time.time())
+        if session.expire_at - now >= settings.SESSION_EXPIRE_SECONDS - self.touch_interval:
+            return
+        session.expire_at = now + settings.SESSION_EXPIRE_SECONDS
+        with self._touch_lock:
+            self._touches[session.session_id] = session.expire_at
+        self.shm_set(session)
+
+    def flush_touches(self) -> int:
+        """写入待续期的 session，同一批使用相同的过期时间"""
+        with self._touch_lock:
+            touches, self._touches = self._touches, {}
+        if not touches:
+            return 0
+        expire_at = max(touches.values())
+        n = self.store.touch(list(touches), expire_at)
+        log.debug("session 续期: %d/%d 个, expire_at=%s", n, len(touches), expire_at)
+        return n
+
+    def start_toucher(self, touch_interval: int = 3600, flush_interval: int = 10):
+        """开启滑动过期并启动后台写入线程"""
+        def run():
+            while not self._toucher_stop.wait(flush_interval):
+                try:
+                    self.flush_touches()
+                except Exception:
+                    log.error(traceback.format_exc())
+
+        self.touch_interval = touch_interval
+        if self._toucher and self._toucher.is_alive():
+            return
+        self._toucher_stop.clear()
+        self._toucher = threading.Thread(target=run, name='session-toucher', daemon=True)
+        self._toucher.start()
+
+    def stop_toucher(self):
+        """停止后台线程并写入剩余的续期"""
+        self.touch_interval = 0
+        self._toucher_stop.set()
+        try:
+            self.flush_touches()
+        except Exception:
+            log.error(traceback.format_exc())
 
     def delete_session(self, session_id: str) -> bool:
         """删除 session
@@ -140,11 +535,17 @@ class SessionService:
         Returns:
             是否删除成功
         """
-        with get_connection(self.DB_NAME) as db:
-            affected = db.delete(self.TABLE, where={'session_id': session_id})
-
-        if affected:
-            log.info(f"删除 session: session_id={session_id[:8]}...")
+        self.cache.pop(session_id)
+        if self.shm is not None:
+            self.shm.delete(session_id)
+        if self.signed:
+            self.revocation.revoke(session_id, int(time.time()) + settings.SESSION_EXPIRE_SECONDS)
+            bus.publish('user_session', 'revoke_sid', session_id)
+        else:
+            bus.publish('user_session', 'session_id', session_id)
+
+        if self.store.delete(session_id):
+            log.info("删除 session: session_id=%s...", session_id[:8])
             return True
         return False
 
@@ -157,76 +558,85 @@ class SessionService:
         Returns:
             是否删除成功
         """
-        with get_connection(self.DB_NAME) as db:
-            affected = db.delete(self.TABLE, where={'openid': openid})
-
-        if affected:
-            log.info(f"删除 session: openid={openid}")
+        self.cache.pop_by_index(openid)
+        if self.shm is not None:
+            self.shm_openid.delete(openid)
+        if self.signed:
+            self.revoke_openid(openid, int(time.time() * 1000))
+        else:
+            bus.publish('user_session', 'openid', openid)
+
+        if self.store.delete_by_openid(openid):
+            log.info("删除 session: openid=%s", openid)
             return True
         return False
 
-    def update_session(self, session_id: str, **kwargs) -> bool:
-        """更新 session 数据
-        
-        Args:
-            session_id: session 标识
-            **kwargs: 要更新的字段 (nickname, avatar_url)
-            
-        Returns:
-            是否更新成功
-        """
-        # 只允许更新特定字段
-        allowed_fields = {'nickname', 'avatar_url'}
-        update_data = {k: v for k, v in kwargs.items() if k in allowed_fields}
+    def update_claims(self, openid: str, role: Optional[int] = None, state: Optional[int] = None) -> bool:
+        """用户角色 / 状态变化后刷新该用户 session 中的冗余字段
 
-        if not update_data:
+        签名 token 中的角色无法修改，签名模式下删除该用户的 session 并吊销已签发的 token，需要重新登录。
+        其他进程通过广播立即吊销；没有广播时由吊销过滤的定期刷新发现 session 已不在存储中，
+        重启后的进程同样如此
+        """
+        values = {k: v for k, v in (('role', role), ('state', state)) if v is not None}
+        if not values:
             return False
 
-        with get_connection(self.DB_NAME) as db:
-            affected = db.update(
-                self.TABLE,
-                values=update_data,
-                where={'session_id': session_id}
-            )
-
-        return affected > 0
-
-    def cleanup_expired(self) -> int:
-        """清理过期的 session
+        self.cache.pop_by_index(openid)
+        if self.shm is not None:
+            self.shm_openid.delete(openid)
+        if self.signed:
+            self.revoke_openid(openid, int(time.time() * 1000))
+            ret = self.store.delete_by_openid(openid)
+        else:
+            ret = self.store.update_by_openid(openid, values)
+            bus.publish('user_session', 'openid', openid)
+        log.info("更新 session 权限: openid=%s, data=%s", openid, values)
+        return ret
+
+    def cleanup_expired(self, chunk: int = 0, pause: float = 0) -> int:
+        """清理过期的 session (redis 依赖 TTL 过期，返回 0)
         
+        Args:
+            chunk: 分批删除的每批条数，0 为一次删除
+            pause: 每批之间暂停的秒数
+            
         Returns:
             清理的数量
         """
-        now = int(time.time())
-        with get_connection(self.DB_NAME) as db:
-            affected = db.delete(
-                self.TABLE,
-                where={'expire_at': ('<', now)}
-            )
+        affected = self.store.cleanup_expired(int(time.time()), chunk, pause)
 
         if affected:
-            log.info(f"清理过期 session: {affected} 个")
+            log.info("清理过期 session: %s 个", affected)
 
         return affected
 
+    def start_reaper(self, interval: int = 300, chunk: int = 500, pause: float = 0.1):
+        """启动后台线程定期分批清理过期 session"""
+        def run():
+            while not self._reaper_stop.wait(interval):
+                try:
+                    self.cleanup_expired(chunk, pause)
+                except Exception:
+                    log.error(traceback.format_exc())
+
+        if self._reaper and self._reaper.is_alive():
+            return
+        self._reaper_stop.clear()
+        self._reaper = threading.Thread(target=run, name='session-reaper', daemon=True)
+        self._reaper.start()
+
+    def stop_reaper(self):
+        self._reaper_stop.set()
+
     def get_or_create_user(self, openid: str, session_key: str, **kwargs) -> tuple:
         """获取或创建用户 session
         
         Returns:
             (session_id, is_new_user)
         """
-        # 检查是否有有效的 session
-        with get_connection(self.DB_NAME) as db:
-            row = db.select_one(
-                self.TABLE,
-                where={'openid': openid},
-                fields=['session_id', 'expire_at']
-            )
-
-        is_new_user = row is None
-
-        # 创建新 session
-        session_id = self.create_session(
+        # 替换 session 的同时得到之前是否有 session (mysql 为一条 upsert)
+        session_id, is_new_user = self._create_session(
             openid=openid,
             session_key=session_key,
             **kwargs
@@ -235,5 +645,20 @@ class SessionService:
         return session_id, is_new_user
 
 
+def _snapshot_session(session: SessionData) -> dict:
+    # 微信 session_key 不写入快照文件
+    data = asdict(session)
+    data.pop('session_key', None)
+    return data
+
+
+def _restore_session(data: dict) -> Optional[SessionData]:
+    session = SessionData(**dict(data, session_key=''))
+    return None if session.is_expired() else session
+
+
 # 全局单例
 session_service = SessionService()
+
+snapshot.register('session', session_service.cache, session_service.store.change_marker,
+                  encode=_snapshot_session, decode=_restore_session)
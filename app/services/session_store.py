@@ -0,0 +1,377 @@
+# coding: utf-8
+"""Session 存储后端
+
+SessionService 通过 SessionStore 读写 session，由 settings.SESSION_STORE 选择:
+    - mysql: user_session 表 (默认，dbpool 支持的引擎都可以)
+    - memory: 进程内字典，单节点部署使用，重启丢失
+    - redis: Redis 协议服务，依赖 key 的 TTL 过期，不需要定期清理
+
+session 以字典传递，字段与 user_session 表一致:
+session_id, openid, session_key, nickname, avatar_url, created_at, expire_at, role, state
+(role / state 是 club_user 的冗余，用于不查用户表的权限判断)
+"""
+
+import json
+import time
+import logging
+import threading
+from typing import Dict, Iterator, List, Optional
+
+from app.config import settings
+from app.db import get_connection
+
+log = logging.getLogger(__name__)
+
+SESSION_FIELDS = [
+    'session_id', 'openid', 'session_key', 'nickname', 'avatar_url', 'created_at', 'expire_at', 'role', 'state',
+]
+
+
+class SessionStore:
+    """session 存储接口"""
+
+    name = ''
+    # 是否支持 get_with_user (session 和用户表在同一个库)
+    joinable = False
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        """按 session_id 读取，不检查过期"""
+        raise NotImplementedError
+
+    def get_with_user(self, session_id: str, user_table: str, user_fields: List[str]) -> tuple:
+        """按 session_id 读取 session，同时按 openid 关联读取用户，返回 (session 或 None, 用户 或 None)"""
+        raise NotImplementedError
+
+    def create(self, session: Dict) -> bool:
+        """保存新 session 并替换该用户的旧 session，返回之前是否没有 session"""
+        raise NotImplementedError
+
+    def delete(self, session_id: str) -> bool:
+        raise NotImplementedError
+
+    def delete_by_openid(self, openid: str) -> bool:
+        raise NotImplementedError
+
+    def update(self, session_id: str, values: Dict) -> bool:
+        raise NotImplementedError
+
+    def update_by_openid(self, openid: str, values: Dict) -> bool:
+        raise NotImplementedError
+
+    def touch(self, session_ids: List[str], expire_at: int) -> int:
+        """批量延长过期时间，返回更新数量"""
+        raise NotImplementedError
+
+    def cleanup_expired(self, now: int, chunk: int = 0, pause: float = 0) -> int:
+        """删除 expire_at < now 的 session，返回删除数量
+
+        Args:
+            chunk: 每次最多删除的条数，0 为一次删除
+            pause: 两次删除之间暂停的秒数
+        """
+        return 0
+
+    def session_ids(self, now: int) -> Iterator[str]:
+        """未过期的 session_id"""
+        raise NotImplementedError
+
+    def change_marker(self):
+        """存储的变更标记，用于判断缓存快照是否仍然有效，None 表示不支持"""
+        return None
+
+
+class MySQLSessionStore(SessionStore):
+    """user_session 表
+
+    数据库表结构:
+    CREATE TABLE `user_session` (
+        `id` int(11) NOT NULL AUTO_INCREMENT,
+        `session_id` varchar(64) NOT NULL COMMENT 'Session ID',
+        `openid` varchar(64) NOT NULL COMMENT '微信 openid',
+        `session_key` varchar(128) NOT NULL COMMENT '微信 session_key',
+        `nickname` varchar(64) DEFAULT NULL COMMENT '用户昵称',
+        `avatar_url` varchar(512) DEFAULT NULL COMMENT '头像 URL',
+        `created_at` int(11) NOT NULL COMMENT '创建时间戳',
+        `expire_at` int(11) NOT NULL COMMENT '过期时间戳',
+        `role` smallint NOT NULL DEFAULT '1' COMMENT '用户角色 (club_user.role 冗余)',
+        `state` smallint NOT NULL DEFAULT '1' COMMENT '用户状态 (club_user.state 冗余)',
+        `ctime` datetime DEFAULT CURRENT_TIMESTAMP,
+        `utime` datetime DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        PRIMARY KEY (`id`),
+        UNIQUE KEY `uk_session_id` (`session_id`),
+        UNIQUE KEY `uk_openid` (`openid`),
+        KEY `idx_expire_at` (`expire_at`)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='用户会话表';
+    """
+
+    name = 'mysql'
+    joinable = True
+    TABLE = 'user_session'
+    DB_NAME = 'xclub'
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        with get_connection(self.DB_NAME) as db:
+            return db.select_one(self.TABLE, where={'session_id': session_id}, fields=SESSION_FIELDS)
+
+    def get_with_user(self, session_id: str, user_table: str, user_fields: List[str]) -> tuple:
+        # 一条 left join，用户字段加 u_ 前缀避免和 session 字段重名
+        fields = ['s.%s' % x for x in SESSION_FIELDS] + ['u.%s as u_%s' % (x, x) for x in user_fields]
+        with get_connection(self.DB_NAME) as db:
+            row = db.select_join_one(
+                self.TABLE + ' s', user_table + ' u', 'left',
+                on={'s.openid': 'u.openid'},
+                where={'s.session_id': session_id},
+                fields=fields,
+            )
+        if not row:
+            return None, None
+        session = {x: row[x] for x in SESSION_FIELDS}
+        user = {x: row['u_' + x] for x in user_fields} if row['u_openid'] is not None else None
+        return session, user
+
+    def create(self, session: Dict) -> bool:
+        # openid 唯一，一条 insert ... on duplicate key update 替换旧 session
+        with get_connection(self.DB_NAME) as db:
+            return db.upsert(self.TABLE, session, 'openid') == 1
+
+    def delete(self, session_id: str) -> bool:
+        with get_connection(self.DB_NAME) as db:
+            return db.delete(self.TABLE, where={'session_id': session_id}) > 0
+
+    def delete_by_openid(self, openid: str) -> bool:
+        with get_connection(self.DB_NAME) as db:
+            return db.delete(self.TABLE, where={'openid': openid}) > 0
+
+    def update(self, session_id: str, values: Dict) -> bool:
+        with get_connection(self.DB_NAME) as db:
+            # 只在值有变化时更新，MySQL 和 SQLite 都返回有变化的行数
+            return db.update_changed(self.TABLE, values=values, where={'session_id': session_id}) > 0
+
+    def update_by_openid(self, openid: str, values: Dict) -> bool:
+        with get_connection(self.DB_NAME) as db:
+            return db.update(self.TABLE, values=values, where={'openid': openid}) > 0
+
+    REAPER_LOCK = 'xclub:session_reaper'
+    TOUCH_CHUNK = 500
+
+    def touch(self, session_ids: List[str], expire_at: int) -> int:
+        # 按 in 分批，所有批次一次发送
+        with get_connection(self.DB_NAME) as db:
+            p = db.pipeline()
+            for i in range(0, len(session_ids), self.TOUCH_CHUNK):
+                chunk = session_ids[i:i + self.TOUCH_CHUNK]
+                p.update(self.TABLE, {'expire_at': expire_at}, where={'session_id': ('in', chunk)})
+            return sum(x.affected for x in p.execute())
+
+    def cleanup_expired(self, now: int, chunk: int = 0, pause: float = 0) -> int:
+        where = {'expire_at': ('<', now)}
+        with get_connection(self.DB_NAME) as db:
+            if not chunk:
+                return db.delete(self.TABLE, where=where)
+
+            # 多个实例同时启动清理时只有拿到锁的执行，锁随连接断开自动释放
+            if not db.get_lock(self.REAPER_LOCK, 0):
+                log.debug("session 清理由其他实例执行")
+                return 0
+            total = 0
+            try:
+                while True:
+                    affected = db.delete(self.TABLE, where=where, other='limit %d' % chunk)
+                    total += affected
+                    if affected < chunk:
+                        break
+                    time.sleep(pause)
+            finally:
+                db.release_lock(self.REAPER_LOCK)
+        return total
+
+    def session_ids(self, now: int) -> Iterator[str]:
+        with get_connection(self.DB_NAME) as db:
+            rows = db.select(self.TABLE, where={'expire_at': ('>=', now)}, fields='session_id', isdict=False)
+        return (x[0] for x in rows)
+
+    def change_marker(self):
+        # 行数 + 最大 id + 最大更新时间，插入、删除和更新都会改变
+        with get_connection(self.DB_NAME) as db:
+            row = db.select_one(self.TABLE, fields='count(*),max(id),max(utime)', isdict=False)
+        return list(row)
+
+
+class MemorySessionStore(SessionStore):
+    """进程内存储，只适合单进程部署"""
+
+    name = 'memory'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions: Dict[str, Dict] = {}
+        self.openids: Dict[str, str] = {}   # openid -> session_id
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        row = self.sessions.get(session_id)
+        return dict(row) if row else None
+
+    def create(self, session: Dict) -> bool:
+        with self.lock:
+            old = self.openids.get(session['openid'])
+            if old:
+                self.sessions.pop(old, None)
+            self.sessions[session['session_id']] = dict(session)
+            self.openids[session['openid']] = session['session_id']
+        return old is None
+
+    def delete(self, session_id: str) -> bool:
+        with self.lock:
+            row = self.sessions.pop(session_id, None)
+            if row is None:
+                return False
+            if self.openids.get(row['openid']) == session_id:
+                del self.openids[row['openid']]
+            return True
+
+    def delete_by_openid(self, openid: str) -> bool:
+        with self.lock:
+            session_id = self.openids.pop(openid, None)
+            return session_id is not None and self.sessions.pop(session_id, None) is not None
+
+    def update(self, session_id: str, values: Dict) -> bool:
+        with self.lock:
+            row = self.sessions.get(session_id)
+            if row is None:
+                return False
+            row.update(values)
+            return True
+
+    def update_by_openid(self, openid: str, values: Dict) -> bool:
+        session_id = self.openids.get(openid)
+        return session_id is not None and self.update(session_id, values)
+
+    def touch(self, session_ids: List[str], expire_at: int) -> int:
+        n = 0
+        with self.lock:
+            for session_id in session_ids:
+                row = self.sessions.get(session_id)
+                if row is not None:
+                    row['expire_at'] = expire_at
+                    n += 1
+        return n
+
+    def cleanup_expired(self, now: int, chunk: int = 0, pause: float = 0) -> int:
+        with self.lock:
+            expired = [k for k, v in self.sessions.items() if v['expire_at'] < now]
+            for session_id in expired:
+                row = self.sessions.pop(session_id)
+                if self.openids.get(row['openid']) == session_id:
+                    del self.openids[row['openid']]
+        return len(expired)
+
+    def session_ids(self, now: int) -> Iterator[str]:
+        return [k for k, v in list(self.sessions.items()) if v['expire_at'] >= now]
+
+
+class RedisSessionStore(SessionStore):
+    """Redis 协议存储
+
+    - {prefix}session:{session_id} -> session json，TTL 为剩余有效期
+    - {prefix}session_openid:{openid} -> session_id，TTL 相同
+    """
+
+    name = 'redis'
+
+    def __init__(self, client, prefix: str = 'xclub:'):
+        self.client = client
+        self.skey = prefix + 'session:'
+        self.okey = prefix + 'session_openid:'
+
+    @staticmethod
+    def ttl(session: Dict) -> int:
+        return max(int(session['expire_at']) - int(time.time()), 1)
+
+    @staticmethod
+    def dumps(session: Dict) -> str:
+        return json.dumps({k: session.get(k) for k in SESSION_FIELDS}, ensure_ascii=False)
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        data = self.client.get(self.skey + session_id)
+        return json.loads(data) if data else None
+
+    def create(self, session: Dict) -> bool:
+        okey = self.okey + session['openid']
+        ttl = self.ttl(session)
+        old = self.client.get(okey)
+        commands = [
+            ('SET', self.skey + session['session_id'], self.dumps(session), 'EX', ttl),
+            ('SET', okey, session['session_id'], 'EX', ttl),
+        ]
+        if old:
+            commands.insert(0, ('DEL', self.skey + old.decode('utf-8')))
+        self.client.pipeline(commands)
+        return old is None
+
+    def delete(self, session_id: str) -> bool:
+        # 读出 openid，session 和 openid 索引一起删除
+        # (create 替换旧 session 时会删除旧的 session key，session key 存在说明索引指向它)
+        data = self.client.get(self.skey + session_id)
+        if not data:
+            return False
+        okey = self.okey + json.loads(data)['openid']
+        return self.client.pipeline([('DEL', self.skey + session_id), ('DEL', okey)])[0] > 0
+
+    def delete_by_openid(self, openid: str) -> bool:
+        okey = self.okey + openid
+        old = self.client.get(okey)
+        if not old:
+            return False
+        return self.client.delete(self.skey + old.decode('utf-8'), okey) > 0
+
+    def update(self, session_id: str, values: Dict) -> bool:
+        session = self.get(session_id)
+        if session is None:
+            return False
+        session.update(values)
+        self.client.set(self.skey + session_id, self.dumps(session), ex=self.ttl(session))
+        return True
+
+    def update_by_openid(self, openid: str, values: Dict) -> bool:
+        session_id = self.client.get(self.okey + openid)
+        return bool(session_id) and self.update(session_id.decode('utf-8'), values)
+
+    def touch(self, session_ids: List[str], expire_at: int) -> int:
+        # 一次 mget 读出，再一次 pipeline 写回并延长两个 key 的 TTL
+        if not session_ids:
+            return 0
+        rows = self.client.execute('MGET', *[self.skey + x for x in session_ids])
+        ttl = max(expire_at - int(time.time()), 1)
+        commands = []
+        for data in rows:
+            if not data:
+                continue
+            session = json.loads(data)
+            session['expire_at'] = expire_at
+            commands.append(('SET', self.skey + session['session_id'], self.dumps(session), 'EX', ttl))
+            commands.append(('EXPIRE', self.okey + session['openid'], ttl))
+        self.client.pipeline(commands)
+        return len(commands) // 2
+
+    def session_ids(self, now: int) -> Iterator[str]:
+        n = len(self.skey)
+        return (k[n:].decode('utf-8') for k in self.client.scan_iter(self.skey + '*'))
+
+
+def create_session_store(name: str) -> SessionStore:
+    """按名称创建存储后端"""
+    if name == 'memory':
+        return MemorySessionStore()
+    if name == 'redis':
+        from app.db.resp import RedisClient
+        client = RedisClient(
+            host=settings.REDIS_HOST,
+            port=settings.REDIS_PORT,
+            db=settings.REDIS_DB,
+            password=settings.REDIS_PASSWORD,
+            maxconn=settings.REDIS_POOL_SIZE,
+        )
+        return RedisSessionStore(client, settings.REDIS_PREFIX)
+    if name != 'mysql':
+        log.warning("未知的 SESSION_STORE=%s，使用 mysql", name)
+    return MySQLSessionStore()
@@ -1,15 +1,28 @@
 # coding: utf-8
 """用户服务"""
 
+import time
 import logging
-from typing import Optional, Dict, Any
+import threading
+import traceback
+from typing import Optional, Dict, Any, Iterable, List
 
+from app.config import settings
+from app.core import snapshot
+from app.core.bus import bus
+from app.core.cache import LRUCache, MISSING
+from app.core.search import NGramIndex
 from app.db import get_connection
-from app.schemas.user import ROLE_NAME_MAP, UserRole
+from app.schemas.user import ROLE_NAME_MAP, UserRole, UserSex, UserState
 
 log = logging.getLogger(__name__)
 
 
+def _same(a, b) -> bool:
+    # 缓存中的日期已格式化为字符串，按字符串比较
+    return a == b or (a is not None and b is not None and str(a) == str(b))
+
+
 class UserService:
     """用户服务
     
@@ -36,6 +49,219 @@ class UserService:
 
     TABLE = 'club_user'
     DB_NAME = 'xclub'
+    FIELDS = [
+        'id', 'openid', 'nickname', 'avatar', 'realname', 'phone_num', 'sex', 'birthday',
+        'address', 'email', 'role', 'state', 'create_time', 'update_time',
+    ]
+    # 批量查询时每条 in 语句的最大值数
+    BATCH_SIZE = 500
+    # 搜索索引: 匹配的字段，以及索引中保存的字段 (随搜索结果返回)
+    SEARCH_FIELDS = ['nickname', 'realname', 'phone_num']
+    SEARCH_DOC_FIELDS = ['id', 'openid', 'nickname', 'realname', 'phone_num', 'avatar', 'role', 'state']
+    # 用户可以修改的资料字段及表上的默认值
+    PROFILE_DEFAULTS = {
+        'nickname': '', 'avatar': '', 'realname': '', 'phone_num': '',
+        'sex': UserSex.UNKNOWN, 'birthday': None, 'address': '', 'email': '',
+    }
+
+    def __init__(self):
+        # openid -> 用户信息 (None 表示不存在)，按 id 建二级索引
+        self.cache = LRUCache(
+            maxsize=settings.USER_CACHE_SIZE,
+            ttl=settings.USER_CACHE_TTL,
+            name='user',
+            index=lambda x: x['id'] if x else None,
+        )
+        # 每次失效加一，查库期间发生过失效的结果不写入缓存，避免写回旧数据
+        self.generation = 0
+        # 和当前值相同被跳过的写入次数
+        self.skipped_writes = 0
+
+        # 昵称 / 姓名 / 手机号搜索索引，openid -> 文档，start_search_index 之后生效
+        self.search = self._new_search_index()
+        self.search_enabled = False
+        self.search_built_at = 0
+        # 重建期间被修改的 openid，新索引替换上去之后重新读取
+        self._search_dirty = None
+        self._search_thread = None
+        # 等待后台重新读取的 openid
+        self._reindex_pending = set()
+        self._reindex_lock = threading.Lock()
+        self._reindex_run_lock = threading.Lock()
+        self._reindex_event = threading.Event()
+        self._reindex_thread = None
+
+        bus.subscribe(self.TABLE, self.on_invalidate)
+
+    def _new_search_index(self) -> NGramIndex:
+        # 同一匹配级别内新用户在前
+        return NGramIndex(self.SEARCH_FIELDS, sort_key=lambda x: -x['id'])
+
+    def _format(self, user: Dict[str, Any]) -> Dict[str, Any]:
+        user['role_name'] = ROLE_NAME_MAP.get(user.get('role', 1), '游客')
+        # 格式化日期时间
+        for field in ('birthday', 'create_time', 'update_time'):
+            if user.get(field):
+                user[field] = str(user[field])
+        return user
+
+    def _cache_set(self, openid: str, user: Optional[Dict[str, Any]], gen: int):
+        if gen != self.generation:
+            return
+        self.cache.set(openid, user, ttl=None if user else settings.USER_CACHE_NEGATIVE_TTL)
+
+    def prime(self, openid: str, row: Optional[Dict[str, Any]], gen: int) -> Optional[Dict[str, Any]]:
+        """用其他查询 (例如关联 session 表) 取到的 FIELDS 行填充缓存，返回格式化后的副本
+
+        Args:
+            gen: 查询之前的 generation，期间有失效时不写入缓存
+        """
+        if row:
+            self._format(row)
+        self._cache_set(openid, row, gen)
+        return dict(row) if row else None
+
+    def invalidate(self, openid: str, row: Optional[Dict[str, Any]] = None):
+        """用户数据修改后清理本进程缓存并通知其他进程
+
+        Args:
+            row: 写入之后完整的用户信息 (调用方合并得到)，直接写入缓存和搜索索引；
+                没有时搜索索引由后台线程重新读取，不在请求路径上查库
+        """
+        self.generation += 1
+        self.cache.pop(openid)
+        bus.publish(self.TABLE, 'openid', openid)
+        if row is not None:
+            self._format(row)
+            self._cache_set(openid, row, self.generation)
+        if self.search_enabled:
+            if row is not None:
+                self._index_row(openid, row)
+            else:
+                self.queue_reindex(openid)
+
+    def on_invalidate(self, column: str, value: str):
+        """收到其他进程的失效事件"""
+        if column == 'openid':
+            self.generation += 1
+            self.cache.pop(value)
+            if self.search_enabled:
+                self.queue_reindex(value)
+
+    def _index_row(self, openid: str, row: Dict[str, Any]):
+        if self._search_dirty is not None:
+            self._search_dirty.add(openid)
+        self.search.add(openid, {k: row.get(k) for k in self.SEARCH_DOC_FIELDS})
+
+    def queue_reindex(self, openid: str):
+        """交给后台线程重新读取该用户更新搜索索引"""
+        with self._reindex_lock:
+            self._reindex_pending.add(openid)
+        self._reindex_event.set()
+
+    def reindex_pending(self) -> int:
+        """一次 in 查询重新读取排队的用户更新搜索索引，返回处理的数量
+
+        写入的字段只是部分值，不能直接合并到索引文档中 (新建时缺少默认值，
+        其他字段可能已被其他进程修改)，统一读取完整的行，同时填充缓存
+        """
+        with self._reindex_run_lock:
+            with self._reindex_lock:
+                pending, self._reindex_pending = self._reindex_pending, set()
+            if not pending:
+                return 0
+            if self._search_dirty is not None:
+                self._search_dirty.update(pending)
+            users = self.get_users_by_openids(pending)
+            for openid in pending:
+                user = users.get(openid)
+                if user:
+                    self.search.add(openid, {k: user.get(k) for k in self.SEARCH_DOC_FIELDS})
+                else:
+                    self.search.remove(openid)
+            return len(pending)
+
+    def _run_reindex(self):
+        while True:
+            self._reindex_event.wait()
+            self._reindex_event.clear()
+            try:
+                self.reindex_pending()
+            except Exception:
+                log.error(traceback.format_exc())
+
+    def reindex(self, openid: str):
+        """从数据库重新读取一个用户更新搜索索引"""
+        if self._search_dirty is not None:
+            self._search_dirty.add(openid)
+        with get_connection(self.DB_NAME) as db:
+            row = db.select_one(self.TABLE, where={'openid': openid}, fields=self.SEARCH_DOC_FIELDS)
+        if row:
+            self.search.add(openid, row)
+        else:
+            self.search.remove(openid)
+
+    SCAN_BATCH = 1000
+
+    def build_search_index(self) -> int:
+        """按 id 分批扫描 club_user 重建搜索索引，返回文档数"""
+        index = self._new_search_index()
+        self._search_dirty = set()
+        last = 0
+        while True:
+            with get_connection(self.DB_NAME) as db:
+                rows = db.select(self.TABLE, where={'id': ('>', last)}, fields=self.SEARCH_DOC_FIELDS,
+                                 other='order by id limit %d' % self.SCAN_BATCH)
+            for row in rows:
+                index.add(row['openid'], row)
+            if len(rows) < self.SCAN_BATCH:
+                break
+            last = rows[-1]['id']
+
+        # 先替换，之后的修改直接写入新索引；替换之前的修改重新读取
+        self.search = index
+        dirty, self._search_dirty = self._search_dirty, None
+        for openid in dirty:
+            self.reindex(openid)
+        self.search_built_at = int(time.time())
+        log.info("func=build_search_index|docs=%d|dirty=%d", len(index), len(dirty))
+        return len(index)
+
+    def start_search_index(self):
+        """启用搜索索引，后台线程扫描建立"""
+        def run():
+            try:
+                self.build_search_index()
+            except Exception:
+                self._search_dirty = None
+                log.error(traceback.format_exc())
+
+        if self._search_thread and self._search_thread.is_alive():
+            return
+        self.search_enabled = True
+        self._search_thread = threading.Thread(target=run, name='user-search-build', daemon=True)
+        self._search_thread.start()
+        if self._reindex_thread is None:
+            self._reindex_thread = threading.Thread(target=self._run_reindex, name='user-search-reindex', daemon=True)
+            self._reindex_thread.start()
+
+    def search_users(self, query: str, limit: int = 20, fields: Optional[List[str]] = None,
+                     state: Optional[int] = None) -> List[Dict[str, Any]]:
+        """按昵称 / 姓名 / 手机号子串搜索用户
+
+        Args:
+            fields: 只匹配这些字段，默认 SEARCH_FIELDS
+            state: 只返回该状态的用户
+        """
+        where = (lambda x: x.get('state') == state) if state is not None else None
+        users = self.search.search(query, limit, fields=fields, where=where)
+        for user in users:
+            user['role_name'] = ROLE_NAME_MAP.get(user.get('role', 1), '游客')
+        return users
+
+    def search_stats(self) -> Dict[str, Any]:
+        return dict(self.search.stats(), name='user_search', enabled=self.search_enabled,
+                    built_at=self.search_built_at)
 
     def get_user_by_openid(self, openid: str) -> Optional[Dict[str, Any]]:
         """通过 openid 获取用户信息
@@ -44,20 +270,18 @@ class UserService:
             openid: 微信 openid
             
         Returns:
-            用户信息字典，不存在返回 None
+            用户信息字典 (副本，可以修改)，不存在返回 None
         """
-        with get_connection(self.DB_NAME) as db:
-            user = db.select_one(self.TABLE, where={'openid': openid})
-
-        if user:
-            user['role_name'] = ROLE_NAME_MAP.get(user.get('role', 1), '游客')
-            # 格式化日期时间
-            if user.get('birthday'):
-                user['birthday'] = str(user['birthday'])
-            if user.get('create_time'):
-                user['create_time'] = str(user['create_time'])
+        user = self.cache.get(openid, MISSING)
+        if user is MISSING:
+            gen = self.generation
+            with get_connection(self.DB_NAME) as db:
+                user = db.select_one(self.TABLE, where={'openid': openid})
+            if user:
+                self._format(user)
+            self._cache_set(openid, user, gen)
 
-        return user
+        return dict(user) if user else None
 
     def get_user_by_id(self, user_id: int) -> Optional[Dict[str, Any]]:
         """通过 ID 获取用户信息
@@ -66,19 +290,130 @@ class UserService:
             user_id: 用户 ID
             
         Returns:
-            用户信息字典，不存在返回 None
+            用户信息字典 (副本，可以修改)，不存在返回 None
         """
+        for cached in self.cache.get_by_index(user_id):
+            user = self.cache.get(cached['openid'])
+            if user:
+                return dict(user)
+
+        gen = self.generation
         with get_connection(self.DB_NAME) as db:
             user = db.select_one(self.TABLE, where={'id': user_id})
 
         if user:
-            user['role_name'] = ROLE_NAME_MAP.get(user.get('role', 1), '游客')
-            if user.get('birthday'):
-                user['birthday'] = str(user['birthday'])
-            if user.get('create_time'):
-                user['create_time'] = str(user['create_time'])
+            self._format(user)
+            self._cache_set(user['openid'], user, gen)
+            return dict(user)
+        return None
 
-        return user
+    def _get_users(self, column: str, values: Iterable, key) -> Dict[Any, Dict[str, Any]]:
+        """按 column in (...) 批量查询未缓存的用户，key(value) 为缓存中查找该值的用户"""
+        ret = {}
+        missing = []
+        for value in dict.fromkeys(values):
+            user = key(value)
+            if user is MISSING:
+                missing.append(value)
+            elif user:
+                ret[value] = dict(user)
+        if not missing:
+            return ret
+
+        # 分批 in 查询，所有批次一次发送
+        gen = self.generation
+        with get_connection(self.DB_NAME) as db:
+            p = db.pipeline()
+            for i in range(0, len(missing), self.BATCH_SIZE):
+                p.select(self.TABLE, where={column: ('in', missing[i:i + self.BATCH_SIZE])})
+            rows = [row for x in p.execute() for row in x.rows or []]
+
+        found = {}
+        for row in rows:
+            self._format(row)
+            found[row[column]] = row
+        for value in missing:
+            user = found.get(value)
+            if user:
+                self._cache_set(user['openid'], user, gen)
+                ret[value] = dict(user)
+            elif column == 'openid':
+                self._cache_set(value, None, gen)
+        return ret
+
+    def get_users_by_openids(self, openids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """批量获取用户信息，先查缓存，其余用 in 查询
+
+        Returns:
+            openid -> 用户信息，不存在的 openid 不在结果中
+        """
+        return self._get_users('openid', openids, lambda x: self.cache.get(x, MISSING))
+
+    def get_users_by_ids(self, user_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        """批量获取用户信息，先查缓存，其余用 in 查询
+
+        Returns:
+            用户 ID -> 用户信息，不存在的 ID 不在结果中
+        """
+        def cached(user_id):
+            for user in self.cache.get_by_index(user_id):
+                user = self.cache.get(user['openid'])
+                if user:
+                    return user
+            return MISSING
+
+        return self._get_users('id', user_ids, cached)
+
+    def list_users(
+        self,
+        page: int = 1,
+        pagesize: int = 20,
+        role: Optional[int] = None,
+        state: Optional[int] = None,
+        fields: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        """分页列出用户，按 ID 倒序
+
+        Args:
+            role: 按角色过滤
+            state: 按状态过滤
+            fields: 返回的字段，必须在 FIELDS 中，默认全部
+
+        Returns:
+            {page, pagesize, pagecount, data}
+        """
+        fields = [x for x in fields if x in self.FIELDS] if fields else list(self.FIELDS)
+        if not fields:
+            fields = ['id']
+        where = {}
+        if role is not None:
+            where['role'] = role
+        if state is not None:
+            where['state'] = state
+
+        with get_connection(self.DB_NAME) as db:
+            ret = db.select_page_simple(self.TABLE, page, pagesize, where=where or None,
+                                        fields=fields, other='order by id desc')
+        for row in ret['data']:
+            if 'role' in row:
+                row['role_name'] = ROLE_NAME_MAP.get(row['role'], '游客')
+            for field in ('birthday', 'create_time', 'update_time'):
+                if row.get(field):
+                    row[field] = str(row[field])
+        return ret
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return dict(self.cache.stats(), skipped_writes=self.skipped_writes)
+
+    def diff(self, user: Dict[str, Any], values: Dict[str, Any]) -> Dict[str, Any]:
+        """values 中和 user 当前值不同的字段"""
+        return {k: v for k, v in values.items() if not _same(user.get(k), v)}
+
+    def change_marker(self):
+        """club_user 的变更标记 (行数 + 最大 id + 最大更新时间)，用于缓存快照"""
+        with get_connection(self.DB_NAME) as db:
+            row = db.select_one(self.TABLE, fields='count(*),max(id),max(update_time)', isdict=False)
+        return list(row)
 
     def create_user(
         self,
@@ -117,8 +452,11 @@ class UserService:
         with get_connection(self.DB_NAME) as db:
             db.insert(self.TABLE, data)
             user_id = db.last_insert_id()
+        # 替换不存在的缓存，未指定的字段为表上的默认值
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
+        self.invalidate(openid, dict(self.PROFILE_DEFAULTS, **data, id=user_id, create_time=now, update_time=now))
 
-        log.info(f"创建用户: openid={openid}, user_id={user_id}")
+        log.info("创建用户: openid=%s, user_id=%s", openid, user_id)
         return user_id
 
     def register_user(
@@ -168,6 +506,7 @@ class UserService:
             
             with get_connection(self.DB_NAME) as db:
                 db.update(self.TABLE, values=update_data, where={'id': user_id})
+            self.invalidate(openid)
         else:
             # 创建新用户，直接设置为成员
             user_id = self.create_user(
@@ -181,7 +520,7 @@ class UserService:
         # 使用激活码
         activation_code_service.use_code(activation_code, user_id)
         
-        log.info(f"用户注册成功: openid={openid}, user_id={user_id}, activation_code={activation_code}")
+        log.info("用户注册成功: openid=%s, user_id=%s, activation_code=%s", openid, user_id, activation_code)
         return user_id, ""
 
     def get_or_create_user(self, openid: str, nickname: str = "", avatar: str = "") -> Dict[str, Any]:
@@ -198,15 +537,14 @@ class UserService:
         user = self.get_user_by_openid(openid)
         
         if user:
-            # 如果有新的昵称或头像，更新
+            # 如果有新的昵称或头像，更新 (没有变化时 update_user 不写库)
             update_data = {}
-            if nickname and nickname != user.get('nickname'):
+            if nickname:
                 update_data['nickname'] = nickname
-            if avatar and avatar != user.get('avatar'):
+            if avatar:
                 update_data['avatar'] = avatar
             
-            if update_data:
-                self.update_user(openid, **update_data)
+            if self.update_user(openid, **update_data):
                 user.update(update_data)
             
             return user, False
@@ -227,26 +565,91 @@ class UserService:
             是否更新成功
         """
         # 只允许更新特定字段
-        allowed_fields = {
-            'nickname', 'avatar', 'realname', 'phone_num',
-            'sex', 'birthday', 'address', 'email'
-        }
-        update_data = {k: v for k, v in kwargs.items() if k in allowed_fields and v is not None}
+        update_data = {k: v for k, v in kwargs.items() if k in self.PROFILE_DEFAULTS and v is not None}
 
         if not update_data:
             return False
 
+        # 有失效广播时缓存和库一致，和缓存的当前值比较，只写入变化的字段，都没变化时不写库
+        if bus.enabled:
+            user = self.get_user_by_openid(openid)
+            if user:
+                changed = self.diff(user, update_data)
+                if not changed:
+                    self.skipped_writes += 1
+                    log.debug("用户信息没有变化: openid=%s", openid)
+                    return False
+                update_data = changed
+
+        # 没有广播时缓存可能是其他进程写入前的旧值，由库按当前值判断是否有变化
         with get_connection(self.DB_NAME) as db:
-            affected = db.update(
+            affected = db.update_changed(
                 self.TABLE,
                 values=update_data,
                 where={'openid': openid}
             )
 
         if affected:
-            log.info(f"更新用户信息: openid={openid}, data={update_data}")
+            self.invalidate(openid)
+            log.info("更新用户信息: openid=%s, data=%s", openid, update_data)
+        else:
+            # 库中已经是这些值，本进程缓存的可能是旧值
+            self.cache.pop(openid)
         return affected > 0
 
+    def upsert_profile(
+        self,
+        openid: str,
+        base: Optional[Dict[str, Any]] = None,
+        defaults: Optional[Dict[str, Any]] = None,
+        **fields
+    ) -> Dict[str, Any]:
+        """创建或更新用户资料，一条 insert ... on duplicate key update
+
+        Args:
+            openid: 微信 openid
+            base: 调用方已有的当前用户信息 (例如 AuthContext.user)，None 表示不存在或未知
+            defaults: 只在新建时使用的资料 (例如 session 中的昵称头像)
+            **fields: 要更新的资料字段
+
+        Returns:
+            更新后的用户信息，由 base 合并写入的字段得到，不重新查询
+        """
+        fields = {k: v for k, v in fields.items() if k in self.PROFILE_DEFAULTS and v is not None}
+        if base and bus.enabled:
+            # 只有缓存和库一致时 base 才可信，否则全部字段交给 upsert
+            fields = self.diff(base, fields)
+            if not fields:
+                self.skipped_writes += 1
+                return dict(base)
+
+        values = dict(self.PROFILE_DEFAULTS)
+        values.update({k: v for k, v in (defaults or {}).items() if k in self.PROFILE_DEFAULTS and v})
+        values.update(fields)
+        values.update({'openid': openid, 'role': UserRole.VISITOR, 'state': UserState.NORMAL})
+
+        with get_connection(self.DB_NAME) as db:
+            ret = db.upsert(self.TABLE, values, 'openid', update=list(fields) or ['openid'])
+            user_id = db.last_insert_id() if ret == 1 else None
+
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
+        if ret == 1:
+            user = dict(values, id=user_id, create_time=now, update_time=now)
+            log.info("创建用户: openid=%s, user_id=%s", openid, user_id)
+        elif base:
+            user = dict(base, **fields)
+            if ret:
+                user['update_time'] = now
+                log.info("更新用户信息: openid=%s, data=%s", openid, fields)
+        else:
+            # 调用方不知道已有的行，只能重新读取
+            self.invalidate(openid)
+            return self.get_user_by_openid(openid)
+
+        # 合并得到的行直接写入缓存和搜索索引，不重新查询
+        self.invalidate(openid, user)
+        return dict(user)
+
     def update_user_role(self, openid: str, role: int) -> bool:
         """更新用户角色
         
@@ -268,7 +671,8 @@ class UserService:
             )
 
         if affected:
-            log.info(f"更新用户角色: openid={openid}, role={role}")
+            self.invalidate(openid)
+            log.info("更新用户角色: openid=%s, role=%s", openid, role)
         return affected > 0
 
     def is_admin(self, openid: str) -> bool:
@@ -286,3 +690,5 @@ class UserService:
 
 # 全局单例
 user_service = UserService()
+
+snapshot.register('user', user_service.cache, user_service.change_marker)
@@ -46,13 +46,13 @@ class WechatService:
             "grant_type": "authorization_code"
         }
         
-        log.debug(f"调用微信 code2session: code={code[:10]}...")
+        log.debug("调用微信 code2session: code=%s...", code[:10])
         
         async with httpx.AsyncClient() as client:
             response = await client.get(self.CODE2SESSION_URL, params=params)
             result = response.json()
         
-        log.debug(f"微信 code2session 响应: {result}")
+        log.debug("微信 code2session 响应: %s", result)
         
         # 检查错误
         if "errcode" in result and result["errcode"] != 0:
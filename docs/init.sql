@@ -15,11 +15,13 @@ CREATE TABLE IF NOT EXISTS `user_session` (
     `avatar_url` varchar(512) DEFAULT NULL COMMENT '头像 URL',
     `created_at` int(11) NOT NULL COMMENT '创建时间戳',
     `expire_at` int(11) NOT NULL COMMENT '过期时间戳',
+    `role` smallint NOT NULL DEFAULT '1' COMMENT '用户角色 (club_user.role 冗余)',
+    `state` smallint NOT NULL DEFAULT '1' COMMENT '用户状态 (club_user.state 冗余)',
     `ctime` datetime DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
     `utime` datetime DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
     PRIMARY KEY (`id`),
     UNIQUE KEY `uk_session_id` (`session_id`),
-    KEY `idx_openid` (`openid`),
+    UNIQUE KEY `uk_openid` (`openid`),
     KEY `idx_expire_at` (`expire_at`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='用户会话表';
 
@@ -57,3 +59,15 @@ CREATE TABLE IF NOT EXISTS `club_activation_code` (
     UNIQUE KEY `uk_code` (`code`),
     KEY `idx_user_id` (`user_id`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='激活码表';
+
+-- 缓存失效事件表 (CACHE_BUS=mysql)
+CREATE TABLE IF NOT EXISTS `cache_invalidation` (
+    `id` bigint NOT NULL AUTO_INCREMENT,
+    `tbl` varchar(64) NOT NULL COMMENT '表名',
+    `col` varchar(64) NOT NULL COMMENT '字段',
+    `val` varchar(128) NOT NULL COMMENT '值',
+    `origin` varchar(32) NOT NULL COMMENT '发出事件的进程',
+    `created_at` int(11) NOT NULL COMMENT '创建时间戳',
+    PRIMARY KEY (`id`),
+    KEY `idx_created_at` (`created_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='缓存失效事件表';
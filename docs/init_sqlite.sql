@@ -0,0 +1,88 @@
+-- XClub SQLite 初始化脚本 (DB_ENGINE=sqlite)
+-- 表结构与 init.sql 保持一致，建立连接时自动执行，需保证幂等
+-- 已有库新增字段写在 upgrade_sqlite.sql
+
+PRAGMA foreign_keys = OFF;
+
+-- 用户会话表
+CREATE TABLE IF NOT EXISTS `user_session` (
+    `id` integer NOT NULL PRIMARY KEY AUTOINCREMENT,
+    `session_id` varchar(64) NOT NULL,
+    `openid` varchar(64) NOT NULL,
+    `session_key` varchar(128) NOT NULL,
+    `nickname` varchar(64) DEFAULT NULL,
+    `avatar_url` varchar(512) DEFAULT NULL,
+    `created_at` int NOT NULL,
+    `expire_at` int NOT NULL,
+    `role` smallint NOT NULL DEFAULT '1',
+    `state` smallint NOT NULL DEFAULT '1',
+    `ctime` datetime DEFAULT CURRENT_TIMESTAMP,
+    `utime` datetime DEFAULT CURRENT_TIMESTAMP
+);
+CREATE UNIQUE INDEX IF NOT EXISTS `uk_session_id` ON `user_session` (`session_id`);
+-- SQLite 的索引名在整个库内唯一，索引名带上表名。旧版本的库中 uk_openid 属于 club_user
+-- 或 user_session，idx_openid 是 user_session 之前的普通索引，都删除后按新名称重建
+DROP INDEX IF EXISTS `idx_openid`;
+DROP INDEX IF EXISTS `uk_openid`;
+-- openid 之前不唯一的库，建唯一索引前只保留每个用户最新的 session (索引已存在时不执行)
+DELETE FROM `user_session`
+WHERE NOT EXISTS (SELECT 1 FROM `sqlite_master` WHERE `type` = 'index' AND `name` = 'uk_user_session_openid')
+    AND `id` NOT IN (SELECT max(`id`) FROM `user_session` GROUP BY `openid`);
+CREATE UNIQUE INDEX IF NOT EXISTS `uk_user_session_openid` ON `user_session` (`openid`);
+CREATE INDEX IF NOT EXISTS `idx_expire_at` ON `user_session` (`expire_at`);
+
+CREATE TRIGGER IF NOT EXISTS `trg_user_session_utime` AFTER UPDATE ON `user_session`
+FOR EACH ROW WHEN NEW.`utime` = OLD.`utime`
+BEGIN
+    UPDATE `user_session` SET `utime` = CURRENT_TIMESTAMP WHERE `id` = NEW.`id`;
+END;
+
+-- 俱乐部用户表
+CREATE TABLE IF NOT EXISTS `club_user` (
+    `id` integer NOT NULL PRIMARY KEY AUTOINCREMENT,
+    `openid` varchar(64) NOT NULL,
+    `nickname` varchar(128) NOT NULL DEFAULT '',
+    `avatar` varchar(500) NOT NULL DEFAULT '',
+    `realname` varchar(50) NOT NULL DEFAULT '',
+    `phone_num` varchar(20) NOT NULL DEFAULT '',
+    `sex` smallint DEFAULT '3',
+    `birthday` date DEFAULT NULL,
+    `address` varchar(200) NOT NULL DEFAULT '',
+    `email` varchar(75) DEFAULT '',
+    `role` smallint DEFAULT '1',
+    `state` smallint DEFAULT '1',
+    `create_time` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    `update_time` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE UNIQUE INDEX IF NOT EXISTS `uk_club_user_openid` ON `club_user` (`openid`);
+
+CREATE TRIGGER IF NOT EXISTS `trg_club_user_update_time` AFTER UPDATE ON `club_user`
+FOR EACH ROW WHEN NEW.`update_time` = OLD.`update_time`
+BEGIN
+    UPDATE `club_user` SET `update_time` = CURRENT_TIMESTAMP WHERE `id` = NEW.`id`;
+END;
+
+-- 激活码表
+CREATE TABLE IF NOT EXISTS `club_activation_code` (
+    `id` integer NOT NULL PRIMARY KEY AUTOINCREMENT,
+    `code` varchar(32) NOT NULL,
+    `user_id` bigint DEFAULT NULL,
+    `used_at` datetime DEFAULT NULL,
+    `state` smallint NOT NULL DEFAULT '1',
+    `remark` varchar(200) NOT NULL DEFAULT '',
+    `create_time` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    `update_time` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE UNIQUE INDEX IF NOT EXISTS `uk_code` ON `club_activation_code` (`code`);
+CREATE INDEX IF NOT EXISTS `idx_user_id` ON `club_activation_code` (`user_id`);
+
+-- 缓存失效事件表 (CACHE_BUS=mysql)
+CREATE TABLE IF NOT EXISTS `cache_invalidation` (
+    `id` integer NOT NULL PRIMARY KEY AUTOINCREMENT,
+    `tbl` varchar(64) NOT NULL,
+    `col` varchar(64) NOT NULL,
+    `val` varchar(128) NOT NULL,
+    `origin` varchar(32) NOT NULL,
+    `created_at` int NOT NULL
+);
+CREATE INDEX IF NOT EXISTS `idx_created_at` ON `cache_invalidation` (`created_at`);
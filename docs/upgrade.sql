@@ -0,0 +1,31 @@
+-- XClub 已有数据库的结构变更 (MySQL)，按顺序执行
+-- 新建的库直接使用 init.sql，不需要执行本脚本
+
+USE `xclub`;
+
+-- user_session.openid 改为唯一键，登录时一条 insert ... on duplicate key update 替换旧 session
+-- 先删除同一用户多余的 session，只保留最新的一条
+DELETE s1 FROM `user_session` s1
+    JOIN `user_session` s2 ON s1.`openid` = s2.`openid` AND s1.`id` < s2.`id`;
+ALTER TABLE `user_session`
+    DROP KEY `idx_openid`,
+    ADD UNIQUE KEY `uk_openid` (`openid`);
+
+-- 缓存失效事件表 (CACHE_BUS=mysql)
+CREATE TABLE IF NOT EXISTS `cache_invalidation` (
+    `id` bigint NOT NULL AUTO_INCREMENT,
+    `tbl` varchar(64) NOT NULL COMMENT '表名',
+    `col` varchar(64) NOT NULL COMMENT '字段',
+    `val` varchar(128) NOT NULL COMMENT '值',
+    `origin` varchar(32) NOT NULL COMMENT '发出事件的进程',
+    `created_at` int(11) NOT NULL COMMENT '创建时间戳',
+    PRIMARY KEY (`id`),
+    KEY `idx_created_at` (`created_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='缓存失效事件表';
+
+-- session 冗余用户角色和状态，用于不查用户表的权限判断
+ALTER TABLE `user_session`
+    ADD COLUMN `role` smallint NOT NULL DEFAULT '1' COMMENT '用户角色 (club_user.role 冗余)' AFTER `expire_at`,
+    ADD COLUMN `state` smallint NOT NULL DEFAULT '1' COMMENT '用户状态 (club_user.state 冗余)' AFTER `role`;
+UPDATE `user_session` s JOIN `club_user` u ON u.`openid` = s.`openid`
+    SET s.`role` = u.`role`, s.`state` = u.`state`;
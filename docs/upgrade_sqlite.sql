@@ -0,0 +1,14 @@
+-- XClub 已有 SQLite 数据库的结构变更 (DB_ENGINE=sqlite)，与 upgrade.sql 对应
+-- 建立连接时在 init_sqlite.sql 之前执行，按 PRAGMA user_version 只执行未执行过的版本；
+-- 新建的库直接使用 init_sqlite.sql 并记为最新版本。没有版本号的旧库从第一个版本开始，
+-- 已经存在的字段跳过，其他语句需可重复执行
+-- 新增版本追加在末尾，版本号递增
+
+-- version: 1
+-- session 冗余用户角色和状态，用于不查用户表的权限判断
+ALTER TABLE `user_session` ADD COLUMN `role` smallint NOT NULL DEFAULT '1';
+ALTER TABLE `user_session` ADD COLUMN `state` smallint NOT NULL DEFAULT '1';
+UPDATE `user_session` SET
+    `role` = (SELECT coalesce(u.`role`, 1) FROM `club_user` u WHERE u.`openid` = `user_session`.`openid`),
+    `state` = (SELECT coalesce(u.`state`, 1) FROM `club_user` u WHERE u.`openid` = `user_session`.`openid`)
+WHERE EXISTS (SELECT 1 FROM `club_user` u WHERE u.`openid` = `user_session`.`openid`);
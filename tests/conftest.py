@@ -0,0 +1,30 @@
+# coding: utf-8
+"""pytest 公共配置
+
+在导入 app 之前把数据库切换到临时目录下的 sqlite，测试不依赖 MySQL / Redis
+"""
+
+import os
+import tempfile
+
+import pytest
+
+_tmpdir = tempfile.mkdtemp(prefix='xclub-test-')
+os.environ['DB_ENGINE'] = 'sqlite'
+os.environ['DB_SQLITE_PATH'] = os.path.join(_tmpdir, 'xclub.db')
+os.environ['CACHE_SNAPSHOT_FILE'] = ''
+os.environ['CACHE_BUS'] = ''
+os.environ['DB_CAPTURE_FILE'] = ''
+
+from tests.resp_server import RESPServer  # noqa: E402
+
+
+@pytest.fixture
+def resp_server():
+    """进程内的 Redis 协议服务"""
+    server = RESPServer()
+    server.start()
+    try:
+        yield server
+    finally:
+        server.stop()
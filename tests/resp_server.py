@@ -0,0 +1,112 @@
+# coding: utf-8
+"""测试用的进程内 Redis 协议 (RESP2) 服务
+
+只实现 RedisClient 和 RedisSessionStore 用到的命令:
+PING AUTH SELECT GET SET(EX) DEL MGET EXPIRE TTL EXISTS SCAN(MATCH)
+"""
+
+import fnmatch
+import socketserver
+import threading
+import time
+
+
+def _bulk(value):
+    if value is None:
+        return b'$-1\r\n'
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        assert line[:1] == b'*', line
+        args = []
+        for _ in range(int(line[1:-2])):
+            n = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(n + 2)[:-2])
+        return args
+
+    def handle(self):
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            self.wfile.write(self.server.owner.dispatch(args))
+
+
+class RESPServer:
+    """监听 127.0.0.1 的随机端口，数据保存在字典中，支持过期时间"""
+
+    def __init__(self):
+        self.data = {}      # key -> (value, 过期时间 或 None)
+        self.lock = threading.Lock()
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _Handler)
+        self.server.daemon_threads = True
+        self.server.owner = self
+        self.port = self.server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _get(self, key):
+        item = self.data.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= time.time():
+            del self.data[key]
+            return None
+        return item[0]
+
+    def dispatch(self, args):
+        cmd = args[0].upper().decode()
+        with self.lock:
+            if cmd in ('PING', 'AUTH', 'SELECT'):
+                return b'+OK\r\n' if cmd != 'PING' else b'+PONG\r\n'
+            if cmd == 'GET':
+                return _bulk(self._get(args[1]))
+            if cmd == 'MGET':
+                return b'*%d\r\n' % (len(args) - 1) + b''.join(_bulk(self._get(k)) for k in args[1:])
+            if cmd == 'SET':
+                expire_at = None
+                if len(args) >= 5 and args[3].upper() == b'EX':
+                    expire_at = time.time() + int(args[4])
+                self.data[args[1]] = (args[2], expire_at)
+                return b'+OK\r\n'
+            if cmd in ('DEL', 'EXISTS'):
+                n = 0
+                for k in args[1:]:
+                    if self._get(k) is not None:
+                        n += 1
+                        if cmd == 'DEL':
+                            del self.data[k]
+                return b':%d\r\n' % n
+            if cmd == 'EXPIRE':
+                value = self._get(args[1])
+                if value is None:
+                    return b':0\r\n'
+                self.data[args[1]] = (value, time.time() + int(args[2]))
+                return b':1\r\n'
+            if cmd == 'TTL':
+                if self._get(args[1]) is None:
+                    return b':-2\r\n'
+                expire_at = self.data[args[1]][1]
+                return b':%d\r\n' % (-1 if expire_at is None else int(expire_at - time.time() + 0.5))
+            if cmd == 'SCAN':
+                pattern = b'*'
+                if b'MATCH' in [x.upper() for x in args]:
+                    pattern = args[[x.upper() for x in args].index(b'MATCH') + 1]
+                keys = [k for k in list(self.data) if self._get(k) is not None
+                        and fnmatch.fnmatchcase(k.decode(), pattern.decode())]
+                return b'*2\r\n' + _bulk(b'0') + b'*%d\r\n' % len(keys) + b''.join(_bulk(k) for k in keys)
+        return b'-ERR unknown command ' + cmd.encode() + b'\r\n'
+
+    def keys(self):
+        with self.lock:
+            return sorted(k.decode() for k in list(self.data) if self._get(k) is not None)
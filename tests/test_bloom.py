@@ -0,0 +1,61 @@
+# coding: utf-8
+"""计数布隆过滤器和 session_id 预检"""
+
+import time
+
+import app.main  # noqa: F401  安装连接池
+from app.core.bloom import CountingBloomFilter
+from app.core.security import generate_session_id, verify_session_id
+from app.services.session import session_service
+
+
+def test_counting_remove():
+    bloom = CountingBloomFilter(capacity=1000, error_rate=0.01)
+    keys = ['k%d' % i for i in range(500)]
+    bloom.update(keys)
+    assert len(bloom) == 500
+    assert all(k in bloom for k in keys)
+
+    # 同一个 key 添加两次，删除一次之后仍然存在
+    bloom.add('k0')
+    assert bloom.remove('k0') and 'k0' in bloom
+    assert bloom.remove('k0') and 'k0' not in bloom
+    assert all(k in bloom for k in keys[1:])
+
+    assert not bloom.remove('absent')
+    assert len(bloom) == 499
+
+
+def test_saturated_counter_is_kept():
+    bloom = CountingBloomFilter(capacity=1)
+    for _ in range(300):
+        bloom.add('a')
+    for _ in range(300):
+        bloom.remove('a')
+    assert 'a' in bloom
+
+
+def test_session_id_tag():
+    key = b'k' * 32
+    sid = generate_session_id(key)
+    assert len(sid) == 50 and verify_session_id(sid, key)
+    assert not verify_session_id(sid, b'x' * 32)
+    assert not verify_session_id(sid[:-1] + ('A' if sid[-1] != 'A' else 'B'), key)
+    assert not verify_session_id(generate_session_id(), key)
+
+
+def test_maybe_exists_rejects_forged_time_prefix(monkeypatch):
+    key = b'k' * 32
+    monkeypatch.setattr(session_service, 'id_key', key)
+    monkeypatch.setattr(session_service, 'bloom', CountingBloomFilter(capacity=100))
+    monkeypatch.setattr(session_service, 'bloom_built_at', int(time.time()) - 10)
+
+    known = generate_session_id(key)
+    session_service.bloom.add(known)
+    assert session_service.maybe_exists(known)
+    # 过滤器构建之后其他进程创建的，标签正确时放行
+    assert session_service.maybe_exists(generate_session_id(key))
+    # 时间前缀有效但没有标签 / 标签错误的拒绝
+    assert not session_service.maybe_exists(generate_session_id())
+    assert not session_service.maybe_exists(generate_session_id(b'x' * 32))
+    assert not session_service.maybe_exists('bad id')
@@ -0,0 +1,83 @@
+# coding: utf-8
+"""缓存失效广播的传输往返"""
+
+import json
+import time
+
+import app.main  # noqa: F401  安装连接池
+from app.core.bus import InvalidationBus, MySQLTransport, Transport, UDPMulticastTransport, \
+    UnixSocketTransport, create_transport, ORIGIN
+
+
+def wait_for(items, n, timeout=3):
+    deadline = time.time() + timeout
+    while len(items) < n and time.time() < deadline:
+        time.sleep(0.01)
+    return items
+
+
+def test_bus_dispatch_and_origin():
+    bus = InvalidationBus()
+    got = []
+    bus.subscribe('club_user', lambda c, v: got.append((c, v)))
+    assert not bus.enabled
+
+    bus.on_message({'o': 'other', 't': 'club_user', 'c': 'openid', 'v': 'o1'})
+    bus.on_message(json.dumps({'o': 'other', 't': 'user_session', 'c': 'openid', 'v': 'o1'}))
+    # 自己发出的事件不处理
+    bus.on_message({'o': ORIGIN, 't': 'club_user', 'c': 'openid', 'v': 'o2'})
+    assert got == [('openid', 'o1')]
+    assert bus.received == 2
+
+
+def test_mysql_transport_round_trip():
+    sender = MySQLTransport(interval=0.02)
+    receiver = MySQLTransport(interval=0.02)
+    got = []
+    receiver.start(got.append)
+    try:
+        sender.send({'o': 'w1', 't': 'club_user', 'c': 'openid', 'v': 'o1'})
+        sender.send({'o': 'w1', 't': 'club_user', 'c': 'openid', 'v': 'o2'})
+        # 发送只入队，flush 时一条语句写入
+        assert len(sender.pending) == 2
+        assert sender.flush() == 2 and sender.pending == []
+        wait_for(got, 2)
+    finally:
+        receiver.stop()
+    assert [x['v'] for x in got] == ['o1', 'o2']
+    assert got[0] == {'o': 'w1', 't': 'club_user', 'c': 'openid', 'v': 'o1'}
+
+
+def test_unix_transport_round_trip(tmp_path):
+    a = UnixSocketTransport(str(tmp_path))
+    b = UnixSocketTransport(str(tmp_path))
+    # 同一进程内的两个实例使用不同的 socket 文件
+    b.path = str(tmp_path / 'peer.sock')
+    got_a, got_b = [], []
+    a.start(got_a.append)
+    b.start(got_b.append)
+    try:
+        a.send({'o': 'a', 't': 'club_user', 'c': 'openid', 'v': 'o1'})
+        wait_for(got_b, 1)
+    finally:
+        a.stop()
+        b.stop()
+    assert [json.loads(x)['v'] for x in got_b] == ['o1']
+    assert got_a == []
+
+
+def test_udp_signature():
+    a = UDPMulticastTransport(secret='s1')
+    b = UDPMulticastTransport(secret='s2')
+    payload = b'{"o":"x"}'
+    assert a.verify(a.tag(payload) + payload) == payload
+    assert b.verify(a.tag(payload) + payload) is None
+    assert a.verify(payload) is None
+
+
+def test_create_transport():
+    # udp 没有密钥时不广播
+    assert type(create_transport('udp')) is Transport
+    assert isinstance(create_transport('udp', secret='s'), UDPMulticastTransport)
+    assert isinstance(create_transport('mysql'), MySQLTransport)
+    assert type(create_transport('')) is Transport
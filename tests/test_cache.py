@@ -0,0 +1,59 @@
+# coding: utf-8
+"""LRUCache 和用户缓存的 generation 保护"""
+
+import app.main  # noqa: F401  安装连接池
+from app.core.cache import LRUCache, MISSING
+from app.services.user import user_service
+
+
+def test_lru_eviction_and_ttl():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b', MISSING) is MISSING
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+    cache.set('d', 4, ttl=-1)
+    assert cache.get('d', MISSING) is MISSING
+    assert cache.stats()['expirations'] == 1
+
+
+def test_lru_index():
+    cache = LRUCache(index=lambda x: x['openid'])
+    cache.set('s1', {'openid': 'o1'})
+    cache.set('s2', {'openid': 'o1'})
+    cache.set('s3', {'openid': 'o2'})
+    assert len(cache.get_by_index('o1')) == 2
+    assert len(cache.pop_by_index('o1')) == 2
+    assert cache.get('s1') is None and cache.get('s3') == {'openid': 'o2'}
+    assert cache.get_by_index('o1') == []
+
+
+def test_generation_guard_drops_stale_rows():
+    openid = 'cache-gen-1'
+    user_service.create_user(openid, 'old', '')
+    row = user_service.get_user_by_openid(openid)
+
+    # 查询期间发生了失效，查到的旧行不能写回缓存
+    gen = user_service.generation
+    user_service.update_user(openid, nickname='new')
+    assert user_service.prime(openid, dict(row), gen)['nickname'] == 'old'
+    assert user_service.get_user_by_openid(openid)['nickname'] == 'new'
+
+    # 没有失效时写入缓存
+    gen = user_service.generation
+    user_service.cache.pop(openid)
+    user_service.prime(openid, dict(row, nickname='primed'), gen)
+    assert user_service.cache.get(openid)['nickname'] == 'primed'
+    user_service.invalidate(openid)
+
+
+def test_create_clears_negative_entry():
+    openid = 'cache-missing-1'
+    assert user_service.get_user_by_openid(openid) is None
+    assert user_service.cache.get(openid, MISSING) is None
+    user_service.create_user(openid, 'x', '')
+    assert user_service.get_user_by_openid(openid)['nickname'] == 'x'
@@ -0,0 +1,175 @@
+# coding: utf-8
+"""dbpool 构造方法在 sqlite 引擎上的返回值，MySQL 批量执行的重连"""
+
+import pymysql
+import pytest
+
+import app.main  # noqa: F401  安装连接池
+from app.db import dbpool
+from app.db.dbpool import get_connection
+
+TABLE = 't_kv'
+
+
+@pytest.fixture
+def db():
+    with get_connection('xclub') as conn:
+        conn.execute('create table if not exists %s ('
+                     'id integer primary key autoincrement, k varchar(32) not null unique, v varchar(32))' % TABLE)
+        conn.execute('delete from %s' % TABLE)
+        yield conn
+
+
+def test_upsert_returns_insert_then_update(db):
+    assert db.upsert(TABLE, {'k': 'a', 'v': '1'}, 'k') == 1
+    assert db.upsert(TABLE, {'k': 'a', 'v': '2'}, 'k') == 2
+    assert db.select(TABLE, fields='k,v') == [{'k': 'a', 'v': '2'}]
+
+    # 本连接最近一次插入的就是这一行，冲突更新仍然返回 2
+    db.insert(TABLE, {'k': 'b', 'v': '1'})
+    assert db.upsert(TABLE, {'k': 'b', 'v': '2'}, 'k') == 2
+    assert db.upsert(TABLE, {'k': 'c', 'v': '1'}, 'k') == 1
+    assert db.last_insert_id() == db.select_one(TABLE, where={'k': 'c'}, fields='id')['id']
+
+
+def test_upsert_is_one_statement(db):
+    sqls = []
+    hook = lambda conn, sql, *args: sqls.append(sql)  # noqa: E731
+    db.insert(TABLE, {'k': 'a', 'v': '1'})
+    dbpool.add_query_hook(hook)
+    try:
+        assert db.upsert(TABLE, {'k': 'a', 'v': '2'}, 'k') == 2
+        assert db.upsert(TABLE, {'k': 'b', 'v': '2'}, 'k') == 1
+    finally:
+        dbpool.remove_query_hook(hook)
+    assert len(sqls) == 2
+
+
+def test_pipeline_results(db):
+    p = db.pipeline()
+    p.insert(TABLE, {'k': 'a', 'v': '1'})
+    p.insert(TABLE, {'k': 'b', 'v': '1'})
+    p.update(TABLE, {'v': '2'}, where={'v': '1'})
+    p.select(TABLE, fields='k,v', other='order by k')
+    assert len(p) == 4
+    ret = p.execute()
+    assert len(p) == 0
+    assert [x.affected for x in ret[:3]] == [1, 1, 2]
+    assert ret[1].lastrowid == ret[0].lastrowid + 1
+    assert ret[0].rows is None
+    assert ret[3].rows == [{'k': 'a', 'v': '2'}, {'k': 'b', 'v': '2'}]
+    assert db.pipeline().execute() == []
+
+
+def test_update_changed_counts_changed_rows(db):
+    db.insert(TABLE, {'k': 'a', 'v': None})
+    assert db.update_changed(TABLE, {'v': None}, where={'k': 'a'}) == 0
+    assert db.update_changed(TABLE, {'v': '1'}, where={'k': 'a'}) == 1
+    assert db.update_changed(TABLE, {'v': '1'}, where={'k': 'a'}) == 0
+    assert db.update_changed(TABLE, {'v': None}, where={'k': 'a'}) == 1
+
+
+def test_delete_limit(db):
+    db.insert_list(TABLE, [{'k': str(i), 'v': 'x'} for i in range(5)])
+    assert db.delete(TABLE, where={'v': 'x'}, other='limit 2') == 2
+    assert db.select_one(TABLE, fields='count(*) as n')['n'] == 3
+
+
+# ---- MySQL 批量执行的重连 (没有 MySQL 服务，用假连接模拟断开) ----
+
+class FakeCursor:
+    description = None
+    rowcount = 1
+    lastrowid = 0
+
+    def __init__(self, server):
+        self.server = server
+
+    def execute(self, sql):
+        self.server.calls += 1
+        error = self.server.errors.pop(self.server.calls, None)
+        if error:
+            if error.args[0] == dbpool.CR_SERVER_GONE_ERROR:
+                raise error
+            # 断开发生在语句到达服务端之后
+            self.server.executed.append(sql)
+            raise error
+        self.server.executed.append(sql)
+        return 1
+
+    def nextset(self):
+        return None
+
+    def close(self):
+        pass
+
+
+class FakeServer:
+    """记录到达服务端的语句，errors 为 {第几次发送: 异常}"""
+    def __init__(self, errors):
+        self.errors = errors
+        self.calls = 0
+        self.executed = []
+        self.connects = 0
+
+
+class FakeMySQLConnection(dbpool.PyMySQLConnection):
+    def __init__(self, server, multi_statements=False):
+        self.server = server
+        dbpool.PyMySQLConnection.__init__(
+            self, {'engine': 'pymysql', 'name': 'fake', 'multi_statements': multi_statements}, 0, 0)
+        self.pool = type('Pool', (), {'dbconn_idle': [], 'dbconn_using': [], 'max_conn': 1})
+
+    def connect(self):
+        self.server.connects += 1
+        self.conn = self
+
+    def cursor(self):
+        return FakeCursor(self.server)
+
+    def close(self):
+        self.conn = None
+
+
+def mysql_error(code):
+    return pymysql.err.OperationalError(code, 'lost')
+
+
+SQLS = ["insert into t values (1)", "insert into t values (2)", "delete from t where id=3"]
+
+
+@pytest.mark.parametrize('multi', [False, True])
+def test_mysql_multi_not_replayed_after_lost_connection(multi):
+    # 第一条 (或整批) 已经执行后连接断开: 不重放，异常抛出
+    server = FakeServer({1: mysql_error(2013)} if multi else {2: mysql_error(2013)})
+    conn = FakeMySQLConnection(server, multi)
+    with pytest.raises(pymysql.err.OperationalError) as e:
+        conn.execute_multi(SQLS)
+    assert e.value.args[0] == 2013
+    assert server.connects == 1
+    assert server.executed == ([';'.join(SQLS)] if multi else SQLS[:2])
+
+    # 第二条发送时才发现断开，第一条已经执行，也不重放
+    server = FakeServer({2: mysql_error(dbpool.CR_SERVER_GONE_ERROR)})
+    conn = FakeMySQLConnection(server)
+    with pytest.raises(pymysql.err.OperationalError):
+        conn.execute_multi(SQLS)
+    assert server.executed == SQLS[:1] and server.connects == 1
+
+
+@pytest.mark.parametrize('multi', [False, True])
+def test_mysql_multi_retried_when_nothing_sent(multi):
+    server = FakeServer({1: mysql_error(dbpool.CR_SERVER_GONE_ERROR)})
+    conn = FakeMySQLConnection(server, multi)
+    ret = conn.execute_multi(SQLS)
+    assert server.connects == 2
+    assert server.executed == ([';'.join(SQLS)] if multi else SQLS)
+    assert len(ret) == (1 if multi else 3)
+
+    # 事务中不重连
+    server = FakeServer({1: mysql_error(dbpool.CR_SERVER_GONE_ERROR)})
+    conn = FakeMySQLConnection(server, multi)
+    conn.trans = 1
+    with pytest.raises(pymysql.err.OperationalError):
+        conn.execute_multi(SQLS)
+    assert server.executed == [] and server.connects == 1
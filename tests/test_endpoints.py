@@ -0,0 +1,136 @@
+# coding: utf-8
+"""用户和管理接口 (TestClient + sqlite)"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.core.response import ErrorCode
+from app.schemas.user import UserRole
+from app.services.session import session_service
+from app.services.user import user_service
+
+
+@pytest.fixture(scope='module')
+def client():
+    with TestClient(app) as c:
+        yield c
+
+
+@pytest.fixture(scope='module')
+def users(client):
+    # 等启动时的后台索引建立完成，之后的写入直接更新索引
+    if user_service._search_thread:
+        user_service._search_thread.join()
+    admin_id = user_service.create_user('ep-admin', '管理员', '', role=UserRole.ADMIN)
+    member_id = user_service.create_user('ep-member', '令狐冲', '', role=UserRole.MEMBER,
+                                         realname='令狐冲', phone_num='13700137000')
+    visitor_id = user_service.create_user('ep-visitor', '游客甲', '')
+    return {
+        'admin': (admin_id, {'X-Session-Id': session_service.create_session('ep-admin', 'k', role=UserRole.ADMIN)}),
+        'member': (member_id, {'X-Session-Id': session_service.create_session('ep-member', 'k', role=UserRole.MEMBER)}),
+        'visitor': (visitor_id, {'X-Session-Id': session_service.create_session('ep-visitor', 'k')}),
+    }
+
+
+def get(client, url, headers):
+    r = client.get(url, headers=headers)
+    assert r.status_code == 200
+    return r.json()
+
+
+def test_user_batch_by_ids(client, users):
+    admin_id, admin = users['admin']
+    member_id, _ = users['member']
+    ret = get(client, '/xclub/v1/user?ids=%d,999999,%d,%d' % (member_id, admin_id, member_id), admin)
+    assert ret['code'] == 0
+    # 按请求顺序去重，不存在的忽略
+    assert [x['id'] for x in ret['data']['data']] == [member_id, admin_id]
+
+    ret = get(client, '/xclub/v1/user/%d' % member_id, admin)
+    assert ret['data']['nickname'] == '令狐冲'
+    assert get(client, '/xclub/v1/user/999999', admin)['code'] == ErrorCode.USER_NOT_FOUND
+
+
+def test_user_list(client, users):
+    _, admin = users['admin']
+    ret = get(client, '/xclub/v1/user?role=%d&fields=id,openid' % UserRole.MEMBER, admin)
+    assert ret['code'] == 0
+    rows = ret['data']['data']
+    assert 'ep-member' in [x['openid'] for x in rows]
+    assert all(set(x) == {'id', 'openid'} for x in rows)
+
+    _, member = users['member']
+    assert get(client, '/xclub/v1/user', member)['code'] == ErrorCode.FORBIDDEN
+
+
+def test_user_search(client, users):
+    _, admin = users['admin']
+    _, member = users['member']
+    _, visitor = users['visitor']
+
+    ret = get(client, '/xclub/v1/user/search?q=1370013', admin)
+    assert [x['openid'] for x in ret['data']] == ['ep-member']
+    assert ret['data'][0]['phone_num'] == '13700137000'
+
+    # 成员不能按手机号搜索，结果不带手机号
+    assert get(client, '/xclub/v1/user/search?q=1370013', member)['data'] == []
+    ret = get(client, '/xclub/v1/user/search?q=令狐', member)
+    assert [x['openid'] for x in ret['data']] == ['ep-member']
+    assert 'phone_num' not in ret['data'][0]
+
+    assert get(client, '/xclub/v1/user/search?q=令狐', visitor)['code'] == ErrorCode.FORBIDDEN
+
+
+def test_sql_stats(client, users):
+    _, admin = users['admin']
+    ret = get(client, '/xclub/v1/admin/sql-stats?top=5&order=count', admin)
+    assert ret['code'] == 0
+    items = ret['data']['items']
+    assert 0 < len(items) <= 5
+    assert items == sorted(items, key=lambda x: x['count'], reverse=True)
+    assert {'sql', 'count', 'total_ms', 'p99_ms'} <= set(items[0])
+
+    _, member = users['member']
+    assert get(client, '/xclub/v1/admin/sql-stats', member)['code'] == ErrorCode.FORBIDDEN
+
+
+def test_cache_stats(client, users):
+    _, admin = users['admin']
+    ret = get(client, '/xclub/v1/admin/cache-stats', admin)
+    assert ret['code'] == 0
+    names = [x['name'] for x in ret['data']]
+    assert {'user', 'session_bloom', 'user_search'} <= set(names)
+    user = ret['data'][names.index('user')]
+    assert 'skipped_writes' in user and 'hit_rate' in user
+
+
+def test_update_role_refreshes_session(client, users):
+    _, admin = users['admin']
+    visitor_id, visitor = users['visitor']
+
+    r = client.put('/xclub/v1/user/%d/role' % visitor_id, headers=visitor, json={'role': UserRole.ADMIN})
+    assert r.json()['code'] == ErrorCode.FORBIDDEN
+
+    r = client.put('/xclub/v1/user/%d/role' % visitor_id, headers=admin, json={'role': UserRole.MEMBER})
+    assert r.json()['code'] == 0
+    assert user_service.get_user_by_id(visitor_id)['role'] == UserRole.MEMBER
+    # session 中冗余的角色同步更新，不需要重新登录即可访问成员接口
+    assert session_service.get_session(visitor['X-Session-Id']).role == UserRole.MEMBER
+    assert get(client, '/xclub/v1/user/search?q=令狐', visitor)['code'] == 0
+
+    r = client.put('/xclub/v1/user/999999/role', headers=admin, json={'role': UserRole.MEMBER})
+    assert r.json()['code'] == ErrorCode.USER_NOT_FOUND
+
+
+def test_update_profile_is_one_query(client, users):
+    _, member = users['member']
+    # 第一次请求读取 session 和用户并缓存
+    assert get(client, '/xclub/v1/user/info', member)['code'] == 0
+
+    r = client.put('/xclub/v1/user/info', headers=member, json={'address': '华山'})
+    assert r.json()['code'] == 0
+    assert r.json()['data']['address'] == '华山'
+    # 一条 upsert，不重新查询
+    assert r.headers['X-DB-Queries'] == '1'
+    assert user_service.get_user_by_openid('ep-member')['address'] == '华山'
@@ -0,0 +1,58 @@
+# coding: utf-8
+"""日志队列的入队处理"""
+
+import logging
+import queue
+import sys
+import threading
+
+from app.core.logger import NonBlockingQueueHandler, LOG_FORMAT
+
+
+def make_record(msg, args, exc_info=None):
+    return logging.LogRecord('t', logging.ERROR, __file__, 1, msg, args, exc_info)
+
+
+def test_prepare_formats_message_and_exception():
+    handler = NonBlockingQueueHandler(queue.Queue())
+    data = {'n': 1}
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        record = make_record('data=%s|n=%d', (data, 2), sys.exc_info())
+    handler.handle(record)
+    queued = handler.queue.get_nowait()
+
+    # 入队之后修改参数不影响已经记录的消息
+    data['n'] = 2
+    assert queued.msg == "data={'n': 1}|n=2" and queued.args is None
+    assert queued.exc_info is None and 'ValueError: boom' in queued.exc_text
+    # 原记录不修改，其他 handler 仍能使用
+    assert record.args == (data, 2) and record.exc_info is not None
+
+    text = logging.Formatter(LOG_FORMAT).format(queued)
+    assert "data={'n': 2}" not in text
+    assert text.endswith('ValueError: boom') and 'Traceback' in text
+
+
+def test_message_with_percent_and_no_args():
+    handler = NonBlockingQueueHandler(queue.Queue())
+    handler.handle(make_record('100%% done %s', ('ok',)))
+    handler.handle(make_record('rate 50%', None))
+    assert [x.getMessage() for x in list(handler.queue.queue)] == ['100% done ok', 'rate 50%']
+
+
+def test_full_queue_drops_without_blocking():
+    handler = NonBlockingQueueHandler(queue.Queue(2))
+    done = threading.Event()
+
+    def emit():
+        for i in range(5):
+            handler.handle(make_record('m%d', (i,)))
+        done.set()
+
+    t = threading.Thread(target=emit, daemon=True)
+    t.start()
+    assert done.wait(1)
+    assert handler.dropped == 3
+    assert [x.msg for x in list(handler.queue.queue)] == ['m0', 'm1']
@@ -0,0 +1,92 @@
+# coding: utf-8
+"""dbpool 日志离线分析"""
+
+import gzip
+import json
+
+from app.db import logstat
+
+PREFIX = '2026-01-01 10:%02d:%02d,123 - app.db.dbpool - INFO - '
+
+
+def query_line(sec, sql, usetime=1000, w=1, idle=1, using=1, maxconn=2, err='', minute=0):
+    return PREFIX % (minute, sec) + (
+        'server=pymysql|id=1|name=xclub|user=u|r=m|addr=db1:3306|db=x|c=%d,%d,%d|tr=0|time=%d|ret=0|n=1|w=%g|'
+        'sql=%r|err=%s\n' % (idle, using, maxconn, usetime, w, sql, err))
+
+
+def connect_line(sec, minute=0):
+    return PREFIX % (minute, sec) + (
+        'server=pymysql|func=connect|id=2|name=xclub|user=u|role=m|addr=db1:3306|db=x\n')
+
+
+def run(tmp_path, lines, *args, gz=False):
+    filename = str(tmp_path / ('app.log.gz' if gz else 'app.log'))
+    opener = gzip.open if gz else open
+    with opener(filename, 'wt', encoding='utf-8') as f:
+        f.writelines(lines)
+    stat = logstat.LogStat(*args)
+    f = logstat.open_log(filename)
+    for line in f:
+        stat.feed(line)
+    f.close()
+    stat.finish()
+    return stat.report()
+
+
+def test_weighted_aggregation(tmp_path):
+    lines = [
+        # 采样率 0.1 输出的一行代表 10 条
+        query_line(0, "select * from user where openid='a'", 1000, w=10),
+        query_line(1, "select * from user where openid='b'", 3000),
+        query_line(2, "update user set name='x' where id=1", 5000, err='gone'),
+    ]
+    r = run(tmp_path, lines, gz=True)
+    assert r['lines'] == 3 and r['queries'] == 12 and r['errors'] == 1
+    assert r['start'] == '2026-01-01 10:00:00' and r['end'] == '2026-01-01 10:00:02'
+    top = r['fingerprints'][0]
+    assert top['sql'] == 'select * from user where openid=?'
+    assert top['count'] == 11 and top['total_ms'] == 13.0 and top['max_ms'] == 3.0
+    update = r['fingerprints'][1]
+    assert update['count'] == 1 and update['error_rate'] == 1
+
+
+def test_malformed_lines_are_skipped(tmp_path):
+    lines = [
+        'random text\n',
+        '\n',
+        PREFIX % (0, 0) + 'server=pymysql|id=1|time=abc|sql=\'select 1\'|err=\n',
+        PREFIX % (0, 1) + 'server=pymysql|id=1|time=10|no sql field\n',
+        'bad time - server=pymysql|c=x,y|time=10|n=1|sql=\'select 2\'|err=\n',
+        query_line(2, 'select 3'),
+    ]
+    r = run(tmp_path, lines)
+    assert r['lines'] == 6 and r['queries'] == 2
+    # 没有时间的行仍然计数，只是不参与连接池区间统计
+    assert [(x['sql'], x['count']) for x in r['fingerprints']] == [('select ?', 2)]
+    assert r['saturation']['windows'] == 0
+
+
+def test_saturation_and_storms(tmp_path):
+    lines = [
+        query_line(0, 'select 1', idle=1),
+        query_line(1, 'select 1', idle=0, using=2, w=5),
+        query_line(4, 'select 1', idle=0, using=2),
+        query_line(5, 'select 1', idle=1),
+    ]
+    lines += [connect_line(i, minute=1) for i in range(3)]
+    lines.append(connect_line(0, minute=2))
+    r = run(tmp_path, lines, 20, 2000, 3)
+    assert r['saturation']['windows'] == 1 and r['saturation']['seconds'] == 3
+    assert r['saturation']['top'][0]['queries'] == 6
+    assert r['connects'] == 4
+    assert r['storms'] == [{'addr': 'xclub@db1:3306/m', 'minute': '2026-01-01 10:01:00', 'connects': 3}]
+
+
+def test_main_json(tmp_path, capsys):
+    filename = str(tmp_path / 'app.log')
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.writelines([query_line(0, 'select 1'), query_line(1, 'select 2', w=4)])
+    logstat.main(['--json', '-n', '1', filename])
+    r = json.loads(capsys.readouterr().out)
+    assert r['queries'] == 5 and len(r['fingerprints']) == 1
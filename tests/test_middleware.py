@@ -0,0 +1,67 @@
+# coding: utf-8
+"""请求级 sql 计数中间件"""
+
+import logging
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.core.middleware import DBQueryCounterMiddleware, current_db_stats, db_query_hook
+
+
+class FakeConn:
+    def __init__(self, multi_statements=False):
+        self.multi_statements = multi_statements
+
+
+def make_client(queries, budget=4, debug=True):
+    """每个请求按 queries 调用 query_hook: [(连接, sql 或 sql 列表), ...]"""
+    def endpoint(request):
+        for conn, sql in queries:
+            db_query_hook(conn, sql, 1000, 1, 0, '')
+        stats = current_db_stats()
+        return JSONResponse({'queries': stats.queries, 'round_trips': stats.round_trips})
+
+    app = Starlette(routes=[Route('/t', endpoint)])
+    app.add_middleware(DBQueryCounterMiddleware, budget=budget, debug=debug)
+    return TestClient(app)
+
+
+def test_hook_outside_request_is_ignored():
+    db_query_hook(FakeConn(), 'select 1', 10, 1, 0, '')
+    assert current_db_stats() is None
+
+
+def test_round_trips():
+    queries = [
+        (FakeConn(), 'select 1'),
+        # 没有 multi_statements 时逐条发送
+        (FakeConn(), ['select 1', 'select 2', 'select 3']),
+        # multi_statements 一次发送
+        (FakeConn(multi_statements=True), ['select 1', 'select 2']),
+    ]
+    r = make_client(queries).get('/t')
+    assert r.json() == {'queries': 6, 'round_trips': 5}
+    assert r.headers['X-DB-Queries'] == '6'
+    assert r.headers['Server-Timing'] == 'db;dur=3.000;desc="6 queries, 5 round trips"'
+
+
+def test_headers_only_in_debug():
+    r = make_client([(FakeConn(), 'select 1')], debug=False).get('/t')
+    assert r.json() == {'queries': 1, 'round_trips': 1}
+    assert 'X-DB-Queries' not in r.headers and 'Server-Timing' not in r.headers
+
+
+def test_budget_warning(caplog):
+    client = make_client([(FakeConn(), ['select 1', 'select 2', 'select 3'])], budget=2)
+    with caplog.at_level(logging.WARNING, logger='app.core.middleware'):
+        client.get('/t')
+    assert any('func=db_budget' in x.message and 'queries=3|round_trips=3' in x.message for x in caplog.records)
+
+    caplog.clear()
+    client = make_client([(FakeConn(), 'select 1')], budget=2)
+    with caplog.at_level(logging.WARNING, logger='app.core.middleware'):
+        client.get('/t')
+    assert not [x for x in caplog.records if 'func=db_budget' in x.message]
@@ -0,0 +1,85 @@
+# coding: utf-8
+"""sql 采集和回放 (sqlite)"""
+
+import json
+
+import pytest
+
+from app.db import dbpool
+from app.db.replay import QueryCapture, read_capture, replay, to_sqlite
+
+SCHEMA = 'create table if not exists kv (k varchar(32) primary key, v varchar(32));\n'
+
+
+def make_pool(tmp_path, name):
+    init = tmp_path / 'init.sql'
+    init.write_text(SCHEMA, encoding='utf-8')
+    return dbpool.DBPool({'name': name, 'engine': 'sqlite', 'db': str(tmp_path / (name + '.db')),
+                          'conn': 2, 'init_sql': str(init), 'multi_statements': True})
+
+
+@pytest.mark.parametrize('sql, expected', [
+    ("insert into kv (k,v) values ('a','1') on duplicate key update v=values(v), k = VALUES(`k`)",
+     "insert into kv (k,v) values ('a','1') on conflict do update set v=excluded.v, k = excluded.`k`"),
+    ("delete from kv where v='1' limit 100",
+     "delete from kv where rowid in (select rowid from kv where v='1' limit 100)"),
+    ("delete from kv where v='1' order by k limit 5",
+     "delete from kv where rowid in (select rowid from kv where v='1' order by k limit 5)"),
+    ('START TRANSACTION', 'begin'),
+    ("select get_lock('x', 0)", None),
+    ("select release_lock('x')", None),
+    ('show tables', None),
+    ('desc kv', None),
+    ('set names utf8mb4', None),
+    ("select * from kv where k='show'", "select * from kv where k='show'"),
+    (['begin', "select get_lock('x', 0)", 'commit'], ['begin', 'commit']),
+    (["select get_lock('x', 0)"], None),
+])
+def test_to_sqlite(sql, expected):
+    assert to_sqlite(sql) == expected
+
+
+def test_capture_and_replay(tmp_path):
+    src = make_pool(tmp_path, 'src')
+    filename = str(tmp_path / 'capture.jsonl')
+    capture = QueryCapture(filename)
+    dbpool.add_query_hook(capture.hook)
+    try:
+        db = src.acquire()
+        db.execute("insert into kv (k,v) values ('a','1')")
+        db.execute("insert into kv (k,v) values ('b','1')")
+        db.execute_multi(["update kv set v='2' where k='a'", "select * from kv"])
+        db.query("select * from kv where k='a'")
+        src.release(db)
+    finally:
+        dbpool.remove_query_hook(capture.hook)
+        capture.close()
+
+    # hook 是全局的，只保留本连接池的语句 (其他测试启动的后台线程也可能执行 sql)
+    with open(filename, encoding='utf-8') as f:
+        items = [x for x in map(json.loads, f) if x['name'] == 'src']
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.writelines(json.dumps(x) + '\n' for x in items)
+
+    assert [x['fp'] for x in items] == [
+        'insert into kv (k,v) values (?+)', 'insert into kv (k,v) values (?+)',
+        'update kv set v=? where k=?;select * from kv', 'select * from kv where k=?']
+    assert items[2]['sql'] == ["update kv set v='2' where k='a'", 'select * from kv']
+    assert [x['t'] for x in read_capture(filename)] == sorted(x['t'] for x in items)
+    assert [x['sql'] for x in read_capture(filename, readonly=True)] == [
+        "select * from kv where k='a'"]
+
+    dst = make_pool(tmp_path, 'dst')
+    # 加一条需要改写和一条需要跳过的语句
+    with open(filename, 'a', encoding='utf-8') as f:
+        t = items[-1]['t'] + 0.001
+        for sql in ("insert into kv (k,v) values ('b','3') on duplicate key update v=values(v)",
+                    "select get_lock('x', 0)"):
+            f.write(json.dumps({'t': t, 'fp': '', 'sql': sql, 'us': 1, 'name': 'src'}) + '\n')
+    result = replay(dst, filename, speed=100, concurrency=1, translate=to_sqlite)
+    r = result.report()
+    assert r['queries'] == 5 and r['errors'] == 0
+    assert r['skipped'] == 1 and r['rewritten'] == 1
+    db = dst.acquire()
+    assert db.query('select k, v from kv order by k') == [{'k': 'a', 'v': '2'}, {'k': 'b', 'v': '3'}]
+    dst.release(db)
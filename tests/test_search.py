@@ -0,0 +1,68 @@
+# coding: utf-8
+"""n-gram 搜索索引"""
+
+import app.main  # noqa: F401  安装连接池
+from app.core.search import NGramIndex
+from app.services.user import user_service
+
+
+def make_index():
+    index = NGramIndex(['nickname', 'phone_num'], sort_key=lambda x: -x['id'])
+    index.add('o1', {'id': 1, 'nickname': '张三丰', 'phone_num': '13800138000'})
+    index.add('o2', {'id': 2, 'nickname': '小张三', 'phone_num': '13900139000'})
+    index.add('o3', {'id': 3, 'nickname': '张三', 'phone_num': ''})
+    index.add('o4', {'id': 4, 'nickname': 'ＡＢＣ abc', 'phone_num': ''})
+    return index
+
+
+def test_prefix_matches_rank_first():
+    index = make_index()
+    # 前缀匹配在前，同一级别内按 sort_key (新的在前)
+    assert [x['id'] for x in index.search('张三')] == [3, 1, 2]
+    assert [x['id'] for x in index.search('张三', limit=2)] == [3, 1]
+    # 都不是前缀匹配
+    assert [x['id'] for x in index.search('三')] == [3, 2, 1]
+
+
+def test_substring_and_fields():
+    index = make_index()
+    assert [x['id'] for x in index.search('8001')] == [1]
+    assert index.search('8001', fields=['nickname']) == []
+    # 全角和大小写归一
+    assert [x['id'] for x in index.search('abc')] == [4]
+    assert [x['id'] for x in index.search('Ｂc a')] == [4]
+    # 字符都在但不连续
+    assert index.search('张丰') == []
+    assert [x['id'] for x in index.search('张', where=lambda x: x['id'] > 1)] == [3, 2]
+
+
+def test_update_and_remove():
+    index = make_index()
+    assert index.update('o3', {'nickname': '李四'})
+    assert not index.update('absent', {'nickname': 'x'})
+    assert [x['id'] for x in index.search('张三')] == [1, 2]
+    assert [x['id'] for x in index.search('李')] == [3]
+    index.remove('o3')
+    assert index.search('李') == [] and len(index) == 3
+    assert '李四' not in str(index.postings)
+
+
+def test_user_index_follows_writes():
+    user_service.build_search_index()
+    user_service.search_enabled = True
+    try:
+        # 新建时用写入的完整行建索引，不查库
+        user_service.create_user('search-1', '欧阳锋', '')
+        assert [x['openid'] for x in user_service.search_users('欧阳')] == ['search-1']
+
+        # 部分字段的修改排队，由后台一次读取
+        user_service.update_user('search-1', realname='西毒')
+        user_service.update_user_role('search-1', 2)
+        user_service.reindex_pending()
+        users = user_service.search_users('西毒')
+        assert [x['openid'] for x in users] == ['search-1']
+        # 索引的是完整的行，不只是写入的字段
+        assert users[0]['nickname'] == '欧阳锋' and users[0]['role'] == 2 and users[0]['role_name']
+        assert user_service.search_users('欧阳', state=2) == []
+    finally:
+        user_service.search_enabled = False
@@ -0,0 +1,128 @@
+# coding: utf-8
+"""过期 session 的分批清理和滑动过期的合并写入 (sqlite 和内存存储)"""
+
+import subprocess
+import sys
+import time
+
+import pytest
+
+import app.main  # noqa: F401  安装连接池
+from app.db import dbpool, get_connection
+from app.services.session import session_service
+from app.services.session_store import MemorySessionStore, MySQLSessionStore
+
+
+def make_session(session_id, openid, ttl=3600):
+    now = int(time.time())
+    return {
+        'session_id': session_id, 'openid': openid, 'session_key': 'key', 'nickname': None, 'avatar_url': None,
+        'created_at': now, 'expire_at': now + ttl, 'role': 1, 'state': 1,
+    }
+
+
+@pytest.fixture
+def sqls():
+    """记录执行的 sql"""
+    ret = []
+    hook = lambda conn, sql, *args: ret.append(sql)  # noqa: E731
+    dbpool.add_query_hook(hook)
+    yield ret
+    dbpool.remove_query_hook(hook)
+
+
+@pytest.fixture
+def sqlite_store():
+    with get_connection('xclub') as db:
+        db.execute('delete from user_session')
+    return MySQLSessionStore()
+
+
+@pytest.fixture(params=['sqlite', 'memory'])
+def store(request):
+    if request.param == 'memory':
+        return MemorySessionStore()
+    return request.getfixturevalue('sqlite_store')
+
+
+def test_cleanup_expired_in_chunks(store, sqls):
+    for i in range(7):
+        store.create(make_session('old%d' % i, 'o%d' % i, ttl=-10))
+    store.create(make_session('live1', 'l1'))
+    store.create(make_session('live2', 'l2'))
+    del sqls[:]
+
+    assert store.cleanup_expired(int(time.time()), chunk=3, pause=0) == 7
+    assert sorted(store.session_ids(0)) == ['live1', 'live2']
+    assert store.cleanup_expired(int(time.time()), chunk=3, pause=0) == 0
+    if store.name == 'mysql':
+        # 每批最多删除 3 条: 3 + 3 + 1
+        deletes = [x for x in sqls if x.lower().startswith('delete')]
+        assert len(deletes) == 4 and all('limit 3' in x for x in deletes[:3])
+
+
+def test_cleanup_single_runner(sqlite_store):
+    sqlite_store.create(make_session('old', 'o1', ttl=-10))
+    with get_connection('xclub') as db:
+        path = db.param['db']
+    # fcntl 锁按进程持有，在另一个进程中拿住清理锁
+    script = (
+        'import sys, time\n'
+        'from app.db.dbpool import SQLiteConnection\n'
+        'conn = SQLiteConnection({"name": "x", "engine": "sqlite", "db": sys.argv[1]}, 0, 0)\n'
+        'assert conn.get_lock(sys.argv[2])\n'
+        'print("locked", flush=True)\n'
+        'sys.stdin.read()\n'
+    )
+    proc = subprocess.Popen([sys.executable, '-c', script, path, sqlite_store.REAPER_LOCK],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        assert proc.stdout.readline().strip() == 'locked'
+        assert sqlite_store.cleanup_expired(int(time.time()), chunk=10) == 0
+        assert sqlite_store.get('old') is not None
+    finally:
+        proc.stdin.close()
+        proc.wait(10)
+    # 锁随进程退出释放
+    assert sqlite_store.cleanup_expired(int(time.time()), chunk=10) == 1
+
+
+def test_get_session_keeps_expired_rows(sqls):
+    token = session_service.create_session('reaper-1', 'k')
+    # 缓存中的 session 过期
+    session_service.get_session(token).expire_at = int(time.time()) - 1
+    del sqls[:]
+    assert session_service.get_session(token) is None
+    # 缓存已移除，从存储读到过期的行
+    session_service.store.update(token, {'expire_at': int(time.time()) - 1})
+    assert session_service.get_session(token) is None
+    assert session_service.store.get(token) is not None
+    assert not [x for x in sqls if 'delete' in str(x).lower()]
+
+
+def test_touches_flush_as_one_update(monkeypatch, sqls):
+    monkeypatch.setattr(session_service, 'touch_interval', 60)
+    tokens = [session_service.create_session('toucher-%d' % i, 'k') for i in range(5)]
+    sessions = [session_service.get_session(x) for x in tokens]
+    for session in sessions:
+        session.expire_at = int(time.time()) + 10
+        session_service.touch(session)
+        # 同一个间隔内再次使用不重复记入
+        session_service.touch(session)
+
+    del sqls[:]
+    assert session_service.flush_touches() == 5
+    assert len(sqls) == 1
+    sql = sqls[0][0] if isinstance(sqls[0], list) else sqls[0]
+    assert sql.startswith('update `user_session` set `expire_at`=') and '`session_id` in (' in sql
+    expire_at = {session_service.store.get(x)['expire_at'] for x in tokens}
+    assert len(expire_at) == 1 and expire_at.pop() > int(time.time()) + 60
+    assert session_service.flush_touches() == 0
+
+
+def test_store_touch(store):
+    store.create(make_session('s1', 'o1', ttl=10))
+    store.create(make_session('s2', 'o2', ttl=10))
+    expire_at = int(time.time()) + 7200
+    assert store.touch(['s1', 's2', 'missing'], expire_at) == 2
+    assert store.get('s1')['expire_at'] == store.get('s2')['expire_at'] == expire_at
@@ -0,0 +1,94 @@
+# coding: utf-8
+"""RedisSessionStore / RESP 客户端测试 (进程内 RESP 服务)"""
+
+import time
+
+import pytest
+
+from app.db.resp import RedisClient, RedisError
+from app.services.session_store import RedisSessionStore
+
+
+def make_session(session_id, openid, ttl=3600, **kwargs):
+    now = int(time.time())
+    session = {
+        'session_id': session_id,
+        'openid': openid,
+        'session_key': 'key',
+        'nickname': 'nick',
+        'avatar_url': '',
+        'created_at': now,
+        'expire_at': now + ttl,
+        'role': 1,
+        'state': 1,
+    }
+    session.update(kwargs)
+    return session
+
+
+@pytest.fixture
+def store(resp_server):
+    client = RedisClient(port=resp_server.port)
+    yield RedisSessionStore(client, prefix='t:')
+    client.close()
+
+
+def test_client_pipeline(resp_server):
+    client = RedisClient(port=resp_server.port, db=1, password='x')
+    assert client.set('a', 'x', ex=10) == 'OK'
+    assert client.pipeline([('GET', 'a'), ('MGET', 'a', 'b'), ('DEL', 'a')]) == [b'x', [b'x', None], 1]
+    with pytest.raises(RedisError):
+        client.execute('NOPE')
+    client.close()
+
+
+def test_create_and_get(store, resp_server):
+    assert store.create(make_session('s1', 'o1')) is True
+    assert store.get('s1')['openid'] == 'o1'
+    # 重新登录替换旧 session
+    assert store.create(make_session('s2', 'o1')) is False
+    assert store.get('s1') is None
+    assert store.get('s2')['session_id'] == 's2'
+    assert resp_server.keys() == ['t:session:s2', 't:session_openid:o1']
+
+
+def test_delete_removes_openid_index(store, resp_server):
+    store.create(make_session('s1', 'o1'))
+    assert store.delete('s1') is True
+    assert resp_server.keys() == []
+    assert store.delete('s1') is False
+    assert store.delete_by_openid('o1') is False
+    # 下次登录不需要清理残留的索引
+    assert store.create(make_session('s2', 'o1')) is True
+
+
+def test_delete_by_openid(store, resp_server):
+    store.create(make_session('s1', 'o1'))
+    store.create(make_session('s3', 'o2'))
+    assert store.delete_by_openid('o1') is True
+    assert store.get('s1') is None
+    assert resp_server.keys() == ['t:session:s3', 't:session_openid:o2']
+
+
+def test_touch(store, resp_server):
+    store.create(make_session('s1', 'o1', ttl=60))
+    expire_at = int(time.time()) + 7200
+    assert store.touch(['s1', 'missing'], expire_at) == 1
+    assert store.get('s1')['expire_at'] == expire_at
+    assert resp_server.dispatch([b'TTL', b't:session_openid:o1']) in (b':7199\r\n', b':7200\r\n')
+
+
+def test_update_by_openid(store):
+    store.create(make_session('s1', 'o1'))
+    assert store.update_by_openid('o1', {'role': 3, 'state': 2}) is True
+    row = store.get('s1')
+    assert (row['role'], row['state']) == (3, 2)
+    assert store.update_by_openid('nobody', {'role': 3}) is False
+    assert store.update('s1', {'nickname': 'x'}) is True
+    assert store.get('s1')['nickname'] == 'x'
+
+
+def test_session_ids(store):
+    store.create(make_session('s1', 'o1'))
+    store.create(make_session('s2', 'o2'))
+    assert sorted(store.session_ids(int(time.time()))) == ['s1', 's2']
@@ -0,0 +1,66 @@
+# coding: utf-8
+"""分片连接池的路由和跨分片查询 (每个分片一个 sqlite 文件)"""
+
+import zlib
+
+import pytest
+
+import app.main  # noqa: F401  安装连接池
+from app.db import dbpool
+from app.db.dbpool import ShardedDBPool, get_connection_for, scatter, gather_query, shard_count
+
+
+def make_pool(tmp_path, n, **kwargs):
+    shards = [{'engine': 'sqlite', 'db': str(tmp_path / ('s%d.db' % i)), 'conn': 2} for i in range(n)]
+    return ShardedDBPool(dict(kwargs, name='shard_test', shards=shards))
+
+
+@pytest.fixture
+def hashed(tmp_path, monkeypatch):
+    pool = make_pool(tmp_path, 3)
+    monkeypatch.setitem(dbpool.dbpool, 'shard_test', pool)
+    return pool
+
+
+def test_hash_route(hashed):
+    keys = ['openid-%d' % i for i in range(30)]
+    for key in keys:
+        assert hashed.route(key) == zlib.crc32(key.encode('utf-8')) % 3
+    # 同一个键总是同一个分片，数字和字符串形式一致
+    assert hashed.route(123) == hashed.route('123')
+    assert len({hashed.route(x) for x in keys}) == 3
+    assert shard_count('shard_test') == 3
+
+
+def test_range_route(tmp_path):
+    pool = make_pool(tmp_path, 3, shard_policy='range', shard_ranges=[1000, 2000])
+    assert [pool.route(x) for x in (0, 999, 1000, 1999, 2000, 10 ** 9)] == [0, 0, 1, 1, 2, 2]
+    for bad in ('openid-1', '1000', 1.5, None, True):
+        with pytest.raises(TypeError):
+            pool.route(bad)
+
+    with pytest.raises(ValueError):
+        make_pool(tmp_path, 3, shard_policy='range', shard_ranges=[1000])
+
+
+def test_route_writes_and_scatter(hashed):
+    scatter('shard_test', lambda db: db.execute('create table if not exists t (k varchar(32) primary key)'))
+    keys = ['openid-%d' % i for i in range(20)]
+    for key in keys:
+        with get_connection_for('shard_test', key) as db:
+            assert db.shard == hashed.route(key)
+            db.insert('t', {'k': key})
+
+    # 按分片顺序返回，每个分片只有路由到它的键
+    counts = scatter('shard_test', lambda db: db.select_one('t', fields='count(*) as n')['n'])
+    assert counts == [sum(1 for x in keys if hashed.route(x) == i) for i in range(3)]
+    rows = gather_query('shard_test', 'select k from t')
+    assert sorted(x['k'] for x in rows) == sorted(keys)
+    assert hashed.size() == [x.size() for x in hashed.shards]
+
+
+def test_scatter_unsharded_pool():
+    # 未分片的连接池只执行一次，acquire_for 忽略分片键
+    assert scatter('xclub', lambda db: db.query('select 1 as x')) == [[{'x': 1}]]
+    with get_connection_for('xclub', 'any') as db:
+        assert db.query('select 2 as x') == [{'x': 2}]
@@ -0,0 +1,87 @@
+# coding: utf-8
+"""共享内存表的读写和 seqlock"""
+
+import threading
+import time
+
+import pytest
+
+from app.core.shm import ShmTable, _SEQ, _hash
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'session.shm')
+
+
+def test_set_get_delete(path):
+    table = ShmTable(path, slots=64, slot_size=128)
+    expire = time.time() + 60
+    assert table.set('a', b'1', expire)
+    assert table.get('a') == b'1'
+    assert table.set('a', b'2', expire)
+    assert table.get('a') == b'2'
+    assert table.delete('a') and table.get('a') is None
+    assert not table.delete('a')
+
+    assert table.set('old', b'x', time.time() - 1)
+    assert table.get('old') is None
+    assert not table.set('big', b'x' * 200, expire)
+    table.close()
+
+
+def test_shared_between_instances(path):
+    a = ShmTable(path, slots=64, slot_size=128)
+    b = ShmTable(path, slots=64, slot_size=128)
+    a.set('k', b'v', time.time() + 60)
+    assert b.get('k') == b'v'
+    b.delete('k')
+    assert a.get('k') is None
+
+    # 参数变化时清空重建
+    c = ShmTable(path, slots=128, slot_size=128)
+    assert c.get('k') is None
+    for x in (a, b, c):
+        x.close()
+
+
+def test_odd_sequence_is_not_read(path):
+    table = ShmTable(path, slots=4, slot_size=128, ways=4)
+    table.set('k', b'v', time.time() + 60)
+    off = next(x for x in table._offsets(_hash(b'k')) if table._read(x, _hash(b'k'), b'k'))
+    seq = _SEQ.unpack_from(table.mm, off)[0]
+
+    # 写入中 (奇数序号) 的槽读不到，写完后恢复
+    _SEQ.pack_into(table.mm, off, seq | 1)
+    assert table.get('k') is None
+    _SEQ.pack_into(table.mm, off, (seq | 1) + 1)
+    assert table.get('k') == b'v'
+    table.close()
+
+
+def test_concurrent_reads_are_consistent(path):
+    writer = ShmTable(path, slots=16, slot_size=256)
+    reader = ShmTable(path, slots=16, slot_size=256)
+    expire = time.time() + 60
+    values = [bytes([i]) * (50 + i) for i in range(10)]
+    writer.set('k', values[0], expire)
+
+    stop = threading.Event()
+
+    def write():
+        i = 0
+        while not stop.is_set():
+            writer.set('k', values[i % len(values)], expire)
+            i += 1
+
+    t = threading.Thread(target=write)
+    t.start()
+    try:
+        for _ in range(20000):
+            v = reader.get('k')
+            assert v is None or v in values
+    finally:
+        stop.set()
+        t.join()
+    writer.close()
+    reader.close()
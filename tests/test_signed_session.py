@@ -0,0 +1,117 @@
+# coding: utf-8
+"""签名 session token 和吊销过滤"""
+
+import time
+
+import pytest
+
+import app.main  # noqa: F401  安装连接池
+from app.config import settings
+from app.core.security import sign_token, verify_token, _b64encode
+from app.db import get_connection
+from app.services.session import RevocationFilter, session_service
+
+SECRET = 'test-secret'
+
+
+@pytest.fixture
+def signed(monkeypatch):
+    """切换到签名模式，使用新的吊销过滤"""
+    monkeypatch.setattr(settings, 'SESSION_SECRET', SECRET)
+    monkeypatch.setattr(session_service, 'signed', True)
+    monkeypatch.setattr(session_service, 'revocation', RevocationFilter(session_service.live_session_ids))
+    return session_service
+
+
+def login(service, openid, **kwargs):
+    token = service.create_session(openid, 'k', **kwargs)
+    # iat 为毫秒，保证两次签发的时刻不同
+    time.sleep(0.002)
+    return token
+
+
+def test_sign_and_verify():
+    claims = {'sid': 's1', 'oid': 'o1', 'iat': 1, 'exp': 2}
+    token = sign_token(claims, SECRET)
+    assert verify_token(token, SECRET) == claims
+    assert verify_token(token, 'other') is None
+
+    payload, _, sig = token.partition('.')
+    forged = _b64encode(b'{"sid":"s1","oid":"o2","iat":1,"exp":2}')
+    assert verify_token(forged + '.' + sig, SECRET) is None
+    assert verify_token(payload + '.' + sig[:-2] + ('AA' if sig[-2:] != 'AA' else 'BB'), SECRET) is None
+    for bad in ('', '.', payload, payload + '.', '.' + sig, 'x.y', payload + '.!!'):
+        assert verify_token(bad, SECRET) is None
+    # 签名正确但不是对象
+    assert verify_token(sign_token([1, 2], SECRET), SECRET) is None
+
+
+def test_expired_and_malformed_claims(signed):
+    now = int(time.time())
+    token = sign_token({'sid': 's1', 'oid': 'o1', 'iat': now * 1000, 'exp': now - 1}, SECRET)
+    assert signed.get_session(token) is None
+    token = sign_token({'sid': 's1', 'iat': now * 1000, 'exp': now + 60}, SECRET)
+    assert signed.get_session(token) is None
+    token = sign_token({'sid': 's1', 'oid': 'o1', 'iat': now * 1000, 'exp': now + 60, 'role': 2}, SECRET)
+    assert signed.get_session(token).role == 2
+
+
+def test_logout_and_relogin_revoke(signed):
+    first = login(signed, 'signed-1', role=2)
+    session = signed.get_session(first)
+    assert session.openid == 'signed-1' and session.role == 2
+
+    # 重新登录吊销之前签发的
+    second = login(signed, 'signed-1', role=2)
+    assert signed.get_session(first) is None
+    assert signed.get_session(second) is not None
+
+    # 退出登录
+    signed.delete_session_by_openid('signed-1')
+    assert signed.get_session(second) is None
+    assert signed.get_session(login(signed, 'signed-1')) is not None
+
+
+def test_update_claims_revokes(signed):
+    token = login(signed, 'signed-2', role=1)
+    assert signed.update_claims('signed-2', role=2)
+    # token 中的角色无法修改，需要重新登录
+    assert signed.get_session(token) is None
+    assert signed.get_session(login(signed, 'signed-2', role=2)).role == 2
+
+
+def test_refresh_detects_rows_deleted_elsewhere(signed):
+    token = login(signed, 'signed-3')
+    sid = signed.get_session(token).session_id
+    other = login(signed, 'signed-4')
+
+    # 其他进程删除了 session 行，本进程没有收到广播
+    with get_connection('xclub') as db:
+        db.delete('user_session', where={'session_id': sid})
+    assert signed.get_session(token) is not None
+    signed.revocation.refresh()
+    assert signed.get_session(token) is None
+    assert signed.get_session(other) is not None
+
+    # 最近一次加载之后签发的不按存储判断
+    late = login(signed, 'signed-5')
+    with get_connection('xclub') as db:
+        db.delete('user_session', where={'openid': 'signed-5'})
+    assert signed.get_session(late) is not None
+
+
+def test_revoke_openid_keeps_latest_cutoff():
+    f = RevocationFilter(lambda: [])
+    exp = int(time.time()) + 60
+    f.revoke_openid('o1', 2000, exp)
+    # 乱序到达的较早吊销不覆盖
+    f.revoke_openid('o1', 1000, exp)
+    assert f.is_revoked({'sid': 'a', 'oid': 'o1', 'iat': 1500})
+    assert not f.is_revoked({'sid': 'a', 'oid': 'o1', 'iat': 2001})
+    f.revoke('a', exp)
+    assert f.is_revoked({'sid': 'a', 'oid': 'o1', 'iat': 2001})
+
+    # 过期的吊销记录在刷新时清理
+    f.revoke('b', int(time.time()) - 1)
+    f.refresh()
+    assert 'b' not in f.revoked_sids and 'a' in f.revoked_sids
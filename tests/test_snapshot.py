@@ -0,0 +1,96 @@
+# coding: utf-8
+"""缓存快照的保存和恢复"""
+
+import os
+import stat
+import time
+
+import pytest
+
+from app.core import snapshot
+from app.core.cache import LRUCache
+from app.services.session import SessionData, _restore_session, _snapshot_session
+
+
+@pytest.fixture
+def sections(monkeypatch):
+    """只保留测试登记的 section"""
+    monkeypatch.setattr(snapshot, '_sections', {})
+    return snapshot._sections
+
+
+@pytest.fixture
+def filename(tmp_path):
+    return str(tmp_path / 'cache.snap')
+
+
+def test_round_trip(sections, filename):
+    marker = ['v1']
+    src = LRUCache(ttl=60)
+    src.set('a', {'id': 1, 'name': '张三'})
+    src.set('b', None, ttl=30)
+    src.set('old', {'id': 2}, ttl=-1)
+    snapshot.register('t', src, lambda: marker)
+    assert snapshot.save(filename) == 2
+    assert stat.S_IMODE(os.stat(filename).st_mode) == 0o600
+
+    dst = LRUCache(ttl=60)
+    snapshot.register('t', dst, lambda: marker)
+    assert snapshot.load(filename) == 2
+    assert dst.get('a') == {'id': 1, 'name': '张三'}
+    assert 'b' in [x[0] for x in dst.items()]
+    # 剩余过期时间保留
+    expire = {k: e for k, e, _ in dst.items()}
+    assert expire['b'] - time.time() <= 30
+
+
+def test_marker_mismatch_skips_section(sections, filename):
+    src = LRUCache()
+    src.set('a', 1)
+    snapshot.register('t', src, lambda: {'count': 1})
+    snapshot.register('u', src, lambda: None)
+    snapshot.save(filename)
+
+    dst = LRUCache()
+    snapshot.register('t', dst, lambda: {'count': 2})
+    assert snapshot.load(filename) == 0 and len(dst) == 0
+    # 不支持快照 (标记为 None) 的 section 不写入
+    with open(filename, 'rb') as f:
+        assert snapshot._HEADER.unpack(f.read(snapshot._HEADER.size))[2] == 1
+
+
+def test_bad_header_and_truncated_file(sections, filename):
+    cache = LRUCache()
+    cache.set('a', 1)
+    snapshot.register('t', cache, lambda: 1)
+    snapshot.save(filename)
+    with open(filename, 'rb') as f:
+        data = f.read()
+
+    with open(filename, 'wb') as f:
+        f.write(b'XCSNAQ' + data[6:])
+    assert snapshot.load(filename) == 0
+
+    # 截断的文件不抛出异常
+    with open(filename, 'wb') as f:
+        f.write(data[:-3])
+    assert snapshot.load(filename) == 0
+
+    assert snapshot.load(filename + '.missing') == 0
+
+
+def test_session_key_not_saved(sections, filename):
+    session = SessionData(session_id='s1', openid='o1', session_key='SECRET-KEY',
+                          created_at=int(time.time()), expire_at=int(time.time()) + 60)
+    src = LRUCache()
+    src.set('s1', session)
+    snapshot.register('session', src, lambda: 1, encode=_snapshot_session, decode=_restore_session)
+    snapshot.save(filename)
+    with open(filename, 'rb') as f:
+        assert b'SECRET-KEY' not in f.read()
+
+    dst = LRUCache()
+    snapshot.register('session', dst, lambda: 1, encode=_snapshot_session, decode=_restore_session)
+    assert snapshot.load(filename) == 1
+    restored = dst.get('s1')
+    assert restored.openid == 'o1' and restored.session_key == ''
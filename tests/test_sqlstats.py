@@ -0,0 +1,60 @@
+# coding: utf-8
+"""sql 指纹和耗时直方图"""
+
+from app.db.sqlstats import fingerprint, Histogram, SQLStat
+
+
+def test_fingerprint_literals():
+    assert fingerprint("SELECT *  FROM t\n WHERE a='x' and b=12 and c=-1.5e3") == \
+        'select * from t where a=? and b=? and c=?'
+    assert fingerprint("select * from t where a='it''s' or a=\"q\\\"\"") == 'select * from t where a=? or a=?'
+    # 标识符中的数字不替换
+    assert fingerprint('select t1.c2 from `t3` where `x4`=4') == 'select t1.c2 from `t3` where `x4`=?'
+
+
+def test_fingerprint_null_and_booleans():
+    base = fingerprint("insert into t(a,b) values ('x','y')")
+    assert base == 'insert into t(a,b) values (?+)'
+    assert fingerprint("insert into t(a,b) values (NULL,'y')") == base
+    assert fingerprint("insert into t(a,b) values ('x',null)") == base
+    assert fingerprint("insert into t(a,b) values (true,DEFAULT)") == base
+    assert fingerprint('update t set a=null where b=false') == fingerprint('update t set a=1 where b=2')
+    # 带 null 的标识符不替换
+    assert fingerprint('select `null`, nullable from t') == 'select `null`, nullable from t'
+
+
+def test_fingerprint_collapse_lists():
+    assert fingerprint('select * from t where id in (1, 2,3)') == fingerprint('select * from t where id in (4)')
+    assert fingerprint("insert into t values (1,'a'),(2,NULL),(3,'c')") == 'insert into t values (?+)'
+    assert fingerprint(['select 1', "select 'a'"]) == 'select ?;select ?'
+
+
+def test_histogram_percentile():
+    h = Histogram()
+    assert h.percentile(99) == 0
+    for _ in range(90):
+        h.add(100)
+    for _ in range(10):
+        h.add(10000)
+    # 分位返回所在桶的上界，误差在一个桶 (2^0.25) 以内
+    assert 100 <= h.percentile(50) < 100 * 2 ** 0.25
+    assert h.percentile(90) == h.percentile(50)
+    assert 10000 <= h.percentile(91) < 10000 * 2 ** 0.25
+    assert h.percentile(100) == h.percentile(91)
+
+    # 权重和合并
+    w = Histogram()
+    w.add(10000, weight=90)
+    w.merge(h)
+    assert w.count == 190
+    assert 10000 <= w.percentile(50) < 10000 * 2 ** 0.25
+
+
+def test_sqlstat_weight():
+    stat = SQLStat()
+    stat.add(1000, 2, '', weight=10)
+    stat.add(3000, 0, 'err')
+    d = stat.todict()
+    assert d['count'] == 11 and d['errors'] == 1 and d['rows'] == 20
+    assert d['total_ms'] == 13.0 and d['max_ms'] == 3.0
+    assert d['p99_ms'] == 3.0